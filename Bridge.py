@@ -0,0 +1,237 @@
+import argparse
+import json
+import sys
+import time
+from typing import Literal
+
+from ConfigWatcher import validate_config
+from FdxCodec import encode_read_registers_batch_response, list_to_bytes_struct_direct
+from FdxDispatcher import FdxCommandDispatcher
+from LogUtils import get_logger, setup_logging, stop_logging
+from ModbusClient import SerialModbusRTUClient
+from VectorFDX import VectorFDX
+
+logger = get_logger(__name__)
+
+# 无界面的CANoe FDX与Modbus RTU/SCPI桥接，供测试脚本启动:
+# 不导入PyQt5；pymodbus在打开串口时、pyvisa在打开SCPI仪器时、http.server在配置了metrics_http_port时才导入，
+# 启动耗时见ImportBenchmark.py
+
+
+class HeadlessFdx(VectorFDX):
+    """接收线程中直接把DataExchange命令交给桥接处理，代替QVectorFDX的Qt信号"""
+    def __init__(self, bridge, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.bridge = bridge
+
+    def handle_status_command(self, command_data: bytes, addr: str, byteorder: Literal["little", "big"]):
+        result = super().handle_status_command(command_data, addr, byteorder)
+        logger.info("CANoe status: %s", result)
+        return result
+
+    def handle_data_exchange_command(self, command_data: bytes, addr: str, byteorder: Literal["little", "big"]):
+        result = super().handle_data_exchange_command(command_data, addr, byteorder)
+        self.bridge.handle_fdx_command(result, byteorder)
+        return result
+
+
+class HeadlessModbusRTUClient(SerialModbusRTUClient):
+    """总线线程中直接把读取结果交给桥接发送到FDX，代替QSerialModbusRTUClient的Qt信号"""
+    def __init__(self, bridge, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.bridge = bridge
+
+    def handler_read_holding_registers_response(self, slave, response):
+        super().handler_read_holding_registers_response(slave, response)
+        self.bridge.modbus_registers_to_fdx(slave, response.registers)
+
+    def handler_read_holding_registers_batch_response(self, batch_id, results):
+        self.bridge.modbus_batch_registers_to_fdx(batch_id, results)
+
+
+class FdxModbusBridge(FdxCommandDispatcher):
+    """按config.json桥接FDX命令数据组与Modbus从站/SCPI仪器，命令分发与图形界面共用FdxCommandDispatcher
+
+    FDX接收线程、Modbus总线线程和SCPI仪器线程都会发送FDX数据，VectorFDX的发送缓冲由fdx_send_lock保护；
+    serial_port为None时不创建Modbus客户端，也不导入pymodbus
+    """
+    def __init__(self, config: dict, serial_port: str = None, protocol: Literal["UDP", "TCP"] = 'UDP',
+                 local_ip='127.0.0.1', local_port: int = 2000, target_ip='127.0.0.1', target_port: int = 2001):
+        fdx = HeadlessFdx(self, UDP_Or_TCP=protocol, fdx_byte_order='big', local_ip=local_ip,
+                          local_port=local_port, target_ip=target_ip, target_port=target_port)
+        super().__init__(fdx, config)
+        thread_scheduling = config.get("thread_scheduling") or {}
+        self.fdx.receive_thread_scheduling = thread_scheduling.get('fdx_receive')
+
+        if serial_port is not None:
+            self.modbus_client = HeadlessModbusRTUClient(self, port=serial_port,
+                                                         serial_baud_rate=config.get("serial_baud_rate", 115200),
+                                                         serial_bytesize=config.get("serial_bytesize", 8),
+                                                         serial_parity=config.get("serial_parity", "N"),
+                                                         serial_stop_bits=config.get("serial_stop_bits", 1),
+                                                         serial_timeout=config.get("serial_timeout", 1),
+                                                         serial_retries=config.get("serial_retries", 0))
+            self.modbus_client.slaves_list = {int(k): v for k, v in config.get("slaves_list", {}).items()}
+            self.modbus_client.cycle_read_slaves_list = config.get("cycle_read_slaves_list", [])
+            self.modbus_client.bus_thread_scheduling = thread_scheduling.get('modbus_bus')
+
+        self.metrics_server = None
+
+    def start(self, cycle_read: bool = True):
+        """打开FDX socket、串口和SCPI仪器并请求命令数据组，返回串口是否连接成功(未配置串口时为True)"""
+        is_connected = True
+        if self.modbus_client is not None:
+            is_connected = self.modbus_client.create_modbus_rtu_service()
+            if is_connected:
+                logger.info("Modbus %s connected", self.modbus_client.port)
+                if cycle_read:
+                    self.modbus_client.start_cycle_read__loop()
+            else:
+                logger.error("Modbus %s connect failed", self.modbus_client.port)
+        if self.scpi_instruments_config:
+            self.start_scpi_pollers()
+        if self.config.get("metrics_http_port"):
+            self.start_metrics_server(self.config["metrics_http_port"])
+        self.fdx.start_receiving()
+        self.request_fdx_groups_transmission()
+        return is_connected
+
+    def stop(self):
+        if self.fdx.socket is not None:
+            self.cancel_fdx_groups_transmission()
+        self.fdx.close_socket()
+        if self.scpi_manager is not None:
+            self.scpi_manager.stop()
+        if self.modbus_client is not None:
+            self.modbus_client.stop_cycle_read__loop()
+            self.modbus_client.modbus_rtu_service_close()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+
+    def start_metrics_server(self, port: int):
+        from MetricsServer import MetricsServer, fdx_metrics, modbus_metrics
+        self.metrics_server = MetricsServer(port=port)
+        self.metrics_server.add_collector(lambda: fdx_metrics(self.fdx))
+        if self.modbus_client is not None:
+            self.metrics_server.add_collector(lambda: modbus_metrics(self.modbus_client))
+        self.metrics_server.add_collector(lambda: [
+            ('bridge_fdx_writes_coalesced_total', 'counter',
+             'FDX write commands skipped because they repeat the last write', {}, self.fdx_coalesced_writes)])
+        try:
+            self.metrics_server.start()
+        except OSError as e:
+            logger.error('start metrics server error:%s', e)
+            self.metrics_server = None
+
+    def start_scpi_pollers(self):
+        from ScpiPoller import ScpiInstrumentManager
+        self.scpi_manager = ScpiInstrumentManager()
+        self.scpi_manager.on_measurement = self.scpi_measurement_to_fdx
+        for instrument_config in self.scpi_instruments_config:
+            name = instrument_config.get('name', instrument_config['resource'])
+            resource_kwargs = {key: instrument_config[key] for key in ('baud_rate',) if key in instrument_config}
+            try:
+                self.scpi_manager.open_instrument(name, instrument_config['resource'],
+                                                  instrument_config.get('visa_backend', '@py'),
+                                                  instrument_config.get('timeout_ms', 2000),
+                                                  instrument_config.get('poll_interval_ms', 200) / 1000,
+                                                  instrument_config.get('measurement_max_age_ms', 0) / 1000,
+                                                  **resource_kwargs)
+            except Exception as e:
+                logger.error('open SCPI instrument %s error:%s', name, e)
+
+    def send_data_exchange(self, group_id: int, data_bytes: bytes):
+        with self.fdx_send_lock:
+            try:
+                self.fdx.data_exchange_command(group_id, data_bytes)
+            except ValueError as e:
+                logger.error('FDX data exchange group %s error:%s', group_id, e)
+                return
+            self.fdx.send_fdx_data()
+
+    def modbus_registers_to_fdx(self, slave, registers):
+        self.send_data_exchange(slave, list_to_bytes_struct_direct(registers, 'big'))
+
+    def modbus_batch_registers_to_fdx(self, batch_id, results):
+        if self.read_registers_response_fdx_group_id is not None:
+            self.send_data_exchange(self.read_registers_response_fdx_group_id,
+                                    encode_read_registers_batch_response(batch_id, results))
+
+    def scpi_measurement_to_fdx(self, name, values, timestamp):
+        from ScpiPoller import encode_measurement
+        group_id = self.get_scpi_instrument_config(name).get('measurement_fdx_group_id')
+        if group_id is not None:
+            self.send_data_exchange(group_id, encode_measurement(*values, byteorder='big'))
+
+    def get_stats(self):
+        stats = {'fdx': self.fdx.get_link_stats(), 'fdx_writes_coalesced': self.fdx_coalesced_writes}
+        if self.modbus_client is not None:
+            stats['modbus'] = self.modbus_client.get_stats()
+        if self.scpi_manager is not None:
+            stats['scpi'] = self.scpi_manager.get_stats()
+        return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless CANoe FDX to Modbus RTU/SCPI bridge")
+    parser.add_argument('--config', default='./Config/config.json')
+    parser.add_argument('--serial-port', help="Modbus RTU serial port, omit to run without Modbus")
+    parser.add_argument('--bus', action='append', metavar='PORT[=SLAVE,...]',
+                        help="run this serial bus in its own process, repeat for several buses; "
+                             "slaves default to those not assigned to another bus")
+    parser.add_argument('--ring-slots', type=int, default=256, help="slots per shared-memory ring with --bus")
+    parser.add_argument('--protocol', choices=('UDP', 'TCP'), default='UDP')
+    parser.add_argument('--local-ip', default='127.0.0.1')
+    parser.add_argument('--local-port', type=int, default=2000)
+    parser.add_argument('--target-ip', default='127.0.0.1')
+    parser.add_argument('--target-port', type=int, default=2001)
+    parser.add_argument('--no-cycle-read', action='store_true', help="do not poll cycle_read_slaves_list")
+    parser.add_argument('--duration', type=float, default=0, help="seconds to run, 0 runs until Ctrl-C")
+    args = parser.parse_args(argv)
+
+    setup_logging()
+    try:
+        with open(args.config, 'r') as f:
+            config = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.error("Load config %s error: %s", args.config, e)
+        stop_logging()
+        return 2
+    errors = validate_config(config)
+    if errors:
+        logger.error("Config %s rejected: %s", args.config, '; '.join(errors))
+        stop_logging()
+        return 2
+
+    if args.bus:
+        if args.serial_port:
+            parser.error("--serial-port and --bus are mutually exclusive")
+        from MultiProcessBridge import MultiProcessBridge, parse_bus_argument
+        try:
+            bridge = MultiProcessBridge(config, [parse_bus_argument(bus) for bus in args.bus], args.protocol,
+                                        args.local_ip, args.local_port, args.target_ip, args.target_port,
+                                        ring_slots=args.ring_slots)
+        except FileExistsError as e:
+            logger.error("Create bus rings error: %s", e)
+            stop_logging()
+            return 2
+    else:
+        bridge = FdxModbusBridge(config, args.serial_port, args.protocol, args.local_ip, args.local_port,
+                                 args.target_ip, args.target_port)
+    exit_code = 0 if bridge.start(cycle_read=not args.no_cycle_read) else 1
+    try:
+        deadline = time.monotonic() + args.duration if args.duration else None
+        while exit_code == 0 and (deadline is None or time.monotonic() < deadline):
+            time.sleep(0.1 if deadline is None else max(min(deadline - time.monotonic(), 0.1), 0))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stats = bridge.get_stats()
+        bridge.stop()
+        logger.info("Bridge stats: %s", stats)
+        stop_logging()
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
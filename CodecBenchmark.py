@@ -0,0 +1,128 @@
+import argparse
+import json
+import shlex
+import statistics
+import subprocess
+import sys
+import time
+
+from FdxCodec import (FdxHeaderStructs, decode_data_exchange, decode_fdx_header, decode_read_registers_batch,
+                      decode_write_registers, encode_fdx_command, encode_read_registers_batch_response,
+                      iter_fdx_commands, pack_registers)
+from PollScheduler import CyclePollScheduler
+
+# 桥接热点路径的吞吐量: FDX命令解码、寄存器打包编码和总线轮询调度。
+# 同一脚本可解释执行，也可用Nuitka编译后执行，--compare对比两者在相同负载下的结果
+
+CommandCodeDataExchange = 0x0005
+
+
+def build_command_datagram(register_count: int = 10, batch_blocks: int = 4):
+    """一个FDX数据报: 多寄存器写命令和批量读取命令各一条DataExchange"""
+    write_data = pack_registers([1, 0, register_count] + list(range(register_count)))
+    batch_data = pack_registers([1, batch_blocks] + [value for block in range(batch_blocks)
+                                                     for value in (block + 1, 0, register_count)])
+    commands = b''.join(encode_fdx_command(CommandCodeDataExchange,
+                                           pack_registers([group_id, len(data)]) + data)
+                        for group_id, data in ((251, write_data), (252, batch_data)))
+    header = FdxHeaderStructs['big'].pack(b'CANoeFDX', 2, 1, 2, 1, 1, 0)
+    return header + commands
+
+
+def decode_datagram(datagram: bytes):
+    _, _, _, number_of_commands, _, byteorder = decode_fdx_header(datagram)
+    for _, command_data in iter_fdx_commands(datagram, number_of_commands, byteorder):
+        groupid, datasize, databytes = decode_data_exchange(command_data, byteorder)
+        if groupid == 251:
+            decode_write_registers(databytes, datasize, byteorder)
+        else:
+            decode_read_registers_batch(databytes, datasize, byteorder)
+
+
+def encode_registers(slave: int, registers):
+    data = pack_registers(registers)
+    return encode_fdx_command(CommandCodeDataExchange, pack_registers([slave, len(data)]) + data)
+
+
+def schedule_polls(scheduler: CyclePollScheduler, cycle_slaves, steps: int = 100):
+    for step in range(steps):
+        if step % 4 == 0 and scheduler.is_request_turn(cycle_slaves):
+            scheduler.request_done()
+        else:
+            scheduler.next_cycle_slave(cycle_slaves)
+
+
+def workloads(register_count: int):
+    datagram = build_command_datagram(register_count)
+    registers = list(range(register_count))
+    batch_results = [(block + 1, 0, register_count, None if block == 3 else registers) for block in range(8)]
+    scheduler = CyclePollScheduler()
+    cycle_slaves = list(range(1, 9))
+    return {
+        'decode_command_datagram': lambda: decode_datagram(datagram),
+        'encode_registers': lambda: encode_registers(1, registers),
+        'encode_batch_response': lambda: encode_read_registers_batch_response(1, batch_results),
+        'schedule_100_polls': lambda: schedule_polls(scheduler, cycle_slaves),
+    }
+
+
+def run(iterations: int, repeats: int, register_count: int):
+    """返回{workload: 每秒操作数(repeats次中位数)}"""
+    results = {}
+    for name, func in workloads(register_count).items():
+        rates = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for _ in range(iterations):
+                func()
+            rates.append(iterations / (time.perf_counter() - start))
+        results[name] = statistics.median(rates)
+    return results
+
+
+def is_compiled():
+    return '__compiled__' in globals()
+
+
+def print_results(results, compared=None, compared_label='compiled'):
+    if compared is None:
+        print(f"{'workload':<26} {'ops/s':>12}  ({'compiled' if is_compiled() else 'interpreted'})")
+        for name, rate in results.items():
+            print(f"{name:<26} {rate:12.0f}")
+        return
+    print(f"{'workload':<26} {'interpreted':>12} {compared_label:>12} {'speedup':>8}")
+    for name, rate in results.items():
+        other = compared.get(name)
+        if other is None:
+            print(f"{name:<26} {rate:12.0f} {'-':>12} {'-':>8}")
+        else:
+            print(f"{name:<26} {rate:12.0f} {other:12.0f} {other / rate:7.2f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark FDX codec, register packing and poll scheduling")
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--registers', type=int, default=10, help="registers per slave")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    parser.add_argument('--compare', metavar='COMMAND',
+                        help="command running the compiled benchmark, e.g. ./CodecBenchmark.bin")
+    args = parser.parse_args()
+    results = run(args.iterations, args.repeats, args.registers)
+    if args.json:
+        print(json.dumps({'compiled': is_compiled(), 'results': results}))
+        sys.exit(0)
+    if not args.compare:
+        print_results(results)
+        sys.exit(0)
+    process = subprocess.run(shlex.split(args.compare) + ['--json', '--iterations', str(args.iterations),
+                                                          '--repeats', str(args.repeats),
+                                                          '--registers', str(args.registers)],
+                             capture_output=True, text=True)
+    if process.returncode != 0:
+        print(process.stderr, file=sys.stderr)
+        sys.exit(process.returncode)
+    compared = json.loads(process.stdout)
+    if not compared['compiled']:
+        print(f"warning: {args.compare} is not a compiled build", file=sys.stderr)
+    print_results(results, compared['results'])
@@ -0,0 +1,190 @@
+import json
+import os
+import threading
+
+from LogUtils import get_logger
+
+logger = get_logger(__name__)
+
+# 运行中修改后需要重新连接串口才生效的配置
+SerialConfigKeys = ('serial_baud_rate', 'serial_bytesize', 'serial_parity', 'serial_stop_bits', 'serial_timeout',
+                    'serial_retries')
+# 只在启动时读取的配置
+StartupConfigKeys = ('profile_trace_file', 'metrics_http_port', 'shared_memory_name_prefix', 'latency_trace_enabled',
+                     'latency_trace_outlier_ms', 'thread_scheduling', 'scpi_instruments', 'config_watch_interval_ms',
+                     'modbus_register_ring_slots', 'modbus_register_ring_overwrite_oldest')
+FdxCommandGroupKeys = ('write_register_command_fdx_group_id', 'write_registers_command_fdx_group_id',
+                       'read_registers_command_fdx_group_id')
+FdxGroupKeys = FdxCommandGroupKeys + ('read_registers_response_fdx_group_id',)
+FreeRunningModes = ('cyclic', 'trigger', 'request')
+
+
+def fdx_command_group_ids(config):
+    """需要向CANoe请求发送的命令数据组: Modbus命令数据组和各SCPI仪器的setpoint_fdx_group_id，按配置顺序去重"""
+    group_ids = [config.get(key) for key in FdxCommandGroupKeys]
+    group_ids += [instrument.get('setpoint_fdx_group_id') for instrument in config.get('scpi_instruments') or []]
+    result = []
+    for group_id in group_ids:
+        if group_id is not None and group_id not in result:
+            result.append(group_id)
+    return result
+
+
+def _parse_group_id(key):
+    """对象键中的FDX数据组号，不是0-65535的整数时返回None"""
+    try:
+        group_id = int(key)
+    except ValueError:
+        return None
+    return group_id if 0 <= group_id <= 0xFFFF else None
+
+
+def validate_config(config):
+    """检查配置内容，返回错误描述列表，为空表示可以应用"""
+    errors = []
+    if not isinstance(config, dict):
+        return ["config must be a JSON object"]
+    slaves_list = config.get('slaves_list', {})
+    slaves = set()
+    if not isinstance(slaves_list, dict):
+        errors.append("slaves_list must be an object")
+    else:
+        for slave, count in slaves_list.items():
+            try:
+                slave = int(slave)
+            except ValueError:
+                errors.append(f"slaves_list key {slave!r} is not a slave id")
+                continue
+            slaves.add(slave)
+            if not 1 <= slave <= 247:
+                errors.append(f"slave id {slave} out of range 1-247")
+            if not isinstance(count, int) or not 1 <= count <= 125:
+                errors.append(f"slave {slave} register count {count!r} out of range 1-125")
+    cycle_read_slaves_list = config.get('cycle_read_slaves_list', [])
+    if not isinstance(cycle_read_slaves_list, list):
+        errors.append("cycle_read_slaves_list must be a list")
+    else:
+        for slave in cycle_read_slaves_list:
+            if slave not in slaves:
+                errors.append(f"cycle_read_slaves_list slave {slave!r} not in slaves_list")
+    group_keys = [(key, config.get(key)) for key in FdxGroupKeys]
+    scpi_instruments = config.get('scpi_instruments') or []
+    if not isinstance(scpi_instruments, list):
+        errors.append("scpi_instruments must be a list")
+        scpi_instruments = []
+    for index, instrument in enumerate(scpi_instruments):
+        if not isinstance(instrument, dict):
+            errors.append(f"scpi_instruments[{index}] must be an object")
+            continue
+        group_keys.append((f"scpi_instruments[{index}].setpoint_fdx_group_id", instrument.get('setpoint_fdx_group_id')))
+    group_ids = []
+    for key, group_id in group_keys:
+        if group_id is None:
+            continue
+        if not isinstance(group_id, int) or not 0 <= group_id <= 0xFFFF:
+            errors.append(f"{key} {group_id!r} is not a group id")
+        elif group_id in group_ids:
+            errors.append(f"{key} {group_id} is used by another command group")
+        else:
+            group_ids.append(group_id)
+    free_running = config.get('fdx_free_running', {})
+    if not isinstance(free_running, dict):
+        errors.append("fdx_free_running must be an object")
+    else:
+        for group_id, group_config in free_running.items():
+            if _parse_group_id(group_id) is None:
+                errors.append(f"fdx_free_running key {group_id!r} is not a group id")
+            if not isinstance(group_config, dict):
+                errors.append(f"fdx_free_running group {group_id} must be an object")
+                continue
+            mode = group_config.get('mode', 'cyclic')
+            if mode not in FreeRunningModes:
+                errors.append(f"fdx_free_running group {group_id} mode {mode!r} not in {FreeRunningModes}")
+            cycle_time_ms = group_config.get('cycle_time_ms', 1)
+            if not isinstance(cycle_time_ms, (int, float)) or cycle_time_ms <= 0:
+                errors.append(f"fdx_free_running group {group_id} cycle_time_ms {cycle_time_ms!r} must be positive")
+    shared_memory_fdx_groups = config.get('shared_memory_fdx_groups', {})
+    if not isinstance(shared_memory_fdx_groups, dict):
+        errors.append("shared_memory_fdx_groups must be an object")
+    else:
+        for group_id, size in shared_memory_fdx_groups.items():
+            if _parse_group_id(group_id) is None:
+                errors.append(f"shared_memory_fdx_groups key {group_id!r} is not a group id")
+            if not isinstance(size, int) or size < 1:
+                errors.append(f"shared_memory_fdx_groups group {group_id} size {size!r} must be a positive integer")
+    budget = config.get('fdx_latency_budget_ms', 1)
+    if not isinstance(budget, (int, float)) or budget <= 0:
+        errors.append(f"fdx_latency_budget_ms {budget!r} must be positive")
+    ring_slots = config.get('modbus_register_ring_slots', 1)
+    if not isinstance(ring_slots, int) or ring_slots < 1:
+        errors.append(f"modbus_register_ring_slots {ring_slots!r} must be a positive integer")
+    return errors
+
+
+def diff_config(old_config: dict, new_config: dict):
+    """返回值发生变化的配置项名称集合"""
+    return {key for key in set(old_config) | set(new_config) if old_config.get(key) != new_config.get(key)}
+
+
+class ConfigWatcher(object):
+    """后台线程按interval检查配置文件的修改时间和大小，变化后读取并校验
+
+    校验通过时调用on_change(config, changed_keys)，回调中应整体应用新配置；
+    JSON格式错误或校验失败时保留当前配置并输出错误
+    """
+    def __init__(self, path: str, on_change, interval: float = 1.0, config: dict = None):
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self.config = config if config is not None else {}
+        self.stop_event = threading.Event()
+        self.watch_thread = None
+        self.file_signature = self._signature()
+
+    def _signature(self):
+        try:
+            stat = os.stat(self.path)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def start(self):
+        if self.watch_thread is None or not self.watch_thread.is_alive():
+            self.stop_event.clear()
+            self.watch_thread = threading.Thread(target=self._watch_loop, daemon=True)
+            self.watch_thread.start()
+
+    def stop(self):
+        if self.watch_thread is not None:
+            self.stop_event.set()
+            self.watch_thread.join()
+            self.watch_thread = None
+
+    def _watch_loop(self):
+        while not self.stop_event.wait(self.interval):
+            signature = self._signature()
+            if signature is None or signature == self.file_signature:
+                continue
+            self.file_signature = signature
+            self.check()
+
+    def check(self):
+        """读取并校验配置文件，有变化时调用on_change，返回是否应用了新配置"""
+        try:
+            with open(self.path, 'r') as f:
+                config = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            # 编辑器保存过程中可能读到不完整的文件，下次修改后重试
+            logger.error("Reload config %s error: %s", self.path, e)
+            return False
+        errors = validate_config(config)
+        if errors:
+            logger.error("Config %s rejected: %s", self.path, '; '.join(errors))
+            return False
+        changed_keys = diff_config(self.config, config)
+        if not changed_keys:
+            return False
+        self.config = config
+        logger.info("Config %s changed: %s", self.path, ', '.join(sorted(changed_keys)))
+        self.on_change(config, changed_keys)
+        return True
@@ -0,0 +1,134 @@
+import struct
+
+# FDX数据报和命令数据组载荷的编解码，不依赖Qt，由图形界面(main.py)、无界面桥接(Bridge.py)和VectorFDX共用。
+# 收发路径上的热点函数: 格式固定的Struct在模块加载时创建，寄存器打包按数量缓存Struct，
+# 避免每次调用解析格式串，也便于Nuitka编译为直接调用
+
+FdxHeaderSize = 16
+FdxHeaderStructs = {'big': struct.Struct('>8sBBHHBB'), 'little': struct.Struct('<8sBBHHBB')}
+FdxCommandHeaderStructs = {'big': struct.Struct('>HH'), 'little': struct.Struct('<HH')}
+CommandStructs = {'big': struct.Struct('>HHH'), 'little': struct.Struct('<HHH')}
+BatchBlockHeader = struct.Struct('>HHHH')
+BatchResponseHeader = struct.Struct('>HH')
+
+_register_structs = {}  # {(count, byteorder): Struct}
+
+
+def register_struct(count: int, byteorder: str = 'big'):
+    """count个uint16寄存器的Struct"""
+    key = (count, byteorder)
+    register_format = _register_structs.get(key)
+    if register_format is None:
+        register_format = struct.Struct(f"{'>' if byteorder == 'big' else '<'}{count}H")
+        _register_structs[key] = register_format
+    return register_format
+
+
+def pack_registers(registers, byteorder: str = 'big'):
+    """寄存器值列表打包为uint16字节串，值超出0-0xFFFF或不是整数时抛出ValueError"""
+    try:
+        return register_struct(len(registers), byteorder).pack(*registers)
+    except struct.error as e:
+        raise ValueError(f"registers must be integers in 0-0xFFFF: {e}") from None
+
+
+def list_to_bytes_struct_direct(input_list,byte_oder):
+    return pack_registers(input_list, byte_oder)
+
+
+def decode_fdx_header(data: bytes):
+    """返回(signature, major_version, minor_version, number_of_commands, sequence_number, byteorder)
+
+    byteorder由头部第14字节(protocol_flags)决定，1为大端、0为小端，其他值按大端处理
+    """
+    byteorder = 'little' if data[14] == 0 else 'big'
+    signature, major_version, minor_version, number_of_commands, sequence_number, _, _ = \
+        FdxHeaderStructs[byteorder].unpack_from(data)
+    return signature, major_version, minor_version, number_of_commands, sequence_number, byteorder
+
+
+def iter_fdx_commands(data: bytes, number_of_commands: int, byteorder: str = 'big', offset: int = FdxHeaderSize):
+    """依次返回数据报中各命令的(command_code, command_data)，数据不足时抛出ValueError"""
+    command_header = FdxCommandHeaderStructs[byteorder]
+    for _ in range(number_of_commands):
+        if offset + 4 > len(data):
+            raise ValueError(f"Data too short for command: {len(data) - offset} bytes")
+        command_size, command_code = command_header.unpack_from(data, offset)
+        yield command_code, data[offset + 4:offset + command_size]
+        offset += command_size
+
+
+def encode_fdx_command(command_code: int, command_data: bytes = b"", byteorder: str = 'big'):
+    """command_size(含4字节命令头), command_code, command_data"""
+    return FdxCommandHeaderStructs[byteorder].pack(4 + len(command_data), command_code) + command_data
+
+
+def decode_data_exchange(command_data: bytes, byteorder: str = 'big'):
+    """DataExchange命令: 返回(groupid, datasize, databytes)"""
+    groupid, datasize = FdxCommandHeaderStructs[byteorder].unpack_from(command_data)
+    return groupid, datasize, command_data[4:]
+
+
+def decode_write_register(databytes: bytes, datasize: int, byteorder: str = 'big'):
+    """单个寄存器写命令: slave, address, value，均为uint16，数据不足时返回None"""
+    if datasize < 6:
+        return None
+    return CommandStructs[byteorder].unpack_from(databytes)
+
+
+def decode_write_registers(databytes: bytes, datasize: int, byteorder: str = 'big'):
+    """多个寄存器写命令: slave, address, register_num, register_num*value，均为uint16
+
+    返回(slave, address, values)，数据不足时返回None
+    """
+    if datasize < 6:
+        return None
+    slave, address, register_num = CommandStructs[byteorder].unpack_from(databytes)
+    if datasize < register_num*2+6:
+        return None
+    values = list(register_struct(register_num, byteorder).unpack_from(databytes, 6))
+    return slave, address, values
+
+
+def decode_read_registers_batch(databytes: bytes, datasize: int, byteorder: str = 'big'):
+    """批量读取命令: request_id, request_num, request_num*(slave, address, count)，均为uint16
+
+    返回(request_id, [(slave, address, count), ...])，数据不足时返回None
+    """
+    if datasize < 4:
+        return None
+    request_id, request_num = FdxCommandHeaderStructs[byteorder].unpack_from(databytes)
+    if datasize < request_num*6+4:
+        return None
+    values = register_struct(request_num * 3, byteorder).unpack_from(databytes, 4)
+    return request_id, [values[i:i + 3] for i in range(0, len(values), 3)]
+
+
+def encode_read_registers_batch_response(batch_id: int, results):
+    """批量读取结果: request_id, request_num, request_num*(slave, address, count, status, values)，大端
+
+    status为1表示读取失败，values以0填充
+    """
+    parts = [BatchResponseHeader.pack(batch_id, len(results))]
+    for slave, address, count, registers in results:
+        if registers is None:
+            parts.append(BatchBlockHeader.pack(slave, address, count, 1))
+            parts.append(bytes(count * 2))
+        else:
+            parts.append(BatchBlockHeader.pack(slave, address, count, 0))
+            parts.append(pack_registers(registers, 'big'))
+    return b''.join(parts)
+
+
+def decode_read_registers_batch_response(data: bytes):
+    """encode_read_registers_batch_response()的逆过程，返回(batch_id, [(slave, address, count, registers或None), ...])"""
+    batch_id, request_num = BatchResponseHeader.unpack_from(data)
+    offset = BatchResponseHeader.size
+    results = []
+    for _ in range(request_num):
+        slave, address, count, status = BatchBlockHeader.unpack_from(data, offset)
+        offset += BatchBlockHeader.size
+        registers = None if status else list(register_struct(count, 'big').unpack_from(data, offset))
+        offset += count * 2
+        results.append((slave, address, count, registers))
+    return batch_id, results
@@ -0,0 +1,225 @@
+import threading
+from typing import Literal
+
+from ConfigWatcher import fdx_command_group_ids
+from FdxCodec import decode_read_registers_batch, decode_write_register, decode_write_registers
+from LogUtils import get_logger
+from ModbusClient import is_queue_full
+
+logger = get_logger(__name__)
+
+
+class FdxCommandDispatcher(object):
+    """按config.json把CANoe发来的命令数据组分发到Modbus从站和SCPI仪器，并向CANoe请求命令数据组的发送方式
+
+    图形界面和无界面桥接共用，不依赖PyQt5: 图形界面在主线程中调用handle_fdx_command()，
+    无界面桥接在FDX接收线程中调用。fdx发送缓冲由fdx_send_lock保护；
+    data_request_timer为提供start(毫秒)和stop()的定时器(如QTimer)，由所属线程定时调用send_data_requests()，
+    为None时由本对象的请求线程定时请求
+    """
+    def __init__(self, fdx, config: dict, modbus_client=None, scpi_manager=None, data_request_timer=None):
+        self.fdx = fdx
+        self.modbus_client = modbus_client
+        self.scpi_manager = scpi_manager
+        self.fdx_send_lock = threading.Lock()
+        self.data_request_timer = data_request_timer
+        self.fdx_data_request_group_ids = []
+        self.fdx_data_request_thread = None
+        self.fdx_data_request_stop_event = threading.Event()
+        self.last_write_register_command = None
+        self.last_write_registers_command = None
+        self.last_read_registers_request_id = None
+        self.fdx_coalesced_writes = 0  # 与上次相同而未重复写入的FDX写命令数
+        self.scpi_pending_setpoints = {}  # {name: (设定值, 尚未执行完的Future)}
+        self.apply_config(config)
+
+    def apply_config(self, config: dict):
+        """读取命令数据组和发送方式，命令数据组变化时由调用方调用reset_command_state()"""
+        self.config = config
+        self.write_register_command_fdx_group_id = config.get("write_register_command_fdx_group_id")
+        self.write_registers_command_fdx_group_id = config.get("write_registers_command_fdx_group_id")
+        self.read_registers_command_fdx_group_id = config.get("read_registers_command_fdx_group_id")
+        self.read_registers_response_fdx_group_id = config.get("read_registers_response_fdx_group_id")
+        # 每个FDX数据组的发送方式: cyclic(周期发送)/trigger(CAPL触发发送)/request(本软件按需请求)
+        self.fdx_free_running_config = {int(k): v for k, v in config.get("fdx_free_running", {}).items()}
+        self.fdx_latency_budget_ms = config.get("fdx_latency_budget_ms", 5000)
+        # SCPI仪器: [{'name', 'resource', 'measurement_fdx_group_id', 'setpoint_fdx_group_id', ...}]
+        self.scpi_instruments_config = config.get("scpi_instruments", [])
+
+    def reset_command_state(self):
+        """清除上次写命令和批量读取request_id，下次收到的命令都会执行"""
+        self.last_write_register_command = None
+        self.last_write_registers_command = None
+        self.last_read_registers_request_id = None
+
+    def get_scpi_instrument_config(self, name):
+        for instrument_config in self.scpi_instruments_config:
+            if instrument_config.get('name', instrument_config['resource']) == name:
+                return instrument_config
+        return {}
+
+    def handle_fdx_command(self, result, byteorder: Literal["little", "big"]):
+        """按groupid分发DataExchange命令数据组，与上次相同的写命令不重复执行"""
+        group_id = result['groupid']
+        if self.is_modbus_ready():
+            if group_id == self.write_register_command_fdx_group_id:
+                self.write_register_by_fdx_command(result, byteorder)
+            elif group_id == self.write_registers_command_fdx_group_id:
+                self.write_registers_by_fdx_command(result, byteorder)
+            elif group_id == self.read_registers_command_fdx_group_id:
+                self.read_registers_by_fdx_command(result, byteorder)
+        if self.scpi_manager is not None:
+            self.scpi_setpoint_by_fdx_command(result, byteorder)
+
+    # 以下submit_*把解码后的命令交给Modbus总线，MultiProcessBridge改为写入总线进程的命令环；
+    # 不等待总线，写命令未能提交时返回False
+    def is_modbus_ready(self):
+        return self.modbus_client is not None and self.modbus_client.is_connected
+
+    def submit_write_register(self, slave, address, value, trace_ns=None):
+        future = self.modbus_client.add_write_register_queue(address=address, value=value, slave=slave,
+                                                             trace_ns=trace_ns, block=False)
+        return not is_queue_full(future)
+
+    def submit_write_registers(self, slave, address, values, trace_ns=None):
+        future = self.modbus_client.add_write_registers_queue(address=address, values=values, slave=slave,
+                                                              trace_ns=trace_ns, block=False)
+        return not is_queue_full(future)
+
+    def submit_read_registers_batch(self, request_id, requests):
+        """队列中放不下的块按读取失败回复"""
+        self.modbus_client.add_read_holding_registers_batch_queue(requests, batch_id=request_id, block=False)
+
+    def write_register_by_fdx_command(self, result, byteorder):
+        command = decode_write_register(result['databytes'], result['datasize'], byteorder)
+        if command is None:
+            return
+        if command == self.last_write_register_command:
+            self.fdx_coalesced_writes += 1
+            return
+        slave, address, value = command
+        # 未能提交的命令不记为上次命令，CANoe再次发送时重新提交
+        if self.submit_write_register(slave, address, value, result['rx_timestamp_ns']):
+            self.last_write_register_command = command
+
+    def write_registers_by_fdx_command(self, result, byteorder):
+        command = decode_write_registers(result['databytes'], result['datasize'], byteorder)
+        if command is None:
+            return
+        if command == self.last_write_registers_command:
+            self.fdx_coalesced_writes += 1
+            return
+        slave, address, values = command
+        if self.submit_write_registers(slave, address, values, result['rx_timestamp_ns']):
+            self.last_write_registers_command = command
+
+    def read_registers_by_fdx_command(self, result, byteorder):
+        """批量读取命令: request_id, request_num, request_num*(slave, address, count)，均为uint16"""
+        if self.read_registers_response_fdx_group_id is None:
+            return
+        command = decode_read_registers_batch(result['databytes'], result['datasize'], byteorder)
+        if command is None:
+            return
+        request_id, requests = command
+        # request_id为0表示空闲，相同request_id为CANoe重复发送的同一批请求
+        if request_id == 0 or request_id == self.last_read_registers_request_id:
+            return
+        self.last_read_registers_request_id = request_id
+        self.submit_read_registers_batch(request_id, requests)
+
+    def scpi_setpoint_by_fdx_command(self, result, byteorder):
+        """设定值命令: function, input, value
+
+        每次收到都提交给仪器线程，是否重复写入由IT8800的设置缓存决定(INPut总是发送)，
+        输入被仪器保护关闭或设置出错后，CANoe再次发送的同一设定值会重新写入；
+        只有相同设定值仍在仪器线程中排队或执行时不再提交，避免周期发送的数据组在仪器较慢时堆积
+        """
+        from ScpiPoller import SetpointFunctions, decode_setpoint
+        for name, worker in self.scpi_manager.workers.items():
+            if self.get_scpi_instrument_config(name).get('setpoint_fdx_group_id') != result['groupid'] or \
+                    result['datasize'] < 8:
+                continue
+            setpoint = decode_setpoint(result['databytes'], byteorder)
+            pending = self.scpi_pending_setpoints.get(name)
+            if pending is not None and pending[0] == setpoint and not pending[1].done():
+                continue
+            function_code, input_state, value = setpoint
+            function = SetpointFunctions.get(function_code)
+            future = worker.submit_setpoint(function, value if function is not None else None,
+                                            None if input_state == 0 else input_state == 2)
+            self.scpi_pending_setpoints[name] = (setpoint, future)
+
+    def get_fdx_command_group_ids(self):
+        """需要由CANoe发送的命令数据组，包括SCPI仪器的设定值数据组"""
+        return fdx_command_group_ids(self.config)
+
+    def get_fdx_group_cycle_time_us(self, group_id):
+        """数据组周期，未单独配置时由延迟预算决定"""
+        group_config = self.fdx_free_running_config.get(group_id, {})
+        return int(group_config.get('cycle_time_ms', self.fdx_latency_budget_ms) * 1000)
+
+    def request_fdx_groups_transmission(self):
+        """按fdx_free_running配置向CANoe请求命令数据组的发送方式，request模式的数据组由本对象定时请求"""
+        self.fdx_data_request_group_ids = []
+        with self.fdx_send_lock:
+            is_add_command = False
+            for group_id in self.get_fdx_command_group_ids():
+                mode = self.fdx_free_running_config.get(group_id, {}).get('mode', 'cyclic')
+                if mode == 'request':
+                    self.fdx_data_request_group_ids.append(group_id)
+                    continue
+                if mode == 'trigger':
+                    # CANoe端通过CAPL FDXTriggerDataGroup()在数据变化时发送
+                    flags = self.fdx.FreeRunningFlag_TransmitAtTrigger
+                    cycle_time = 0
+                else:
+                    flags = self.fdx.FreeRunningFlag_TransmitCyclic
+                    cycle_time = self.get_fdx_group_cycle_time_us(group_id)
+                self.fdx.free_running_request_command(group_id, flags, cycle_time, cycle_time,
+                                                      is_add_command=is_add_command)
+                is_add_command = True
+            if is_add_command:
+                self.fdx.send_fdx_data()
+        if self.fdx_data_request_group_ids:
+            interval_ms = max(min(self.get_fdx_group_cycle_time_us(group_id) // 1000
+                                  for group_id in self.fdx_data_request_group_ids), 1)
+            if self.data_request_timer is not None:
+                self.data_request_timer.start(interval_ms)
+            else:
+                self.fdx_data_request_stop_event.clear()
+                self.fdx_data_request_thread = threading.Thread(target=self._data_request_loop,
+                                                                args=(interval_ms / 1000,), daemon=True)
+                self.fdx_data_request_thread.start()
+
+    def cancel_fdx_groups_transmission(self):
+        """取消命令数据组的自由运行和按需请求"""
+        if self.data_request_timer is not None:
+            self.data_request_timer.stop()
+        if self.fdx_data_request_thread is not None:
+            self.fdx_data_request_stop_event.set()
+            self.fdx_data_request_thread.join()
+            self.fdx_data_request_thread = None
+        with self.fdx_send_lock:
+            is_add_command = False
+            for group_id in self.get_fdx_command_group_ids():
+                if group_id in self.fdx_data_request_group_ids:
+                    continue
+                self.fdx.free_running_cancel_command(group_id, is_add_command=is_add_command)
+                is_add_command = True
+            if is_add_command:
+                self.fdx.send_fdx_data()
+        self.fdx_data_request_group_ids = []
+
+    def send_data_requests(self):
+        """按需请求CANoe发送request模式的数据组"""
+        with self.fdx_send_lock:
+            is_add_command = False
+            for group_id in self.fdx_data_request_group_ids:
+                self.fdx.data_request_command(group_id, is_add_command=is_add_command)
+                is_add_command = True
+            if is_add_command:
+                self.fdx.send_fdx_data()
+
+    def _data_request_loop(self, interval: float):
+        while not self.fdx_data_request_stop_event.wait(interval):
+            self.send_data_requests()
@@ -0,0 +1,74 @@
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+# 各入口模块在新解释器中的导入耗时，每次都启动新进程，结果包含解释器自身的启动时间
+DefaultModules = ('Bridge', 'VectorFDX', 'ModbusClient', 'ScpiPoller', 'RegisterRecorder', 'main')
+# 只应在需要时导入的依赖，出现在无界面入口的导入列表中说明有模块在顶层导入了它们
+LazyDependencies = ('PyQt5', 'pymodbus', 'serial', 'pyvisa', 'numpy', 'http.server')
+
+ImportTimeLine = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)')
+
+
+def time_import(module: str, runs: int = 5, cwd: str = None):
+    """每次在新进程中执行`python -X importtime -c "import module"`
+
+    返回[(总耗时ms, module直接导入的模块[(name, 累计ms)]按耗时降序, 已导入的延迟依赖集合)]
+    """
+    results = []
+    for _ in range(runs):
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=cwd,
+                                 capture_output=True, text=True)
+        if process.returncode != 0:
+            error = process.stderr.strip().splitlines()
+            raise RuntimeError(f"import {module} failed: {error[-1] if error else process.returncode}")
+        total_ms = 0.0
+        children = []  # 下一个顶层模块的直接导入，-X importtime先输出子模块再输出父模块
+        module_children = []
+        loaded = set()
+        for line in process.stderr.splitlines():
+            match = ImportTimeLine.match(line)
+            if match is None:
+                continue
+            cumulative_ms, indent, name = int(match.group(2)) / 1000, len(match.group(3)), match.group(4)
+            for dependency in LazyDependencies:
+                if name == dependency or name.startswith(dependency + '.'):
+                    loaded.add(dependency)
+            if indent == 3:
+                children.append((name, cumulative_ms))
+            elif indent == 1:
+                total_ms += cumulative_ms
+                if name == module:
+                    module_children = children
+                children = []
+        results.append((total_ms, sorted(module_children, key=lambda item: -item[1]), loaded))
+    return results
+
+
+def benchmark(modules, runs: int = 5, top: int = 5):
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    print(f"{'module':<18} {'median ms':>10} {'min ms':>8}  lazy dependencies loaded")
+    for module in modules:
+        try:
+            results = time_import(module, runs, cwd)
+        except RuntimeError as e:
+            print(f"{module:<18} {'-':>10} {'-':>8}  {e}")
+            continue
+        totals = [total for total, _, _ in results]
+        loaded = sorted(results[-1][2])
+        print(f"{module:<18} {statistics.median(totals):10.1f} {min(totals):8.1f}  {', '.join(loaded) or '-'}")
+        if top:
+            for name, ms in results[-1][1][:top]:
+                print(f"{'':<20}{name:<30} {ms:8.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure import time of entry modules with -X importtime")
+    parser.add_argument('modules', nargs='*', default=DefaultModules)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=5, help="show the slowest imports of each module, 0 disables")
+    args = parser.parse_args()
+    benchmark(args.modules, args.runs, args.top)
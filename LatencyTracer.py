@@ -0,0 +1,56 @@
+import time
+from collections import deque
+
+from LogUtils import get_logger
+from Metrics import LatencyHistogram
+
+logger = get_logger(__name__)
+
+
+class LatencyTracer(object):
+    """端到端延迟跟踪
+
+    fdx_to_modbus: FDX DataExchange在接收线程收到 → 对应的Modbus写请求得到从站应答
+    modbus_to_fdx: Modbus读请求得到从站应答 → 寄存器值通过FDX发送出去
+    起点和终点均为time.perf_counter_ns()，每条路径只由一个线程记录；
+    超过outlier_threshold_us的记录作为异常值保留最近outlier_capacity条并输出警告
+    """
+    PathFdxToModbus = 'fdx_to_modbus'
+    PathModbusToFdx = 'modbus_to_fdx'
+
+    def __init__(self, outlier_threshold_us: int = 20000, outlier_capacity: int = 256):
+        self.outlier_threshold_us = outlier_threshold_us
+        self.histograms = {self.PathFdxToModbus: LatencyHistogram(), self.PathModbusToFdx: LatencyHistogram()}
+        self.outlier_counts = {path: 0 for path in self.histograms}
+        self.outliers = deque(maxlen=outlier_capacity)  # [(time.time(), path, label, latency_us), ...]
+
+    def record(self, path: str, start_ns: int, end_ns: int = None, label: str = ''):
+        """记录从start_ns到end_ns(默认为当前时刻)的延迟，返回延迟(us)"""
+        if end_ns is None:
+            end_ns = time.perf_counter_ns()
+        latency_us = (end_ns - start_ns) // 1000
+        self.histograms[path].record(latency_us)
+        if self.outlier_threshold_us is not None and latency_us > self.outlier_threshold_us:
+            self.outlier_counts[path] += 1
+            self.outliers.append((time.time(), path, label, latency_us))
+            logger.warning("Latency outlier %s %s: %d us", path, label, latency_us)
+        return latency_us
+
+    def get_outliers(self):
+        return list(self.outliers)
+
+    def get_stats(self):
+        """{path: {count, min_us, mean_us, p50_us, p90_us, p99_us, max_us, outliers}}"""
+        stats = {}
+        for path, histogram in self.histograms.items():
+            stats[path] = histogram.snapshot()
+            stats[path]['outliers'] = self.outlier_counts[path]
+        return stats
+
+    def report(self):
+        """每条路径一行的文本摘要"""
+        lines = []
+        for path, values in self.get_stats().items():
+            lines.append(f"{path}: count={values['count']} p50={values['p50_us']}us p90={values['p90_us']}us "
+                         f"p99={values['p99_us']}us max={values['max_us']}us outliers={values['outliers']}")
+        return '\n'.join(lines)
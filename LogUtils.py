@@ -0,0 +1,97 @@
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+
+class RateLimitFilter(logging.Filter):
+    """按日志格式串限流，每个(logger, msg)每秒最多rate条，允许burst条突发
+
+    使用未格式化的record.msg作为键，同一位置不同参数的日志共用一个配额；
+    被抑制的条数累计到下一条放行的日志中输出，并可通过get_suppressed_counts()查询
+    """
+    def __init__(self, rate: float = 1.0, burst: int = 5):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}  # {(name, msg): [tokens, last_time, suppressed]}
+        self.suppressed_total = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord):
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = [float(self.burst), now, 0]
+                self.buckets[key] = bucket
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens < 1.0:
+                bucket[0] = tokens
+                bucket[2] += 1
+                self.suppressed_total[key] = self.suppressed_total.get(key, 0) + 1
+                return False
+            bucket[0] = tokens - 1.0
+            suppressed = bucket[2]
+            bucket[2] = 0
+        if suppressed:
+            record.msg = f"{record.msg} (suppressed {suppressed} similar messages)"
+        return True
+
+    def get_suppressed_counts(self):
+        """{'logger: msg': 被抑制的总条数}"""
+        with self.lock:
+            return {f"{name}: {msg}": count for (name, msg), count in self.suppressed_total.items()}
+
+
+rate_limit_filter = RateLimitFilter()
+queue_listener = None
+
+
+def get_logger(name: str):
+    """获取带限流的logger，收发和轮询线程中统一使用此logger代替print"""
+    logger = logging.getLogger(name)
+    if rate_limit_filter not in logger.filters:
+        logger.addFilter(rate_limit_filter)
+    return logger
+
+
+def setup_logging(level=logging.INFO, use_queue: bool = True, handler: logging.Handler = None,
+                  rate: float = None, burst: int = None):
+    """配置根logger
+
+    use_queue为True时根logger只挂QueueHandler，实际输出由QueueListener线程完成，
+    收发线程记录日志时只做入队，不会阻塞在控制台I/O上
+    """
+    global queue_listener
+    if rate is not None:
+        rate_limit_filter.rate = rate
+    if burst is not None:
+        rate_limit_filter.burst = burst
+    if handler is None:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(threadName)s] %(name)s: %(message)s'))
+
+    stop_logging()
+    root = logging.getLogger()
+    root.setLevel(level)
+    for old_handler in list(root.handlers):
+        root.removeHandler(old_handler)
+    if use_queue:
+        log_queue = queue.SimpleQueue()
+        root.addHandler(logging.handlers.QueueHandler(log_queue))
+        queue_listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+        queue_listener.start()
+    else:
+        root.addHandler(handler)
+
+
+def stop_logging():
+    """停止QueueListener并输出队列中剩余的日志"""
+    global queue_listener
+    if queue_listener is not None:
+        queue_listener.stop()
+        queue_listener = None
@@ -0,0 +1,357 @@
+import csv
+import json
+import os
+import threading
+import time
+from array import array
+from collections import deque
+
+from LogUtils import get_logger
+
+logger = get_logger(__name__)
+
+
+class LatencyHistogram(object):
+    """固定内存的HDR风格延迟直方图，单位us
+
+    每个2的幂区间分为sub_bucket_count个子桶，相对误差约为1/sub_bucket_count，
+    只有一个线程写入，读取时不加锁
+    """
+    SubBucketBits = 4
+    MaxExponent = 40  # 可记录到约2^44us
+
+    def __init__(self):
+        self.sub_bucket_count = 1 << self.SubBucketBits
+        self.counts = array('Q', [0]) * ((self.MaxExponent + 2) * self.sub_bucket_count)
+        self.reset()
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.total_count = 0
+        self.total_sum = 0
+        self.min_value = 0
+        self.max_value = 0
+
+    def _index(self, value: int):
+        if value < self.sub_bucket_count:
+            return value
+        exponent = value.bit_length() - self.SubBucketBits - 1
+        if exponent > self.MaxExponent:
+            return len(self.counts) - 1
+        return (exponent + 1) * self.sub_bucket_count + (value >> exponent) - self.sub_bucket_count
+
+    def _value(self, index: int):
+        """桶的上界"""
+        if index < self.sub_bucket_count:
+            return index
+        exponent = index // self.sub_bucket_count - 1
+        sub_bucket = index % self.sub_bucket_count + self.sub_bucket_count
+        return ((sub_bucket + 1) << exponent) - 1
+
+    def record(self, value: int):
+        value = max(int(value), 0)
+        self.counts[self._index(value)] += 1
+        if self.total_count == 0 or value < self.min_value:
+            self.min_value = value
+        if value > self.max_value:
+            self.max_value = value
+        self.total_count += 1
+        self.total_sum += value
+
+    def percentile(self, percent: float):
+        if self.total_count == 0:
+            return 0
+        target = max(1, int(self.total_count * percent / 100.0 + 0.5))
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if count:
+                cumulative += count
+                if cumulative >= target:
+                    return min(self._value(index), self.max_value)
+        return self.max_value
+
+    def mean(self):
+        if self.total_count == 0:
+            return 0.0
+        return self.total_sum / self.total_count
+
+    def snapshot(self):
+        return {
+            'count': self.total_count,
+            'min_us': self.min_value,
+            'mean_us': round(self.mean(), 1),
+            'p50_us': self.percentile(50),
+            'p90_us': self.percentile(90),
+            'p99_us': self.percentile(99),
+            'max_us': self.max_value,
+        }
+
+
+class ModbusRequestStats(object):
+    """单个从站单个功能码的统计"""
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.tx_bytes = 0
+        self.rx_bytes = 0
+        self.latency = LatencyHistogram()
+
+    def snapshot(self):
+        ret = {
+            'requests': self.requests,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'tx_bytes': self.tx_bytes,
+            'rx_bytes': self.rx_bytes,
+        }
+        ret.update(self.latency.snapshot())
+        return ret
+
+
+class ModbusBusStats(object):
+    """Modbus RTU总线统计，按从站和功能码记录请求数、错误、超时、延迟和线上字节数"""
+    StatusOk = 0
+    StatusError = 1
+    StatusTimeout = 2
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.request_stats = {}  # {(slave, code): ModbusRequestStats}
+        self.busy_ns = 0
+        self.start_ns = time.perf_counter_ns()
+
+    def record(self, slave: int, code: int, latency_ns: int, status: int, tx_bytes: int, rx_bytes: int):
+        key = (slave, code)
+        stats = self.request_stats.get(key)
+        if stats is None:
+            stats = ModbusRequestStats()
+            self.request_stats[key] = stats
+        stats.requests += 1
+        if status == self.StatusError:
+            stats.errors += 1
+        elif status == self.StatusTimeout:
+            stats.timeouts += 1
+        stats.tx_bytes += tx_bytes
+        stats.rx_bytes += rx_bytes
+        stats.latency.record(latency_ns // 1000)
+        self.busy_ns += latency_ns
+
+    def bus_busy_fraction(self):
+        elapsed_ns = time.perf_counter_ns() - self.start_ns
+        if elapsed_ns <= 0:
+            return 0.0
+        return min(self.busy_ns / elapsed_ns, 1.0)
+
+    def get_stats(self):
+        """当前统计的快照"""
+        slaves = {}
+        for (slave, code), stats in list(self.request_stats.items()):
+            slaves.setdefault(slave, {})[code] = stats.snapshot()
+        return {
+            'timestamp': time.time(),
+            'elapsed_s': round((time.perf_counter_ns() - self.start_ns) / 1e9, 3),
+            'bus_busy_fraction': round(self.bus_busy_fraction(), 4),
+            'slaves': slaves,
+        }
+
+    @staticmethod
+    def to_rows(stats):
+        """将get_stats()快照展开为CSV行"""
+        rows = []
+        for slave, codes in stats['slaves'].items():
+            for code, values in codes.items():
+                row = {'timestamp': stats['timestamp'], 'bus_busy_fraction': stats['bus_busy_fraction'],
+                       'slave': slave, 'code': code}
+                row.update(values)
+                rows.append(row)
+        return rows
+
+
+class PeriodicStatsDumper(object):
+    """后台线程周期性地将统计快照写入文件，.csv追加行，其他扩展名覆盖写入JSON"""
+    def __init__(self, get_stats, path: str, interval: float = 10.0, to_rows=None):
+        self.get_stats = get_stats
+        self.path = path
+        self.interval = interval
+        self.to_rows = to_rows
+        self.stop_event = threading.Event()
+        self.dump_thread = None
+
+    def start(self):
+        if self.dump_thread is None or not self.dump_thread.is_alive():
+            self.stop_event.clear()
+            self.dump_thread = threading.Thread(target=self._dump_loop, daemon=True)
+            self.dump_thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.dump_thread:
+            self.dump_thread.join()
+            self.dump_thread = None
+
+    def _dump_loop(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.dump()
+            except Exception as e:
+                logger.error("Error dumping stats to %s: %s", self.path, e)
+
+    def dump(self):
+        stats = self.get_stats()
+        if self.path.lower().endswith('.csv') and self.to_rows is not None:
+            rows = self.to_rows(stats)
+            if not rows:
+                return
+            is_new_file = not os.path.exists(self.path)
+            with open(self.path, 'a', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+                if is_new_file:
+                    writer.writeheader()
+                writer.writerows(rows)
+        else:
+            with open(self.path, 'w') as f:
+                json.dump(stats, f, indent=2)
+
+
+class FdxPeerStats(object):
+    """单个FDX对端的链路统计"""
+    def __init__(self):
+        self.datagrams_in = 0
+        self.bytes_in = 0
+        self.datagrams_out = 0
+        self.bytes_out = 0
+        self.lost = 0
+        self.out_of_order = 0
+        self.duplicates = 0
+        self.sequence_resets = 0
+        self.sequence_errors_reported = 0  # 对端通过SequenceNumberError报告的本端序列号错误
+        self.last_sequence_number = None
+        self.command_counts = {}
+        self.status_rtt = LatencyHistogram()
+
+    def snapshot(self):
+        datagrams_expected = self.datagrams_in - self.duplicates + self.lost
+        return {
+            'datagrams_in': self.datagrams_in,
+            'bytes_in': self.bytes_in,
+            'datagrams_out': self.datagrams_out,
+            'bytes_out': self.bytes_out,
+            'lost': self.lost,
+            'out_of_order': self.out_of_order,
+            'duplicates': self.duplicates,
+            'loss_rate': round(self.lost / datagrams_expected, 6) if datagrams_expected > 0 else 0.0,
+            'sequence_resets': self.sequence_resets,
+            'sequence_errors_reported': self.sequence_errors_reported,
+            'command_counts': dict(self.command_counts),
+            'status_rtt': self.status_rtt.snapshot(),
+        }
+
+
+class FdxLinkStats(object):
+    """FDX链路统计，按对端地址记录收发数据报、根据序列号推算的丢包/乱序/重复及状态请求往返时间
+
+    序列号在1~0x7FFF循环，0表示对端未使用序列号，0x8000位表示会话结束
+    """
+    SequenceNumberModulo = 0x7FFF
+    SequenceNumberSessionEnd = 0x8000
+    StatusRequestTimeoutNs = 5 * 1000 * 1000 * 1000
+
+    def __init__(self):
+        # StatusRequest由发送线程登记、由FDX接收线程配对
+        self.status_request_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.peers = {}
+        with self.status_request_lock:
+            self.pending_status_requests = deque()  # 已发送未应答的StatusRequest时间戳，最早的在左端
+        self.start_ns = time.perf_counter_ns()
+
+    def peer(self, addr):
+        peer_stats = self.peers.get(addr)
+        if peer_stats is None:
+            peer_stats = FdxPeerStats()
+            self.peers[addr] = peer_stats
+        return peer_stats
+
+    def record_received(self, addr, nbytes: int):
+        peer_stats = self.peer(addr)
+        peer_stats.datagrams_in += 1
+        peer_stats.bytes_in += nbytes
+
+    def record_sent(self, addr, nbytes: int):
+        peer_stats = self.peer(addr)
+        peer_stats.datagrams_out += 1
+        peer_stats.bytes_out += nbytes
+
+    def record_command(self, addr, command_code: int):
+        command_counts = self.peer(addr).command_counts
+        command_counts[command_code] = command_counts.get(command_code, 0) + 1
+
+    def record_sequence_number(self, addr, sequence_number: int):
+        if sequence_number == 0:
+            return
+        peer_stats = self.peer(addr)
+        is_session_end = sequence_number & self.SequenceNumberSessionEnd
+        sequence_number &= ~self.SequenceNumberSessionEnd & 0xFFFF
+        last = peer_stats.last_sequence_number
+        if last is None:
+            peer_stats.last_sequence_number = sequence_number
+        else:
+            distance = (sequence_number - last) % self.SequenceNumberModulo
+            if distance == 0:
+                peer_stats.duplicates += 1
+            elif distance < self.SequenceNumberModulo // 2:
+                peer_stats.lost += distance - 1
+                peer_stats.last_sequence_number = sequence_number
+            else:
+                # 比已收到的序列号更早，说明之前记为丢失的数据报迟到
+                peer_stats.out_of_order += 1
+                if peer_stats.lost > 0:
+                    peer_stats.lost -= 1
+        if is_session_end:
+            peer_stats.last_sequence_number = None
+            peer_stats.sequence_resets += 1
+
+    def record_sequence_number_error(self, addr):
+        self.peer(addr).sequence_errors_reported += 1
+
+    def _expire_status_requests(self, now_ns):
+        """丢弃超过StatusRequestTimeoutNs未应答的请求，调用方持有status_request_lock"""
+        pending = self.pending_status_requests
+        while pending and now_ns - pending[0] >= self.StatusRequestTimeoutNs:
+            pending.popleft()
+
+    def record_status_request_sent(self):
+        now_ns = time.perf_counter_ns()
+        with self.status_request_lock:
+            self._expire_status_requests(now_ns)
+            self.pending_status_requests.append(now_ns)
+
+    def record_status_received(self, addr):
+        """收到Status时与最早的未超时StatusRequest配对，返回往返时间(ns)"""
+        now_ns = time.perf_counter_ns()
+        with self.status_request_lock:
+            self._expire_status_requests(now_ns)
+            if not self.pending_status_requests:
+                return None
+            rtt_ns = now_ns - self.pending_status_requests.popleft()
+        self.peer(addr).status_rtt.record(rtt_ns // 1000)
+        return rtt_ns
+
+    def get_stats(self):
+        """当前统计的快照，对端地址转换为字符串"""
+        peers = {}
+        for addr, peer_stats in list(self.peers.items()):
+            key = f"{addr[0]}:{addr[1]}" if isinstance(addr, tuple) else str(addr)
+            peers[key] = peer_stats.snapshot()
+        return {
+            'timestamp': time.time(),
+            'elapsed_s': round((time.perf_counter_ns() - self.start_ns) / 1e9, 3),
+            'pending_status_requests': len(self.pending_status_requests),
+            'peers': peers,
+        }
@@ -0,0 +1,163 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from LogUtils import get_logger
+
+logger = get_logger(__name__)
+
+
+def format_metrics(samples):
+    """将[(name, type, help, labels, value), ...]格式化为Prometheus文本格式"""
+    lines = []
+    described = set()
+    for name, metric_type, help_text, labels, value in sorted(samples, key=lambda sample: sample[0]):
+        if name not in described:
+            described.add(name)
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+        if labels:
+            label_text = ','.join(f'{key}="{str(label_value)}"' for key, label_value in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}")
+        else:
+            lines.append(f"{name} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+def lateness_metrics(thread: str, lateness):
+    """线程唤醒延迟，lateness为LoopLateness.snapshot()"""
+    labels = {'thread': thread}
+    samples = [('thread_wakeup_lateness_max_seconds', 'gauge', 'Maximum thread wakeup lateness', labels,
+                lateness['max_us'] / 1e6)]
+    for quantile in ('50', '90', '99'):
+        samples.append(('thread_wakeup_lateness_seconds', 'summary', 'Actual minus intended thread wakeup time',
+                        dict(labels, quantile=f"0.{quantile}"), lateness[f'p{quantile}_us'] / 1e6))
+    return samples
+
+
+def fdx_metrics(fdx):
+    """VectorFDX链路统计"""
+    samples = []
+    stats = fdx.get_link_stats()
+    for peer, peer_stats in stats['peers'].items():
+        labels = {'peer': peer}
+        samples += [
+            ('fdx_datagrams_received_total', 'counter', 'FDX datagrams received', labels, peer_stats['datagrams_in']),
+            ('fdx_bytes_received_total', 'counter', 'FDX bytes received', labels, peer_stats['bytes_in']),
+            ('fdx_datagrams_sent_total', 'counter', 'FDX datagrams sent', labels, peer_stats['datagrams_out']),
+            ('fdx_bytes_sent_total', 'counter', 'FDX bytes sent', labels, peer_stats['bytes_out']),
+            ('fdx_datagrams_lost_total', 'counter', 'FDX datagrams lost by sequence number', labels, peer_stats['lost']),
+            ('fdx_datagrams_out_of_order_total', 'counter', 'FDX datagrams received out of order', labels,
+             peer_stats['out_of_order']),
+            ('fdx_datagrams_duplicate_total', 'counter', 'FDX duplicate datagrams', labels, peer_stats['duplicates']),
+        ]
+        for command_code, count in peer_stats['command_counts'].items():
+            samples.append(('fdx_commands_received_total', 'counter', 'FDX commands received by command code',
+                            {'peer': peer, 'command': f"0x{command_code:04X}"}, count))
+    samples += lateness_metrics('fdx_receive', stats['receive_lateness'])
+    return samples
+
+
+def modbus_metrics(modbus_client):
+    """SerialModbusRTUClient总线统计"""
+    stats = modbus_client.get_stats()
+    samples = [
+        ('modbus_bus_busy_ratio', 'gauge', 'Fraction of time the serial bus is busy', {}, stats['bus_busy_fraction']),
+        ('modbus_cycles_total', 'counter', 'Completed cyclic read rounds', {}, stats['cycle_count']),
+        ('modbus_request_queue_depth', 'gauge', 'Queued Modbus requests', {}, stats['request_queue_size']),
+        ('modbus_requests_dropped_total', 'counter', 'Requests dropped because the queue was full or deadline passed',
+         {}, stats['dropped_requests']),
+        ('modbus_offline_slaves', 'gauge', 'Slaves considered offline', {}, len(stats['offline_slaves'])),
+    ]
+    samples += lateness_metrics('modbus_bus', stats['bus_lateness'])
+    for slave, codes in stats['slaves'].items():
+        for code, values in codes.items():
+            labels = {'slave': slave, 'code': f"0x{code:02X}"}
+            samples += [
+                ('modbus_requests_total', 'counter', 'Modbus requests', labels, values['requests']),
+                ('modbus_errors_total', 'counter', 'Modbus error responses', labels, values['errors']),
+                ('modbus_timeouts_total', 'counter', 'Modbus requests without response', labels, values['timeouts']),
+                ('modbus_latency_mean_seconds', 'gauge', 'Mean Modbus round-trip latency', labels,
+                 values['mean_us'] / 1e6),
+            ]
+            for quantile in ('50', '90', '99'):
+                samples.append(('modbus_latency_seconds', 'summary', 'Modbus round-trip latency',
+                                dict(labels, quantile=f"0.{quantile}"), values[f'p{quantile}_us'] / 1e6))
+    return samples
+
+
+def latency_metrics(latency_tracer):
+    """LatencyTracer端到端延迟"""
+    samples = []
+    for path, values in latency_tracer.get_stats().items():
+        labels = {'path': path}
+        samples += [
+            ('bridge_latency_count', 'counter', 'Traced end-to-end transfers', labels, values['count']),
+            ('bridge_latency_outliers_total', 'counter', 'End-to-end transfers above the outlier threshold', labels,
+             values['outliers']),
+            ('bridge_latency_max_seconds', 'gauge', 'Maximum end-to-end latency', labels, values['max_us'] / 1e6),
+        ]
+        for quantile in ('50', '90', '99'):
+            samples.append(('bridge_latency_seconds', 'summary', 'End-to-end latency',
+                            dict(labels, quantile=f"0.{quantile}"), values[f'p{quantile}_us'] / 1e6))
+    return samples
+
+
+class MetricsServer(object):
+    """在本机后台线程中提供/metrics接口
+
+    每次请求时调用各collector从统计对象生成快照，统计对象由收发线程单线程写入，
+    读取时不加锁，因此抓取不会阻塞数据通路
+    """
+    def __init__(self, host: str = '127.0.0.1', port: int = 9108):
+        self.host = host
+        self.port = port
+        self.collectors = []
+        self.http_server = None
+        self.server_thread = None
+
+    def add_collector(self, collector):
+        """collector: 无参可调用对象，返回[(name, type, help, labels, value), ...]"""
+        self.collectors.append(collector)
+
+    def collect(self):
+        samples = []
+        for collector in list(self.collectors):
+            try:
+                samples += collector()
+            except Exception as e:
+                logger.warning("Metrics collector %s error: %s", collector, e)
+        return format_metrics(samples)
+
+    def start(self):
+        if self.http_server is not None:
+            return
+        metrics_server = self
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics_server.collect().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.http_server = ThreadingHTTPServer((self.host, self.port), MetricsRequestHandler)
+        self.http_server.daemon_threads = True
+        self.server_thread = threading.Thread(target=self.http_server.serve_forever, daemon=True)
+        self.server_thread.start()
+        logger.info("Metrics endpoint http://%s:%d/metrics", self.host, self.port)
+
+    def stop(self):
+        if self.http_server is not None:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+            self.server_thread.join()
+            self.http_server = None
+            self.server_thread = None
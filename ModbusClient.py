@@ -1,12 +1,48 @@
+import itertools
 import threading
+import time
+from concurrent.futures import Future, TimeoutError
 from threading import Event
-from queue import Queue
+from queue import PriorityQueue, Full, Empty
 from typing import Optional
 
-from pymodbus import FramerType
-from pymodbus.client import ModbusSerialClient, AsyncModbusUdpClient
-from pymodbus.exceptions import ModbusException, ModbusIOException
+from LogUtils import get_logger
+from Metrics import ModbusBusStats, PeriodicStatsDumper
+from PollScheduler import CyclePollScheduler
+from RegisterImage import RegisterImage
+from ThreadTuning import LoopLateness, apply_thread_scheduling
 
+logger = get_logger(__name__)
+
+
+class _PymodbusNotLoaded(Exception):
+    """pymodbus加载前异常类的占位，不会被抛出"""
+
+
+# pymodbus导入较慢，在第一次连接时由load_pymodbus()加载
+ModbusException = ModbusIOException = _PymodbusNotLoaded
+pymodbus = None
+
+
+def load_pymodbus():
+    """导入pymodbus并替换模块中的异常类，返回pymodbus模块"""
+    global pymodbus, ModbusException, ModbusIOException
+    if pymodbus is None:
+        import pymodbus.client
+        import pymodbus.exceptions
+        ModbusException = pymodbus.exceptions.ModbusException
+        ModbusIOException = pymodbus.exceptions.ModbusIOException
+    return pymodbus
+
+
+
+class RequestQueueFull(TimeoutError):
+    """请求队列已满，请求未入队"""
+
+
+def is_queue_full(future: Future):
+    """put_request_queue()返回的Future是否因队列满而未入队"""
+    return future.done() and not future.cancelled() and isinstance(future.exception(), RequestQueueFull)
 
 
 class ModbusRequestParameter:
@@ -18,6 +54,11 @@ class ModbusRequestParameter:
         self.address= 0
         self.count=1
         self.no_response_expected=False
+        self.is_notify_handler = True  # 是否同时调用通用的response处理函数
+        self.future = None
+        self.deadline = None  # time.monotonic()时刻，超过后不再执行
+        self.trace_ns = None  # 端到端延迟跟踪的起点(time.perf_counter_ns())
+        self.enqueue_ns = None  # 入队时刻(time.perf_counter_ns())
 
     def init(self):
         self.code = None
@@ -27,6 +68,77 @@ class ModbusRequestParameter:
         self.address = 0
         self.count = 1
         self.no_response_expected = False
+        self.is_notify_handler = True
+        self.future = None
+        self.deadline = None
+        self.trace_ns = None
+        self.enqueue_ns = None
+
+
+def is_valid_read_request(address: int, count: int, max_count: int = 125):
+    """一次Modbus读取的寄存器个数为1-max_count，且不超出地址范围"""
+    return 1 <= count <= max_count and address + count <= 0x10000
+
+
+def coalesce_read_requests(requests, max_count: int = 125):
+    """合并同一从站相邻或重叠的读取范围，返回[(slave, address, count), ...]
+
+    寄存器个数不合法的请求不会被从站接受，不生成块，结果中按读取失败返回
+    """
+    blocks = []
+    for slave, address, count in sorted(set(requests)):
+        if not is_valid_read_request(address, count, max_count):
+            continue
+        if blocks:
+            block_slave, block_address, block_count = blocks[-1]
+            block_end = block_address + block_count
+            end = max(block_end, address + count)
+            if block_slave == slave and address <= block_end and end - block_address <= max_count:
+                blocks[-1] = (block_slave, block_address, end - block_address)
+                continue
+        blocks.append((slave, address, count))
+    return blocks
+
+
+class ModbusReadBatch:
+    """一批读取请求，全部完成后按原始请求顺序整理结果"""
+    def __init__(self, batch_id, requests, max_count: int = 125):
+        self.batch_id = batch_id
+        self.max_count = max_count
+        self.requests = [tuple(request) for request in requests]
+        self.blocks = coalesce_read_requests(self.requests, max_count)
+        self.block_registers = {}
+        self.pending = len(self.blocks)
+        # 块在总线线程中完成，队列满未入队的块在提交线程中完成
+        self.lock = threading.Lock()
+
+    def block_done(self, block, registers):
+        """记录一个合并块的读取结果，返回整批是否已完成"""
+        with self.lock:
+            self.block_registers[block] = registers
+            self.pending -= 1
+            return self.pending == 0
+
+    def results(self):
+        """[(slave, address, count, registers或None), ...]"""
+        results = []
+        for slave, address, count in self.requests:
+            registers = None
+            if not is_valid_read_request(address, count, self.max_count):
+                results.append((slave, address, count, registers))
+                continue
+            for block in self.blocks:
+                block_slave, block_address, block_count = block
+                if block_slave == slave and block_address <= address and \
+                        address + count <= block_address + block_count:
+                    block_registers = self.block_registers.get(block)
+                    if block_registers is not None:
+                        offset = address - block_address
+                        registers = list(block_registers[offset:offset + count])
+                    break
+            results.append((slave, address, count, registers))
+        return results
+
 
 class SerialModbusRTUClient(object):
     CodeReadCoils = 0x01
@@ -38,6 +150,14 @@ class SerialModbusRTUClient(object):
     CodeReadExceptionStatus = 0x07
     CodeWriteRegisters = 0x10
 
+    # 请求优先级，数值越小越先执行
+    RequestPriorityHigh = 0
+    RequestPriorityNormal = 1
+    RequestPriorityLow = 2
+
+    # 单次读取保持寄存器的最大数量
+    MaxReadRegistersCount = 125
+
     def __init__(self,
                  port='com1',
                  serial_baud_rate: int = 115200,
@@ -61,11 +181,19 @@ class SerialModbusRTUClient(object):
         self.retries = serial_retries
 
         self.is_connected = False
-        self.modbus_cycle_thread = None
+        # 唯一占用串口总线的线程，周期读取与单次请求都在此线程中按固定规则交替执行
+        self.modbus_bus_thread = None
+        self.is_bus_thread_running = False
+        self.bus_idle_wait = 0.1  # 无请求且未周期读取时等待队列的超时时间(秒)
+        self.bus_lock = threading.Lock()  # 同步读写接口与总线线程互斥，避免RTU帧交错
         self.modbus_cycle_is_run_event = threading.Event()
-        self.is_stop_cycle_loop = False
-        self.modbus_single_thread = None
-        self.request_queue = Queue(maxsize=queue_maxsize)  # 使用 maxsize
+        self.poll_scheduler = CyclePollScheduler()
+        self.bus_thread_scheduling = None  # 总线线程的CPU亲和性和调度策略，见ThreadTuning.apply_thread_scheduling
+        self.bus_lateness = LoopLateness()  # 总线线程空闲等待后的唤醒延迟
+        self.bus_stats = ModbusBusStats()
+        self.stats_dumper = None
+        self.request_queue = PriorityQueue(maxsize=queue_maxsize)  # 使用 maxsize
+        self.request_sequence = itertools.count()  # 同优先级按入队顺序执行
         # self.request_parameter = ModbusRequestParameter()
         self.stop_read_cycle_request_event = Event()  # 控制添加请求线程停止的事件
         self.modbus_response_handlers = {
@@ -75,7 +203,7 @@ class SerialModbusRTUClient(object):
             self.CodeReadInputRegisters: self.handler_read_input_registers_response,
             self.CodeWriteSingleCoil: self.handler_write_single_coil_response,
             self.CodeWriteRegister: self.handler_write_register_response,
-
+            self.CodeWriteRegisters: self.handler_write_registers_response,
         }
 
         self.slaves_list = {
@@ -85,6 +213,12 @@ class SerialModbusRTUClient(object):
         }
         self.cycle_read_slaves_list = [1]
         self.offline_slaves_list = []
+        self.offline_threshold = 3  # 连续超时次数达到该值时认为从站离线
+        self.slave_timeout_counts = {}
+        self.dropped_requests = 0  # 队列满或超过截止时间而未执行的请求数
+        self.register_recorder = None  # RegisterRecorder，记录周期读取到的整个从站寄存器值
+        self.register_image = None  # RegisterImage，各从站寄存器的最新值，连接时按slaves_list创建
+        self.latency_tracer = None  # LatencyTracer，记录带trace_ns的队列请求从FDX接收到从站应答的延迟
 
         self.modbus_request_handlers = {
             # self.CodeReadCoils: self.handler_read_coils_response,
@@ -96,17 +230,33 @@ class SerialModbusRTUClient(object):
             self.CodeWriteRegisters: self._write_registers,
         }
 
-    def create_cycle_and_single_thread(self):
-        if self.modbus_cycle_thread is None or not self.modbus_cycle_thread.is_alive():
-            self.modbus_cycle_thread = threading.Thread(target=self._cycle_read__loop, daemon=True)
-        if self.modbus_single_thread is None or not self.modbus_single_thread.is_alive():
-            self.modbus_single_thread = threading.Thread(target=self._single__loop, daemon=True)
-            self.modbus_single_thread.start()
+    def create_bus_thread(self):
+        if self.modbus_bus_thread is None or not self.modbus_bus_thread.is_alive():
+            self.is_bus_thread_running = True
+            self.bus_stats.reset()
+            self.bus_lateness.reset()
+            self.modbus_bus_thread = threading.Thread(target=self._bus_owner_loop, daemon=True)
+            self.modbus_bus_thread.start()
+
+    def stop_bus_thread(self):
+        if self.modbus_bus_thread is not None and self.modbus_bus_thread.is_alive():
+            self.is_bus_thread_running = False
+            self._wake_bus_thread()
+            if self.modbus_bus_thread is not threading.current_thread():
+                self.modbus_bus_thread.join()
+
+    def _wake_bus_thread(self):
+        """唤醒等待队列的总线线程，空请求不会被执行"""
+        try:
+            self.request_queue.put_nowait((self.RequestPriorityHigh, next(self.request_sequence), None))
+        except Full:
+            pass
 
     def create_modbus_rtu_service(self):
         if not self.is_connected:
             try:
-                self.modbus_client = ModbusSerialClient(
+                load_pymodbus()
+                self.modbus_client = pymodbus.client.ModbusSerialClient(
                     port=self.port,
                     baudrate=self.serial_baud_rate,
                     bytesize=self.serial_bytesize,
@@ -116,83 +266,192 @@ class SerialModbusRTUClient(object):
                     retries=self.retries,
                 )
                 if not self.modbus_client.connect():
-                    print(f"无法连接到从站进行写入")
+                    logger.error("无法连接到从站进行写入")
                     return False
 
                 self.is_connected = True
-                self.create_cycle_and_single_thread()
+                if self.register_image is None or self.register_image.entries != self.slaves_list:
+                    self.register_image = RegisterImage(self.slaves_list)
+                self.create_bus_thread()
                 return True
             except ModbusException as e:
-                print(f"向从站写入数据时发生错误: {e}")
+                logger.error("向从站写入数据时发生错误: %s", e)
                 return False
             except Exception as e:
-                print(f"创建modbus rtu错误:{e}")
+                logger.error("创建modbus rtu错误:%s", e)
                 return False
+    def update_poll_set(self, slaves_list: dict, cycle_read_slaves_list: list, register_image=None):
+        """运行中替换从站寄存器数量和周期读取列表，不断开串口
+
+        寄存器映像条目与新的slaves_list不同时换成register_image(未提供时新建RegisterImage)，并拷贝已有的寄存器值；
+        总线线程每次读取前重新获取这些属性，下一次周期读取即使用新配置
+        """
+        old_image = self.register_image
+        if register_image is None and old_image is not None and old_image.entries != slaves_list:
+            register_image = RegisterImage(slaves_list)
+        if register_image is not None and register_image is not old_image:
+            if old_image is not None:
+                register_image.copy_from(old_image)
+            self.register_image = register_image
+        self.slaves_list = slaves_list
+        self.cycle_read_slaves_list = cycle_read_slaves_list
+
     def start_cycle_read__loop(self):
-        if self.modbus_cycle_thread is not None and self.is_connected:
+        if self.is_connected:
+            self.create_bus_thread()
             self.modbus_cycle_is_run_event.set()
-            self.is_stop_cycle_loop = False
-            self.create_cycle_and_single_thread()
-            self.modbus_cycle_thread.start()
+            self._wake_bus_thread()
 
     def stop_cycle_read__loop(self):
-        if self.is_connected and self.modbus_cycle_thread.is_alive():
-            self.modbus_cycle_is_run_event.clear()
-            self.is_stop_cycle_loop = True
-            self.modbus_cycle_thread.join()
-
-    # 处理单个指令，如用户请求的写入读取指令
-    def _single__loop(self):
-        if self.is_connected:
-            while True:
+        """停止周期读取，正在进行的单次读取会在总线线程中完成"""
+        self.modbus_cycle_is_run_event.clear()
+
+    def get_bus_utilization(self):
+        """总线线程启动以来串口处于收发状态的时间占比"""
+        return self.bus_stats.bus_busy_fraction()
+
+    def get_stats(self):
+        """总线统计快照: 每个从站每个功能码的请求数、错误/超时数、延迟分布、线上字节数及总线占用率"""
+        stats = self.bus_stats.get_stats()
+        stats['cycle_count'] = self.poll_scheduler.cycle_count
+        stats['request_queue_size'] = self.request_queue.qsize()
+        stats['dropped_requests'] = self.dropped_requests
+        stats['offline_slaves'] = list(self.offline_slaves_list)
+        stats['bus_lateness'] = self.bus_lateness.snapshot()
+        return stats
+
+    def start_stats_dump(self, path: str, interval: float = 10.0):
+        """周期性将get_stats()写入文件，.csv追加行，.json覆盖写入"""
+        self.stop_stats_dump()
+        self.stats_dumper = PeriodicStatsDumper(self.get_stats, path, interval, ModbusBusStats.to_rows)
+        self.stats_dumper.start()
+
+    def stop_stats_dump(self):
+        if self.stats_dumper is not None:
+            self.stats_dumper.stop()
+            self.stats_dumper = None
+
+    @classmethod
+    def rtu_frame_bytes(cls, code, status, count: int = 1, values=None):
+        """RTU请求和应答帧的字节数(含地址和CRC)"""
+        if code == cls.CodeWriteRegisters:
+            tx_bytes = 9 + 2 * len(values or [])
+        else:
+            tx_bytes = 8
+        if status == ModbusBusStats.StatusTimeout:
+            rx_bytes = 0
+        elif status == ModbusBusStats.StatusError:
+            rx_bytes = 5
+        elif code == cls.CodeReadHoldingRegisters:
+            rx_bytes = 5 + 2 * count
+        else:
+            rx_bytes = 8
+        return tx_bytes, rx_bytes
+
+    def _bus_transaction(self, code, method, **kwargs):
+        """在总线锁内执行一次Modbus收发并记录统计"""
+        with self.bus_lock:
+            status = ModbusBusStats.StatusError
+            start_ns = time.perf_counter_ns()
+            try:
+                response = method(**kwargs)
+                if response is None or not response.isError():
+                    status = ModbusBusStats.StatusOk
+                elif isinstance(response, ModbusIOException):
+                    status = ModbusBusStats.StatusTimeout
+                return response
+            except ModbusIOException:
+                status = ModbusBusStats.StatusTimeout
+                raise
+            finally:
+                latency_ns = time.perf_counter_ns() - start_ns
+                tx_bytes, rx_bytes = self.rtu_frame_bytes(code, status, kwargs.get('count', 1), kwargs.get('values'))
+                self.bus_stats.record(kwargs.get('slave', 1), code, latency_ns, status, tx_bytes, rx_bytes)
+                self._update_slave_online(kwargs.get('slave', 1), status)
+
+    def _update_slave_online(self, slave, status):
+        """连续超时达到offline_threshold次的从站加入offline_slaves_list，有应答后移除"""
+        if status == ModbusBusStats.StatusTimeout:
+            timeout_count = self.slave_timeout_counts.get(slave, 0) + 1
+            self.slave_timeout_counts[slave] = timeout_count
+            if timeout_count >= self.offline_threshold and slave not in self.offline_slaves_list:
+                self.offline_slaves_list.append(slave)
+                logger.warning("Slave %s offline after %d timeouts", slave, timeout_count)
+        elif self.slave_timeout_counts.get(slave):
+            self.slave_timeout_counts[slave] = 0
+            if slave in self.offline_slaves_list:
+                self.offline_slaves_list.remove(slave)
+                logger.info("Slave %s online", slave)
+
+    # 总线线程: 队列请求与周期读取交替执行，交替规则见PollScheduler.CyclePollScheduler
+    def _bus_owner_loop(self):
+        apply_thread_scheduling('modbus_bus', self.bus_thread_scheduling)
+        scheduler = self.poll_scheduler
+        scheduler.restart()
+        while self.is_bus_thread_running:
+            cycle_slaves = self.cycle_read_slaves_list if self.modbus_cycle_is_run_event.is_set() else []
+            request_param = None
+            if scheduler.is_request_turn(cycle_slaves):
                 try:
-                    request_param = self.request_queue.get()
-                    self.request_handle_command(request_param)
-
-                except ModbusIOException as e:
-                    print(f"Modbus IO Error during writing: {e}")
-                    self.is_connected = False
-                    break
-                except Exception as e:
-                    print(f"Error during writing: {e}")
-
-    # 根据配置文件周期读取多个寄存器
-    def _cycle_read__loop(self):
-        while True:
-            if self.is_stop_cycle_loop:
-                return
-            if self.modbus_cycle_is_run_event.is_set():
+                    if cycle_slaves:
+                        _, _, request_param = self.request_queue.get_nowait()
+                    else:
+                        # 空闲等待: 超时按预期超时时刻、收到请求按入队时刻统计唤醒延迟
+                        wait_start_ns = time.perf_counter_ns()
+                        try:
+                            _, _, request_param = self.request_queue.get(timeout=self.bus_idle_wait)
+                        except Empty:
+                            self.bus_lateness.record(wait_start_ns + int(self.bus_idle_wait * 1e9))
+                            raise
+                        if request_param is not None and request_param.enqueue_ns is not None:
+                            self.bus_lateness.record(max(request_param.enqueue_ns, wait_start_ns))
+                except Empty:
+                    pass
+            if request_param is not None:
                 try:
-                    for slave in self.cycle_read_slaves_list:
-                        count = self.slaves_list.get(slave)
-                        if count:
-                            self._read_holding_registers_for_cycle_loop(address=0,count=count,slave=slave)
-                except ModbusIOException as e:
-                    print(f"Modbus IO Error during reading: {e}")
-                    self.is_connected = False
-                    break
+                    self.request_handle_command(request_param)
                 except Exception as e:
-                    print(f"Error during reading: {e}")
-            else:
-                self.modbus_cycle_is_run_event.wait()
+                    logger.error("Error during request: %s", e)
+                scheduler.request_done()
+                continue
+            slave = scheduler.next_cycle_slave(cycle_slaves)
+            if slave is None:
+                continue
+            count = self.slaves_list.get(slave)
+            if count:
+                self._read_holding_registers_for_cycle_loop(address=0, count=count, slave=slave)
 
     def request_handle_command(self, request_parameter:ModbusRequestParameter):
-        """根据request_parameter调用相应的处理函数"""
+        """根据request_parameter调用相应的处理函数，结果或异常写入request_parameter.future"""
+        future = request_parameter.future or Future()
+        if not future.set_running_or_notify_cancel():
+            return
         handler = self.modbus_request_handlers.get(request_parameter.code)
-        if handler:
+        if not handler:
+            logger.warning("Unknown code: %s", request_parameter.code)
+            future.set_exception(ValueError(f"Unknown code: {request_parameter.code}"))
+            return
+        if request_parameter.deadline is not None and time.monotonic() > request_parameter.deadline:
+            self.dropped_requests += 1
+            future.set_exception(TimeoutError("request deadline exceeded before execution"))
+            return
+        try:
             params = vars(request_parameter)
-            handler(**params)
-        else:
-            print(f"Unknown code: {request_parameter.code}")
+            future.set_result(handler(**params))
+        except Exception as e:
+            future.set_exception(e)
+            return
+        if request_parameter.trace_ns is not None and self.latency_tracer is not None:
+            self.latency_tracer.record(self.latency_tracer.PathFdxToModbus, request_parameter.trace_ns,
+                                       label=f"slave {request_parameter.slave} code {request_parameter.code:#04x}")
 
     def write_register(self, address: int, value: int, *, slave: int = 1,
                        no_response_expected: bool = False,**kwargs):
         """写从站寄存器"""
         try:
-            self.modbus_cycle_is_run_event.clear()
-            response = self.modbus_client.write_register(slave=slave, address=address, value=value,
-                                                    no_response_expected=no_response_expected)
-            self.modbus_cycle_is_run_event.set()
+            response = self._bus_transaction(self.CodeWriteRegister, self.modbus_client.write_register,
+                                             slave=slave, address=address, value=value,
+                                             no_response_expected=no_response_expected)
             if not response.isError():
                 self.response_handle_command(slave, self.CodeWriteRegister,response)
                 # return response.registers
@@ -202,40 +461,65 @@ class SerialModbusRTUClient(object):
             return None
 
     def _write_register(self, address: int, value: int, *, slave: int = 1,
-                       no_response_expected: bool = False,**kwargs):
-        """写从站寄存器"""
-        try:
-            self.modbus_cycle_is_run_event.clear()
-            response = self.modbus_client.write_register(slave=slave, address=address, value=value,
-                                                    no_response_expected=no_response_expected)
-            self.modbus_cycle_is_run_event.set()
-            if not response.isError():
-                self.response_handle_command(slave, self.CodeWriteRegister,response)
-                # return response.registers
-            else:
-                return None
-        except:
+                       no_response_expected: bool = False, is_notify_handler: bool = True, **kwargs):
+        """写从站寄存器，返回response，失败时抛出异常"""
+        response = self._bus_transaction(self.CodeWriteRegister, self.modbus_client.write_register,
+                                         slave=slave, address=address, value=value,
+                                         no_response_expected=no_response_expected)
+        return self._check_response(slave, self.CodeWriteRegister, response, is_notify_handler)
+
+    def _check_response(self, slave, code, response, is_notify_handler: bool = True):
+        """检查队列请求的response，错误时抛出ModbusException"""
+        if response is None:
             return None
+        if response.isError():
+            raise ModbusException(f"slave {slave} code {code:#04x} error response: {response}")
+        if is_notify_handler:
+            self.response_handle_command(slave, code, response)
+        return response
+
+    def put_request_queue(self, request_parameter: ModbusRequestParameter, priority: int = RequestPriorityNormal,
+                          timeout: Optional[float] = None, block: bool = True):
+        """按优先级加入请求队列，返回执行结果的Future
+
+        timeout为从入队开始计算的截止时间(秒)，队列满等待超时或执行前已超时时Future抛出TimeoutError；
+        block为False时队列满立即返回，用于GUI线程和FDX接收线程等不能等待总线的调用方，
+        队列满时Future抛出RequestQueueFull(TimeoutError的子类)
+        """
+        future = Future()
+        request_parameter.future = future
+        if timeout is not None:
+            request_parameter.deadline = time.monotonic() + timeout
+        request_parameter.enqueue_ns = time.perf_counter_ns()
+        try:
+            self.request_queue.put((priority, next(self.request_sequence), request_parameter), block=block,
+                                   timeout=timeout)
+        except Full:
+            self.dropped_requests += 1
+            future.set_exception(RequestQueueFull("request queue is full"))
+        return future
 
     def add_write_register_queue(self, address: int, value: int, *, slave: int = 1,
-                               no_response_expected: bool = False):
+                               no_response_expected: bool = False,
+                               priority: int = RequestPriorityNormal, timeout: Optional[float] = None,
+                               trace_ns: Optional[int] = None, block: bool = True) -> Future:
         request_parameter = ModbusRequestParameter()
         request_parameter.code=self.CodeWriteRegister
         request_parameter.value=value
         request_parameter.address = address
         request_parameter.slave = slave
         request_parameter.no_response_expected = no_response_expected
+        request_parameter.trace_ns = trace_ns
 
-        self.request_queue.put(request_parameter)
+        return self.put_request_queue(request_parameter, priority, timeout, block)
 
     def write_registers(self, address: int, values: list[int], *, slave: int = 1,
                        no_response_expected: bool = False,**kwargs):
         """写从站寄存器"""
         try:
-            self.modbus_cycle_is_run_event.clear()
-            response = self.modbus_client.write_registers(slave=slave, address=address, values=values,
-                                                    no_response_expected=no_response_expected)
-            self.modbus_cycle_is_run_event.set()
+            response = self._bus_transaction(self.CodeWriteRegisters, self.modbus_client.write_registers,
+                                             slave=slave, address=address, values=values,
+                                             no_response_expected=no_response_expected)
             if not response.isError():
                 self.response_handle_command(slave, self.CodeWriteRegister,response)
                 # return response.registers
@@ -245,40 +529,34 @@ class SerialModbusRTUClient(object):
             return None
 
     def _write_registers(self, address: int, values: list[int], *, slave: int = 1,
-                       no_response_expected: bool = False,**kwargs):
-        """写从站寄存器"""
-        try:
-            self.modbus_cycle_is_run_event.clear()
-            response = self.modbus_client.write_registers(slave=slave, address=address, values=values,
-                                                    no_response_expected=no_response_expected)
-            self.modbus_cycle_is_run_event.set()
-            if not response.isError():
-                self.response_handle_command(slave, self.CodeWriteRegister,response)
-                # return response.registers
-            else:
-                return None
-        except Exception as e:
-            return None
+                       no_response_expected: bool = False, is_notify_handler: bool = True, **kwargs):
+        """写从站寄存器，返回response，失败时抛出异常"""
+        response = self._bus_transaction(self.CodeWriteRegisters, self.modbus_client.write_registers,
+                                         slave=slave, address=address, values=values,
+                                         no_response_expected=no_response_expected)
+        return self._check_response(slave, self.CodeWriteRegisters, response, is_notify_handler)
 
     def add_write_registers_queue(self, address: int, values: list[int], *, slave: int = 1,
-                               no_response_expected: bool = False):
+                               no_response_expected: bool = False,
+                               priority: int = RequestPriorityNormal, timeout: Optional[float] = None,
+                               trace_ns: Optional[int] = None, block: bool = True) -> Future:
         request_parameter = ModbusRequestParameter()
         request_parameter.code=self.CodeWriteRegisters
         request_parameter.values=values
         request_parameter.address = address
         request_parameter.slave = slave
         request_parameter.no_response_expected = no_response_expected
+        request_parameter.trace_ns = trace_ns
 
-        self.request_queue.put(request_parameter)
+        return self.put_request_queue(request_parameter, priority, timeout, block)
 
     def read_holding_registers(self, address: int, count: int, *, slave: int = 1,
                                no_response_expected: bool = False,**kwargs):
         """读从站寄存器"""
         try:
-            self.modbus_cycle_is_run_event.clear()
-            response = self.modbus_client.read_holding_registers(slave=slave, address=address, count=count,
-                                                            no_response_expected=no_response_expected)
-            self.modbus_cycle_is_run_event.set()
+            response = self._bus_transaction(self.CodeReadHoldingRegisters, self.modbus_client.read_holding_registers,
+                                             slave=slave, address=address, count=count,
+                                             no_response_expected=no_response_expected)
             if not response.isError():
                 self.response_handle_command(slave, self.CodeReadHoldingRegisters,response)
                 # return response.registers
@@ -290,9 +568,15 @@ class SerialModbusRTUClient(object):
                                no_response_expected: bool = False,**kwargs):
         """读从站寄存器"""
         try:
-            response = self.modbus_client.read_holding_registers(slave=slave, address=address, count=count,
-                                                            no_response_expected=no_response_expected)
+            response = self._bus_transaction(self.CodeReadHoldingRegisters, self.modbus_client.read_holding_registers,
+                                             slave=slave, address=address, count=count,
+                                             no_response_expected=no_response_expected)
             if not response.isError():
+                self._update_register_image(slave, address, response.registers)
+                # 只记录从地址0读取整个从站的周期读取，队列中的部分读取与记录的行不对应
+                register_recorder = self.register_recorder
+                if register_recorder is not None and address == 0:
+                    register_recorder.append(slave, response.registers)
                 self.response_handle_command(slave, self.CodeReadHoldingRegisters,response)
                 # return response.registers
             else:
@@ -300,38 +584,79 @@ class SerialModbusRTUClient(object):
         except:
             return None
 
+    def _update_register_image(self, slave, address, registers):
+        """总线线程中更新寄存器映像，是映像唯一的写入方"""
+        register_image = self.register_image
+        if register_image is not None:
+            register_image.update(slave, registers, offset=address)
+
     def _read_holding_registers(self, address: int, count: int, *, slave: int = 1,
-                               no_response_expected: bool = False,**kwargs):
-        """读从站寄存器"""
-        try:
-            self.modbus_cycle_is_run_event.clear()
-            response = self.modbus_client.read_holding_registers(slave=slave, address=address, count=count,
-                                                            no_response_expected=no_response_expected)
-            self.modbus_cycle_is_run_event.clear()
-            if not response.isError():
-                self.response_handle_command(slave, self.CodeReadHoldingRegisters,response)
-                # return response.registers
-            else:
-                return None
-        except:
-            return None
+                               no_response_expected: bool = False, is_notify_handler: bool = True, **kwargs):
+        """读从站寄存器，返回response，失败时抛出异常"""
+        response = self._bus_transaction(self.CodeReadHoldingRegisters, self.modbus_client.read_holding_registers,
+                                         slave=slave, address=address, count=count,
+                                         no_response_expected=no_response_expected)
+        if response is not None and not response.isError():
+            self._update_register_image(slave, address, response.registers)
+        return self._check_response(slave, self.CodeReadHoldingRegisters, response, is_notify_handler)
 
     def add_read_holding_registers_queue(self, address: int, count: int, *, slave: int = 1,
-                               no_response_expected: bool = False):
+                               no_response_expected: bool = False, is_notify_handler: bool = True,
+                               priority: int = RequestPriorityNormal, timeout: Optional[float] = None,
+                               block: bool = True) -> Future:
+        """读取请求入队，返回的Future结果为response
+
+        可同时提交多个请求后用concurrent.futures.wait()等待，或用asyncio.wrap_future()在协程中await
+        """
         request_parameter = ModbusRequestParameter()
         request_parameter.code=self.CodeReadHoldingRegisters
         request_parameter.count=count
         request_parameter.address = address
         request_parameter.slave = slave
         request_parameter.no_response_expected = no_response_expected
-
-        self.request_queue.put(request_parameter)
-
-        self.request_parameter.init()
+        request_parameter.is_notify_handler = is_notify_handler
+
+        return self.put_request_queue(request_parameter, priority, timeout, block)
+
+    def add_read_holding_registers_batch_queue(self, requests, batch_id=0,
+                                               priority: int = RequestPriorityLow,
+                                               timeout: Optional[float] = None, block: bool = True) -> Future:
+        """批量读取[(slave, address, count), ...]，合并相邻范围后入队
+
+        返回的Future结果为[(slave, address, count, registers或None), ...]，同时调用批量处理函数；
+        block为False时队列中放不下的块不等待，按读取失败(registers为None)返回；
+        寄存器个数为0或超过MaxReadRegistersCount的请求不发送到总线，直接按读取失败返回
+        """
+        batch = ModbusReadBatch(batch_id, requests, self.MaxReadRegistersCount)
+        batch_future = Future()
+        if not batch.blocks:
+            results = batch.results()
+            batch_future.set_result(results)
+            self.handler_read_holding_registers_batch_response(batch_id, results)
+            return batch_future
+        for batch_block in batch.blocks:
+            slave, address, count = batch_block
+
+            def on_block_done(future, batch_block=batch_block):
+                registers = None
+                if not future.cancelled() and future.exception() is None and future.result() is not None:
+                    registers = future.result().registers
+                if batch.block_done(batch_block, registers):
+                    results = batch.results()
+                    batch_future.set_result(results)
+                    self.handler_read_holding_registers_batch_response(batch.batch_id, results)
+
+            future = self.add_read_holding_registers_queue(address=address, count=count, slave=slave,
+                                                           is_notify_handler=False,
+                                                           priority=priority, timeout=timeout, block=block)
+            future.add_done_callback(on_block_done)
+        return batch_future
 
 
     def modbus_rtu_service_close(self):
         """关闭 modbus_client"""
+        self.modbus_cycle_is_run_event.clear()
+        self.stop_bus_thread()
         if self.modbus_client and self.modbus_client.connected:
             try:
                 self.modbus_client.close()
@@ -346,7 +671,7 @@ class SerialModbusRTUClient(object):
         if handler:
             handler(slave,response)
         else:
-            print(f"Unknown code: {code}")
+            logger.warning("Unknown code: %s", code)
 
     def handler_read_coils_response(self, slave, response):
         """read_coils后处理"""
@@ -363,6 +688,11 @@ class SerialModbusRTUClient(object):
         # print(f'# handler_read_holding_registers_response:{response}')
         pass
 
+    def handler_read_holding_registers_batch_response(self, batch_id, results):
+        """批量read_holding_registers后处理"""
+        # print(f'# handler_read_holding_registers_batch_response:{batch_id} {results}')
+        pass
+
     def handler_read_input_registers_response(self, slave, response):
         """read_input_registers后处理"""
         # print(f'# handler_read_input_registers_response:{response}')
@@ -378,6 +708,11 @@ class SerialModbusRTUClient(object):
         # print(f'# handler_write_register_response:{response}')
         pass
 
+    def handler_write_registers_response(self, slave, response):
+        """write_registers_response后处理"""
+        # print(f'# handler_write_registers_response:{response}')
+        pass
+
 class UdpModbusClient(object):
     CodeReadCoils = 0x01
     CodeReadDiscreteInputs = 0x02
@@ -392,7 +727,7 @@ class UdpModbusClient(object):
 
     def __init__(self,
                  host: str,
-                 framer: FramerType = FramerType.SOCKET,
+                 framer=None,  # 默认pymodbus.FramerType.SOCKET
                  port: int = 502,
                  name: str = 'comm',
                  source_address=None,
@@ -423,7 +758,10 @@ class UdpModbusClient(object):
         self.offline_slaves_list = []
 
     def create_modbus_service(self):
-        self.modbus_client=AsyncModbusUdpClient(host=self.host,
+        load_pymodbus()
+        if self.framer is None:
+            self.framer = pymodbus.FramerType.SOCKET
+        self.modbus_client=pymodbus.client.AsyncModbusUdpClient(host=self.host,
                                                 framer=self.framer,
                                                 port=self.port,
                                                 name=self.name,
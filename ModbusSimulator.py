@@ -0,0 +1,264 @@
+import argparse
+import os
+import random
+import select
+import struct
+import threading
+import time
+
+from LogUtils import get_logger
+
+logger = get_logger(__name__)
+
+
+def crc16_modbus(data: bytes):
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ 0xA001
+            else:
+                crc >>= 1
+    return crc
+
+
+def build_rtu_frame(pdu: bytes):
+    """加上CRC(低字节在前)"""
+    return pdu + struct.pack('<H', crc16_modbus(pdu))
+
+
+class SimulatedSlave(object):
+    """模拟从站: 保持寄存器表及应答延迟、超时(不应答)和CRC错误的注入概率"""
+    def __init__(self, slave_id: int, register_count: int = 10, registers=None,
+                 response_latency: float = 0.0, timeout_rate: float = 0.0, crc_error_rate: float = 0.0):
+        self.slave_id = slave_id
+        self.registers = list(registers) if registers is not None else [0] * register_count
+        self.response_latency = response_latency
+        self.timeout_rate = timeout_rate
+        self.crc_error_rate = crc_error_rate
+        self.requests = 0
+        self.injected_timeouts = 0
+        self.injected_crc_errors = 0
+
+
+class ModbusRTUSlaveFarm(object):
+    """挂在伪终端(pty)上的Modbus RTU从站集合，支持功能码03/06/16
+
+    客户端打开port(如/dev/pts/3)即可像真实串口一样访问，应答按baud_rate计算的帧传输时间延迟发送，
+    用于在没有硬件的Linux主机上对SerialModbusRTUClient做总线级压测
+    """
+    FunctionReadHoldingRegisters = 0x03
+    FunctionWriteRegister = 0x06
+    FunctionWriteRegisters = 0x10
+
+    ExceptionIllegalFunction = 0x01
+    ExceptionIllegalDataAddress = 0x02
+    ExceptionIllegalDataValue = 0x03
+
+    def __init__(self, slaves, baud_rate: int = 115200, bits_per_char: int = 10, seed=None):
+        """slaves: [SimulatedSlave, ...]；bits_per_char为每字节线上位数，8N1为10，8E1为11"""
+        if os.name != 'posix':
+            raise OSError("ModbusRTUSlaveFarm requires a POSIX pty")
+        self.slaves = {slave.slave_id: slave for slave in slaves}
+        self.baud_rate = baud_rate
+        self.bits_per_char = bits_per_char
+        self.random = random.Random(seed)
+        self.master_fd = None
+        self.slave_fd = None
+        self.port = None
+        self.serve_thread = None
+        self.is_running = False
+        self.crc_errors_received = 0
+        self.unknown_frames = 0
+
+    def char_time(self):
+        return self.bits_per_char / self.baud_rate
+
+    def open(self):
+        import tty
+        self.master_fd, self.slave_fd = os.openpty()
+        tty.setraw(self.master_fd)
+        tty.setraw(self.slave_fd)
+        self.port = os.ttyname(self.slave_fd)
+        self.is_running = True
+        self.serve_thread = threading.Thread(target=self._serve_loop, daemon=True)
+        self.serve_thread.start()
+        logger.info("Simulated Modbus RTU slaves %s on %s", sorted(self.slaves), self.port)
+        return self.port
+
+    def close(self):
+        self.is_running = False
+        if self.serve_thread is not None:
+            self.serve_thread.join()
+            self.serve_thread = None
+        for fd in (self.master_fd, self.slave_fd):
+            if fd is not None:
+                os.close(fd)
+        self.master_fd = None
+        self.slave_fd = None
+
+    def _expected_length(self, buffer: bytes):
+        """根据功能码推算请求帧长度，数据不足时返回None"""
+        if len(buffer) < 2:
+            return None
+        function_code = buffer[1]
+        if function_code in (self.FunctionReadHoldingRegisters, self.FunctionWriteRegister):
+            return 8
+        if function_code == self.FunctionWriteRegisters:
+            if len(buffer) < 7:
+                return None
+            return 9 + buffer[6]
+        return -1
+
+    def _serve_loop(self):
+        buffer = b''
+        # 3.5个字符时间的静默作为帧间隔，最短1.75ms
+        frame_gap = max(3.5 * self.char_time(), 0.00175)
+        while self.is_running:
+            readable, _, _ = select.select([self.master_fd], [], [], 0.1 if not buffer else frame_gap)
+            if not readable:
+                if buffer:
+                    # 帧间隔内没有凑齐完整帧，丢弃
+                    self.unknown_frames += 1
+                    buffer = b''
+                continue
+            try:
+                buffer += os.read(self.master_fd, 512)
+            except OSError:
+                return
+            while buffer:
+                length = self._expected_length(buffer)
+                if length is None or len(buffer) < length:
+                    break
+                if length < 0:
+                    self.unknown_frames += 1
+                    self._handle_frame(buffer)
+                    buffer = b''
+                    break
+                frame, buffer = buffer[:length], buffer[length:]
+                self._handle_frame(frame)
+
+    def _handle_frame(self, frame: bytes):
+        if len(frame) < 4 or crc16_modbus(frame[:-2]) != struct.unpack('<H', frame[-2:])[0]:
+            self.crc_errors_received += 1
+            return
+        slave = self.slaves.get(frame[0])
+        if slave is None:
+            return
+        slave.requests += 1
+        if slave.timeout_rate and self.random.random() < slave.timeout_rate:
+            slave.injected_timeouts += 1
+            return
+        response = build_rtu_frame(self._handle_pdu(slave, frame[1:-2]))
+        if slave.crc_error_rate and self.random.random() < slave.crc_error_rate:
+            slave.injected_crc_errors += 1
+            response = response[:-1] + bytes([response[-1] ^ 0xFF])
+        # 应答延迟加上应答帧在线上的传输时间
+        time.sleep(slave.response_latency + len(response) * self.char_time())
+        try:
+            os.write(self.master_fd, response)
+        except OSError as e:
+            logger.warning("Simulator write error: %s", e)
+
+    def _exception(self, slave: SimulatedSlave, function_code: int, exception_code: int):
+        return bytes([slave.slave_id, function_code | 0x80, exception_code])
+
+    def _handle_pdu(self, slave: SimulatedSlave, pdu: bytes):
+        function_code = pdu[0]
+        registers = slave.registers
+        if function_code == self.FunctionReadHoldingRegisters:
+            address, count = struct.unpack('>HH', pdu[1:5])
+            if not 1 <= count <= 125:
+                return self._exception(slave, function_code, self.ExceptionIllegalDataValue)
+            if address + count > len(registers):
+                return self._exception(slave, function_code, self.ExceptionIllegalDataAddress)
+            values = registers[address:address + count]
+            return bytes([slave.slave_id, function_code, count * 2]) + struct.pack(f'>{count}H', *values)
+        if function_code == self.FunctionWriteRegister:
+            address, value = struct.unpack('>HH', pdu[1:5])
+            if address >= len(registers):
+                return self._exception(slave, function_code, self.ExceptionIllegalDataAddress)
+            registers[address] = value
+            return bytes([slave.slave_id]) + pdu[:5]
+        if function_code == self.FunctionWriteRegisters:
+            address, count, byte_count = struct.unpack('>HHB', pdu[1:6])
+            if not 1 <= count <= 123 or byte_count != count * 2:
+                return self._exception(slave, function_code, self.ExceptionIllegalDataValue)
+            if address + count > len(registers):
+                return self._exception(slave, function_code, self.ExceptionIllegalDataAddress)
+            registers[address:address + count] = struct.unpack(f'>{count}H', pdu[6:6 + byte_count])
+            return bytes([slave.slave_id]) + pdu[:5]
+        return self._exception(slave, function_code, self.ExceptionIllegalFunction)
+
+    def get_stats(self):
+        return {
+            'crc_errors_received': self.crc_errors_received,
+            'unknown_frames': self.unknown_frames,
+            'slaves': {slave_id: {'requests': slave.requests,
+                                  'injected_timeouts': slave.injected_timeouts,
+                                  'injected_crc_errors': slave.injected_crc_errors}
+                       for slave_id, slave in self.slaves.items()},
+        }
+
+
+def parse_slaves(text: str, latency: float, timeout_rate: float, crc_error_rate: float):
+    """'1:10,2:20' -> [SimulatedSlave(1, 10), SimulatedSlave(2, 20)]"""
+    slaves = []
+    for item in text.split(','):
+        slave_id, register_count = item.split(':')
+        slaves.append(SimulatedSlave(int(slave_id), int(register_count), response_latency=latency,
+                                     timeout_rate=timeout_rate, crc_error_rate=crc_error_rate))
+    return slaves
+
+
+def run_benchmark(farm: ModbusRTUSlaveFarm, duration: float, serial_timeout: float):
+    """用SerialModbusRTUClient周期读取所有模拟从站并同时写入，输出总线统计"""
+    import json
+    from ModbusClient import SerialModbusRTUClient
+
+    client = SerialModbusRTUClient(port=farm.port, serial_baud_rate=farm.baud_rate, serial_timeout=serial_timeout)
+    client.slaves_list = {slave_id: len(slave.registers) for slave_id, slave in farm.slaves.items()}
+    client.cycle_read_slaves_list = list(client.slaves_list)
+    if not client.create_modbus_rtu_service():
+        raise OSError(f"cannot open {farm.port}")
+    client.start_cycle_read__loop()
+    end_time = time.monotonic() + duration
+    value = 0
+    while time.monotonic() < end_time:
+        slave_id = client.cycle_read_slaves_list[value % len(client.cycle_read_slaves_list)]
+        client.add_write_register_queue(address=0, value=value & 0xFFFF, slave=slave_id, timeout=1.0)
+        value += 1
+        time.sleep(0.01)
+    client.stop_cycle_read__loop()
+    stats = client.get_stats()
+    client.modbus_rtu_service_close()
+    print(json.dumps({'client': stats, 'simulator': farm.get_stats()}, indent=2, default=str))
+
+
+if __name__ == '__main__':
+    from LogUtils import setup_logging
+
+    parser = argparse.ArgumentParser(description="Simulated Modbus RTU slaves on a pty")
+    parser.add_argument('--slaves', default='1:3,2:10,3:10', help="slave_id:register_count,...")
+    parser.add_argument('--baud', type=int, default=115200)
+    parser.add_argument('--latency', type=float, default=0.002, help="response latency in seconds")
+    parser.add_argument('--timeout-rate', type=float, default=0.0)
+    parser.add_argument('--crc-error-rate', type=float, default=0.0)
+    parser.add_argument('--bench', type=float, default=0.0, help="run a client benchmark for N seconds")
+    args = parser.parse_args()
+
+    setup_logging()
+    slave_farm = ModbusRTUSlaveFarm(parse_slaves(args.slaves, args.latency, args.timeout_rate, args.crc_error_rate),
+                                    baud_rate=args.baud)
+    print(slave_farm.open())
+    try:
+        if args.bench > 0:
+            run_benchmark(slave_farm, args.bench, serial_timeout=0.2)
+        else:
+            while True:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        slave_farm.close()
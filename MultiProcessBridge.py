@@ -0,0 +1,412 @@
+import multiprocessing
+import os
+import struct
+import threading
+import time
+
+from Bridge import FdxModbusBridge
+from FdxCodec import (decode_read_registers_batch_response, encode_read_registers_batch_response, pack_registers,
+                      register_struct)
+from LogUtils import get_logger, setup_logging, stop_logging
+from ModbusClient import SerialModbusRTUClient
+from SharedMemoryImage import SharedSlotRing
+
+logger = get_logger(__name__)
+
+# 总线进程与FDX进程之间的消息: 头部kind, id, address, count(均为u16小端) + 数据
+MessageHeader = struct.Struct('<HHHH')
+# FDX进程 -> 总线进程(命令环)，id为slave或batch_id，数据为u16小端
+KindWriteRegister = 1
+KindWriteRegisters = 2
+KindReadBatch = 3  # count个(slave, address, count)
+# 总线进程 -> FDX进程(寄存器环)，数据为可直接放入DataExchange的大端字节
+KindRegisters = 1  # id为slave
+KindBatchResponse = 2  # id为batch_id，数据为encode_read_registers_batch_response()的结果
+
+
+def parse_bus_argument(value: str):
+    """命令行--bus参数: PORT或PORT=slave,slave，返回(port, [slave, ...]或None)"""
+    port, _, slaves = value.partition('=')
+    if not slaves:
+        return port, None
+    return port, [int(slave) for slave in slaves.split(',') if slave]
+
+
+class RingModbusRTUClient(SerialModbusRTUClient):
+    """总线进程中的Modbus客户端，读取结果打包后写入寄存器环
+
+    读取结果由总线线程发布，空批量请求的结果由命令线程发布，publish_lock保证环只有一个生产者在写
+    """
+    def __init__(self, register_ring, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.register_ring = register_ring
+        self.publish_lock = threading.Lock()
+        self.oversized_messages = 0
+
+    def publish(self, kind, message_id, data):
+        if MessageHeader.size + len(data) > self.register_ring.slot_size:
+            self.oversized_messages += 1
+            logger.error("Message kind %s id %s (%d bytes) exceeds ring slot size", kind, message_id, len(data))
+            return
+        with self.publish_lock:
+            slot = self.register_ring.reserve()
+            if slot is None:
+                return
+            MessageHeader.pack_into(slot, 0, kind, message_id, 0, len(data))
+            slot[MessageHeader.size:MessageHeader.size + len(data)] = data
+            self.register_ring.commit(MessageHeader.size + len(data))
+
+    def handler_read_holding_registers_response(self, slave, response):
+        super().handler_read_holding_registers_response(slave, response)
+        self.publish(KindRegisters, slave, pack_registers(response.registers, 'big'))
+
+    def handler_read_holding_registers_batch_response(self, batch_id, results):
+        self.publish(KindBatchResponse, batch_id, encode_read_registers_batch_response(batch_id, results))
+
+
+def execute_command(client: SerialModbusRTUClient, message):
+    """在总线进程中执行命令环中的一条消息
+
+    命令线程只为命令环服务，请求队列满时等待总线线程取走请求，不丢弃命令:
+    FDX进程在命令写入命令环后已记为上次写命令，丢弃的写命令不会因CANoe重复发送而重新提交
+    """
+    kind, message_id, address, count = MessageHeader.unpack_from(message)
+    if kind == KindWriteRegister:
+        value, = register_struct(1, 'little').unpack_from(message, MessageHeader.size)
+        client.add_write_register_queue(address=address, value=value, slave=message_id)
+    elif kind == KindWriteRegisters:
+        values = list(register_struct(count, 'little').unpack_from(message, MessageHeader.size))
+        client.add_write_registers_queue(address=address, values=values, slave=message_id)
+    elif kind == KindReadBatch:
+        values = register_struct(count * 3, 'little').unpack_from(message, MessageHeader.size)
+        requests = [values[i:i + 3] for i in range(0, len(values), 3)]
+        client.add_read_holding_registers_batch_queue(requests, batch_id=message_id)
+    else:
+        logger.warning("Unknown command kind: %s", kind)
+
+
+def reject_command(client: RingModbusRTUClient, message):
+    """命令执行出错时，批量读取的所有块按失败回复，FDX进程不必等到截止时间"""
+    kind, message_id, _, count = MessageHeader.unpack_from(message)
+    if kind != KindReadBatch:
+        return
+    values = register_struct(count * 3, 'little').unpack_from(message, MessageHeader.size)
+    results = [(values[i], values[i + 1], values[i + 2], None) for i in range(0, len(values), 3)]
+    client.handler_read_holding_registers_batch_response(message_id, results)
+
+
+def run_bus_process(port: str, config: dict, slaves: list, command_ring_name: str, register_ring_name: str,
+                    ready_event, stop_event, cycle_read: bool = True, ring_poll_interval: float = 0.0005):
+    """总线进程入口: 打开串口，周期读取slaves并执行命令环中的写入和批量读取，直到stop_event被设置"""
+    setup_logging()
+    # 子进程由父进程以spawn方式启动，共用父进程的resource_tracker
+    command_link = SharedSlotRing(command_ring_name, untrack=False)
+    register_link = SharedSlotRing(register_ring_name, untrack=False)
+    client = RingModbusRTUClient(register_link.ring, port=port,
+                                 serial_baud_rate=config.get("serial_baud_rate", 115200),
+                                 serial_bytesize=config.get("serial_bytesize", 8),
+                                 serial_parity=config.get("serial_parity", "N"),
+                                 serial_stop_bits=config.get("serial_stop_bits", 1),
+                                 serial_timeout=config.get("serial_timeout", 1),
+                                 serial_retries=config.get("serial_retries", 0))
+    slaves_list = {int(k): v for k, v in config.get("slaves_list", {}).items()}
+    client.slaves_list = {slave: slaves_list[slave] for slave in slaves}
+    client.cycle_read_slaves_list = [slave for slave in config.get("cycle_read_slaves_list", []) if slave in slaves]
+    client.bus_thread_scheduling = (config.get("thread_scheduling") or {}).get('modbus_bus')
+    if not client.create_modbus_rtu_service():
+        logger.error("Modbus %s connect failed", port)
+        command_link.close()
+        register_link.close()
+        stop_logging()
+        return
+    if cycle_read:
+        client.start_cycle_read__loop()
+    ready_event.set()
+    command_ring = command_link.ring
+    try:
+        while True:
+            message = command_ring.peek()
+            if message is None:
+                if stop_event.is_set():
+                    break
+                time.sleep(ring_poll_interval)
+                continue
+            try:
+                execute_command(client, message)
+            except Exception as e:
+                logger.error("Bus %s command error: %s", port, e)
+                reject_command(client, message)
+            message.release()
+            command_ring.advance()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.stop_cycle_read__loop()
+        client.modbus_rtu_service_close()
+        logger.info("Bus %s stats: %s", port, client.get_stats())
+        command_link.close()
+        register_link.close()
+        stop_logging()
+
+
+class BusProcess(object):
+    """父进程持有的一条串口总线: 子进程、命令环(父进程写)和寄存器环(子进程写)"""
+    def __init__(self, port: str, slaves: list, name_prefix: str, slot_count: int, slot_size: int):
+        self.port = port
+        self.slaves = slaves
+        self.command_link = SharedSlotRing(f"{name_prefix}_commands", slot_count, slot_size)
+        try:
+            self.register_link = SharedSlotRing(f"{name_prefix}_registers", slot_count, slot_size)
+        except OSError:
+            self.command_link.close()
+            raise
+        self.process = None
+        self.ready_event = None
+        self.stop_event = None
+        self.is_connected = False
+
+    def start(self, context, config: dict, cycle_read: bool, ring_poll_interval: float):
+        self.ready_event = context.Event()
+        self.stop_event = context.Event()
+        self.process = context.Process(target=run_bus_process, name=f"bus {self.port}", daemon=True,
+                                       args=(self.port, config, self.slaves, self.command_link.name,
+                                             self.register_link.name, self.ready_event, self.stop_event,
+                                             cycle_read, ring_poll_interval))
+        self.process.start()
+
+    def wait_ready(self, timeout: float):
+        """等待子进程打开串口，子进程退出或超时时返回False"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.ready_event.wait(0.05):
+                self.is_connected = True
+                break
+            if not self.process.is_alive():
+                break
+        return self.is_connected
+
+    def is_available(self):
+        """子进程已打开串口且仍在运行，否则命令环中的命令不会被执行"""
+        return self.is_connected and self.process is not None and self.process.is_alive()
+
+    def send(self, kind, message_id, address, values):
+        """写入命令环，环满或数据超过槽大小时返回False"""
+        ring = self.command_link.ring
+        if MessageHeader.size + len(values) * 2 > ring.slot_size:
+            logger.error("Command kind %s for bus %s exceeds ring slot size", kind, self.port)
+            return False
+        slot = ring.reserve()
+        if slot is None:
+            return False
+        count = len(values) // 3 if kind == KindReadBatch else len(values)
+        MessageHeader.pack_into(slot, 0, kind, message_id, address, count)
+        register_struct(len(values), 'little').pack_into(slot, MessageHeader.size, *values)
+        ring.commit(MessageHeader.size + len(values) * 2)
+        return True
+
+    def stop(self, timeout: float = 5.0):
+        if self.process is not None:
+            self.stop_event.set()
+            self.process.join(timeout)
+            if self.process.is_alive():
+                logger.warning("Bus process %s did not exit, terminating", self.port)
+                self.process.terminate()
+                self.process.join()
+            self.process = None
+        self.is_connected = False
+
+    def close(self):
+        self.command_link.close()
+        self.register_link.close()
+
+    def get_stats(self):
+        return {'commands': self.command_link.ring.get_stats(), 'registers': self.register_link.ring.get_stats(),
+                'connected': self.is_connected, 'alive': self.process is not None and self.process.is_alive()}
+
+
+class MultiProcessBridge(FdxModbusBridge):
+    """FDX收发与每条串口总线分别运行在独立进程中，避免FDX解码突发与总线线程争用GIL
+
+    本进程运行FDX接收线程、SCPI仪器和转发线程；每条总线一个子进程运行SerialModbusRTUClient。
+    FDX写命令和批量读取按从站写入对应总线的命令环，读取结果由转发线程从寄存器环取出后发送到FDX；
+    环是共享内存中的SlotRing，消息不经过pickle。跨多条总线的批量读取在本进程中按原始顺序合并
+    """
+    def __init__(self, config: dict, buses, protocol='UDP', local_ip='127.0.0.1', local_port: int = 2000,
+                 target_ip='127.0.0.1', target_port: int = 2001, ring_slots: int = 256, ring_slot_size: int = 4096,
+                 ring_poll_interval: float = 0.0005, batch_timeout: float = None):
+        """buses: [(port, [slave, ...]或None)]，None表示slaves_list中未分配给其他总线的所有从站
+
+        batch_timeout: 批量读取等待各总线结果的时间(秒)，超时后未返回的块按失败回复；
+        None时按串口超时、重试次数和块数估算
+        """
+        super().__init__(config, None, protocol, local_ip, local_port, target_ip, target_port)
+        self.ring_poll_interval = ring_poll_interval
+        slaves_list = [int(slave) for slave in config.get("slaves_list", {})]
+        assigned = {slave for _, slaves in buses if slaves for slave in slaves}
+        name_prefix = config.get("shared_memory_name_prefix") or f"fdx_bridge_{os.getpid()}"
+        self.buses = []
+        self.slave_buses = {}  # {slave: BusProcess}
+        for index, (port, slaves) in enumerate(buses):
+            if slaves is None:
+                slaves = [slave for slave in slaves_list if slave not in assigned]
+            slaves = [slave for slave in slaves if slave in slaves_list]
+            try:
+                bus = BusProcess(port, slaves, f"{name_prefix}_bus{index}", ring_slots, ring_slot_size)
+            except OSError:
+                for bus in self.buses:
+                    bus.close()
+                raise
+            self.buses.append(bus)
+            for slave in slaves:
+                self.slave_buses.setdefault(slave, bus)
+        self.batch_timeout = batch_timeout
+        # {batch_id: [剩余总线数, 结果列表, {BusProcess: 原始请求序号列表}, 截止时间]}
+        self.pending_batches = {}
+        self.batch_lock = threading.Lock()  # FDX接收线程登记批量读取，转发线程合并结果
+        self.dropped_commands = 0
+        self.expired_batches = 0  # 超过截止时间仍有总线未返回结果的批量读取
+        self.late_batch_responses = 0  # 截止时间后才到达、已不再等待的总线结果
+        self.forward_thread = None
+        self.is_forwarding = False
+
+    def start(self, cycle_read: bool = True):
+        context = multiprocessing.get_context('spawn')
+        for bus in self.buses:
+            bus.start(context, self.config, cycle_read, self.ring_poll_interval)
+        timeout = self.config.get("serial_timeout", 1) + 10
+        is_connected = True
+        for bus in self.buses:
+            if bus.wait_ready(timeout):
+                logger.info("Bus process %s ready, slaves %s", bus.port, bus.slaves)
+            else:
+                logger.error("Bus process %s failed to open the serial port", bus.port)
+                is_connected = False
+        self.is_forwarding = True
+        self.forward_thread = threading.Thread(target=self._forward_loop, daemon=True)
+        self.forward_thread.start()
+        return super().start(cycle_read) and is_connected
+
+    def stop(self):
+        super().stop()
+        for bus in self.buses:
+            bus.stop()
+        if self.forward_thread is not None:
+            self.is_forwarding = False
+            self.forward_thread.join()
+            self.forward_thread = None
+        for bus in self.buses:
+            bus.close()
+
+    def is_modbus_ready(self):
+        return any(bus.is_connected for bus in self.buses)
+
+    def _send_command(self, slave, kind, message_id, address, values):
+        bus = self.slave_buses.get(slave)
+        if bus is None or not bus.is_available() or not bus.send(kind, message_id, address, values):
+            self.dropped_commands += 1
+            return False
+        return True
+
+    def submit_write_register(self, slave, address, value, trace_ns=None):
+        return self._send_command(slave, KindWriteRegister, slave, address, (value,))
+
+    def submit_write_registers(self, slave, address, values, trace_ns=None):
+        return self._send_command(slave, KindWriteRegisters, slave, address, values)
+
+    def get_batch_timeout(self, block_count: int):
+        if self.batch_timeout is not None:
+            return self.batch_timeout
+        serial_timeout = self.config.get("serial_timeout", 1)
+        retries = self.config.get("serial_retries", 0)
+        return serial_timeout * (retries + 1) * block_count + 1.0
+
+    def submit_read_registers_batch(self, request_id, requests):
+        """按从站所属总线拆分后合并回复；从站不属于可用总线的块直接按失败回复，
+        截止时间内未返回结果的总线由转发线程按失败回复"""
+        parts = {}
+        results = [(slave, address, count, None) for slave, address, count in requests]
+        for index, (slave, _, _) in enumerate(requests):
+            bus = self.slave_buses.get(slave)
+            if bus is not None and bus.is_available():
+                parts.setdefault(bus, []).append(index)
+        if not parts:
+            self.modbus_batch_registers_to_fdx(request_id, results)
+            return
+        deadline = time.monotonic() + self.get_batch_timeout(len(requests))
+        with self.batch_lock:
+            self.pending_batches[request_id] = [len(parts), results, parts, deadline]
+        for bus, indexes in parts.items():
+            values = [value for index in indexes for value in requests[index]]
+            if not bus.send(KindReadBatch, request_id, 0, values):
+                self.dropped_commands += 1
+                self._merge_batch(request_id, bus, [])
+
+    def _merge_batch(self, batch_id, bus, bus_results):
+        with self.batch_lock:
+            pending = self.pending_batches.get(batch_id)
+            if pending is None:
+                return
+            _, results, parts, _ = pending
+            for index, result in zip(parts.get(bus, []), bus_results):
+                results[index] = result
+            pending[0] -= 1
+            if pending[0] > 0:
+                return
+            del self.pending_batches[batch_id]
+        self.modbus_batch_registers_to_fdx(batch_id, results)
+
+    def _expire_batches(self):
+        """截止时间已过的批量读取，已返回的块照常回复，其余块按失败回复"""
+        now = time.monotonic()
+        with self.batch_lock:
+            expired = [(batch_id, pending[1]) for batch_id, pending in self.pending_batches.items()
+                       if pending[3] <= now]
+            for batch_id, _ in expired:
+                del self.pending_batches[batch_id]
+            self.expired_batches += len(expired)
+        for batch_id, results in expired:
+            logger.warning("Read registers batch %s timed out, missing blocks reported as failed", batch_id)
+            self.modbus_batch_registers_to_fdx(batch_id, results)
+
+    def _forward_loop(self):
+        """从各总线的寄存器环取出读取结果发送到FDX，所有环都为空时等待ring_poll_interval"""
+        while self.is_forwarding:
+            if self.pending_batches:
+                self._expire_batches()
+            is_idle = True
+            for bus in self.buses:
+                ring = bus.register_link.ring
+                message = ring.peek()
+                if message is None:
+                    continue
+                is_idle = False
+                try:
+                    self._forward_message(bus, message)
+                except Exception as e:
+                    logger.error("Forward message from bus %s error: %s", bus.port, e)
+                message.release()
+                ring.advance()
+            if is_idle:
+                time.sleep(self.ring_poll_interval)
+
+    def _forward_message(self, bus, message):
+        kind, message_id, _, length = MessageHeader.unpack_from(message)
+        data = bytes(message[MessageHeader.size:MessageHeader.size + length])
+        if kind == KindRegisters:
+            self.send_data_exchange(message_id, data)
+        elif kind == KindBatchResponse:
+            if message_id in self.pending_batches:
+                _, bus_results = decode_read_registers_batch_response(data)
+                self._merge_batch(message_id, bus, bus_results)
+            else:
+                # 已按超时回复过
+                self.late_batch_responses += 1
+
+    def get_stats(self):
+        stats = super().get_stats()
+        stats['buses'] = {bus.port: bus.get_stats() for bus in self.buses}
+        stats['dropped_commands'] = self.dropped_commands
+        stats['pending_batches'] = len(self.pending_batches)
+        stats['expired_batches'] = self.expired_batches
+        stats['late_batch_responses'] = self.late_batch_responses
+        return stats
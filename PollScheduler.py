@@ -0,0 +1,37 @@
+class CyclePollScheduler(object):
+    """总线线程中队列请求与周期读取的交替规则，不做I/O，由SerialModbusRTUClient._bus_owner_loop调用
+
+    两者都有任务时每个单次请求后必跟一次周期读取；周期读取按cycle_read_slaves_list顺序轮询，
+    保证每轮都完整读取所有从站，cycle_count为已完成的完整轮数
+    """
+    def __init__(self):
+        self.cycle_index = 0
+        self.is_cycle_turn = False
+        self.cycle_count = 0
+
+    def restart(self):
+        """新的总线线程从第一个从站开始，cycle_count继续累计"""
+        self.cycle_index = 0
+        self.is_cycle_turn = False
+
+    def is_request_turn(self, cycle_slaves):
+        """本次是否应先取队列请求，未周期读取时总是取队列请求"""
+        if not cycle_slaves:
+            self.cycle_index = 0
+            return True
+        return not self.is_cycle_turn
+
+    def request_done(self):
+        self.is_cycle_turn = True
+
+    def next_cycle_slave(self, cycle_slaves):
+        """返回下一个周期读取的从站，未周期读取时返回None"""
+        self.is_cycle_turn = False
+        if not cycle_slaves:
+            return None
+        slave = cycle_slaves[self.cycle_index % len(cycle_slaves)]
+        self.cycle_index += 1
+        if self.cycle_index >= len(cycle_slaves):
+            self.cycle_index = 0
+            self.cycle_count += 1
+        return slave
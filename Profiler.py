@@ -0,0 +1,146 @@
+import functools
+import json
+import os
+import threading
+import time
+from array import array
+
+from LogUtils import get_logger
+
+logger = get_logger(__name__)
+
+
+class SpanRingBuffer(object):
+    """固定容量的耗时记录环形缓冲，写满后覆盖最早的记录"""
+    def __init__(self, capacity: int = 4096):
+        self.capacity = capacity
+        self.start_ns = array('q', [0]) * capacity
+        self.duration_ns = array('q', [0]) * capacity
+        self.thread_id = array('q', [0]) * capacity
+        self.index = 0
+        self.count = 0
+
+    def append(self, start_ns: int, duration_ns: int, thread_id: int):
+        index = self.index
+        self.start_ns[index] = start_ns
+        self.duration_ns[index] = duration_ns
+        self.thread_id[index] = thread_id
+        self.index = (index + 1) % self.capacity
+        self.count += 1
+
+    def spans(self):
+        """按时间顺序返回[(start_ns, duration_ns, thread_id), ...]"""
+        size = min(self.count, self.capacity)
+        first = (self.index - size) % self.capacity
+        ret = []
+        for i in range(size):
+            index = (first + i) % self.capacity
+            ret.append((self.start_ns[index], self.duration_ns[index], self.thread_id[index]))
+        return ret
+
+
+class CommandProfiler(object):
+    """命令分发和处理函数的耗时分析
+
+    install_fdx()/install_modbus()把实例上的分发函数和处理函数表替换为计时包装，
+    uninstall()后恢复原函数，未安装时没有任何额外开销
+    """
+    def __init__(self, capacity: int = 4096):
+        self.capacity = capacity
+        self.rings = {}  # {(category, name): SpanRingBuffer}
+        self.installed = []  # [(obj, attr_name, original, is_instance_attr)] 或 [(dict, key, original, None)]
+        self.lock = threading.Lock()
+
+    def _ring(self, category: str, name: str):
+        key = (category, name)
+        ring = self.rings.get(key)
+        if ring is None:
+            with self.lock:
+                ring = self.rings.get(key)
+                if ring is None:
+                    ring = SpanRingBuffer(self.capacity)
+                    self.rings[key] = ring
+        return ring
+
+    def _wrap(self, func, category: str, name_of):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start_ns = time.perf_counter_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                end_ns = time.perf_counter_ns()
+                self._ring(category, name_of(args, kwargs)).append(start_ns, end_ns - start_ns,
+                                                                   threading.get_ident())
+        return wrapper
+
+    def _wrap_attr(self, obj, attr_name: str, category: str, name_of):
+        original = getattr(obj, attr_name)
+        is_instance_attr = attr_name in vars(obj)
+        setattr(obj, attr_name, self._wrap(original, category, name_of))
+        self.installed.append((obj, attr_name, original, is_instance_attr))
+
+    def _wrap_handlers(self, handlers: dict, category: str):
+        for key, handler in list(handlers.items()):
+            name = getattr(handler, '__name__', str(key))
+            handlers[key] = self._wrap(handler, category, lambda args, kwargs, name=name: name)
+            self.installed.append((handlers, key, handler, None))
+
+    def install_fdx(self, fdx):
+        """统计VectorFDX.handle_command按命令代码的耗时及每个命令处理函数的耗时"""
+        self._wrap_attr(fdx, 'handle_command', 'fdx_dispatch',
+                        lambda args, kwargs: f"command 0x{args[0]:04X}")
+        self._wrap_handlers(fdx.command_handlers, 'fdx_handler')
+
+    def install_modbus(self, modbus_client):
+        """统计Modbus request/response分发按功能码的耗时及每个处理函数的耗时"""
+        self._wrap_attr(modbus_client, 'request_handle_command', 'modbus_request',
+                        lambda args, kwargs: f"request code 0x{(args[0].code or 0):02X}")
+        self._wrap_attr(modbus_client, 'response_handle_command', 'modbus_response',
+                        lambda args, kwargs: f"response code 0x{args[1]:02X}")
+        self._wrap_handlers(modbus_client.modbus_request_handlers, 'modbus_request_handler')
+        self._wrap_handlers(modbus_client.modbus_response_handlers, 'modbus_response_handler')
+
+    def uninstall(self):
+        """恢复所有被替换的函数"""
+        for target, key, original, is_instance_attr in reversed(self.installed):
+            if is_instance_attr is None:
+                target[key] = original
+            elif is_instance_attr:
+                setattr(target, key, original)
+            else:
+                delattr(target, key)
+        self.installed = []
+
+    def summary(self):
+        """{'category/name': {'count', 'mean_us', 'max_us'}}，只统计缓冲中保留的记录"""
+        ret = {}
+        for (category, name), ring in list(self.rings.items()):
+            spans = ring.spans()
+            durations = [duration for _, duration, _ in spans]
+            ret[f"{category}/{name}"] = {
+                'count': ring.count,
+                'mean_us': round(sum(durations) / len(durations) / 1000, 3) if durations else 0.0,
+                'max_us': round(max(durations) / 1000, 3) if durations else 0.0,
+            }
+        return ret
+
+    def export_chrome_trace(self, path: str):
+        """导出Chrome trace event格式的JSON，可在chrome://tracing或Perfetto中查看"""
+        pid = os.getpid()
+        events = []
+        for (category, name), ring in list(self.rings.items()):
+            for start_ns, duration_ns, thread_id in ring.spans():
+                events.append({
+                    'name': name,
+                    'cat': category,
+                    'ph': 'X',
+                    'ts': start_ns / 1000,
+                    'dur': duration_ns / 1000,
+                    'pid': pid,
+                    'tid': thread_id,
+                })
+        events.sort(key=lambda event: event['ts'])
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ns'}, f)
+        logger.info("Exported %d trace events to %s", len(events), path)
@@ -0,0 +1,179 @@
+import struct
+import time
+from array import array
+
+
+class SeqlockImage(object):
+    """按条目保存最新值的内存映像，单线程写入，任意线程用序列锁(seqlock)无锁读取
+
+    所有数据保存在一块连续缓冲中(小端)，布局:
+        头部 32字节: magic(8s) version(u32) entry_count(u32) itemsize(u32) typecode(4s) total_size(u64)
+        目录 entry_count*16字节: entry_id(u32) count(u32) offset(u64)
+        条目 每个条目在offset处: seq(u64) timestamp(f64) count个数据项，按8字节对齐
+    写入前seq加1变为奇数，写完再加1变为偶数；读取方在seq为偶数且读取前后seq不变时得到一致的数据
+    """
+    Magic = b'FDXIMAGE'
+    Version = 1
+    HeaderStruct = struct.Struct('<8sIII4sQ')
+    EntryStruct = struct.Struct('<IIQ')
+    SlotHeaderSize = 16
+
+    def __init__(self, entries: dict, typecode: str = 'H', buffer=None):
+        """entries: {entry_id: 数据项个数}；buffer为None时分配bytearray，否则在给定缓冲(如共享内存)上初始化"""
+        self.typecode = typecode
+        self.itemsize = array(typecode).itemsize
+        self.entries = {int(entry_id): int(count) for entry_id, count in entries.items()}
+        self.total_size = self.required_size(self.entries, typecode)
+        if buffer is None:
+            buffer = bytearray(self.total_size)
+        self.buffer = memoryview(buffer).cast('B')
+        if len(self.buffer) < self.total_size:
+            raise ValueError(f"buffer size {len(self.buffer)} smaller than required {self.total_size}")
+        self._write_layout()
+        self._build_slots()
+
+    @classmethod
+    def required_size(cls, entries: dict, typecode: str = 'H'):
+        itemsize = array(typecode).itemsize
+        size = cls.HeaderStruct.size + cls.EntryStruct.size * len(entries)
+        size = (size + 7) & ~7
+        for count in entries.values():
+            size += cls.SlotHeaderSize + ((int(count) * itemsize + 7) & ~7)
+        return size
+
+    @classmethod
+    def attach(cls, buffer):
+        """按缓冲中已有的头部和目录创建映像对象，不清空数据，用于读取方"""
+        image = cls.__new__(cls)
+        image.buffer = memoryview(buffer).cast('B')
+        magic, version, entry_count, itemsize, typecode, total_size = cls.HeaderStruct.unpack_from(image.buffer, 0)
+        if magic != cls.Magic or version != cls.Version:
+            raise ValueError("buffer does not contain a register image")
+        image.typecode = typecode.rstrip(b'\x00').decode('ascii')
+        image.itemsize = itemsize
+        image.total_size = total_size
+        image.entries = {}
+        image.offsets = {}
+        for index in range(entry_count):
+            entry_id, count, offset = cls.EntryStruct.unpack_from(
+                image.buffer, cls.HeaderStruct.size + index * cls.EntryStruct.size)
+            image.entries[entry_id] = count
+            image.offsets[entry_id] = offset
+        image._build_slots()
+        return image
+
+    def _write_layout(self):
+        self.offsets = {}
+        offset = self.HeaderStruct.size + self.EntryStruct.size * len(self.entries)
+        offset = (offset + 7) & ~7
+        for index, (entry_id, count) in enumerate(self.entries.items()):
+            self.offsets[entry_id] = offset
+            self.EntryStruct.pack_into(self.buffer, self.HeaderStruct.size + index * self.EntryStruct.size,
+                                       entry_id, count, offset)
+            self.buffer[offset:offset + self.SlotHeaderSize] = bytes(self.SlotHeaderSize)
+            offset += self.SlotHeaderSize + ((count * self.itemsize + 7) & ~7)
+        self.HeaderStruct.pack_into(self.buffer, 0, self.Magic, self.Version, len(self.entries), self.itemsize,
+                                    self.typecode.encode('ascii'), self.total_size)
+
+    def _build_slots(self):
+        # {entry_id: (seq视图, timestamp视图, 原始字节视图, 打包格式)}
+        self.slots = {}
+        for entry_id, count in self.entries.items():
+            offset = self.offsets[entry_id]
+            data_offset = offset + self.SlotHeaderSize
+            self.slots[entry_id] = (
+                self.buffer[offset:offset + 8].cast('Q'),
+                self.buffer[offset + 8:offset + 16].cast('d'),
+                self.buffer[data_offset:data_offset + count * self.itemsize],
+                struct.Struct(f'<{count}{self.typecode}'),
+            )
+
+    def update(self, entry_id: int, values, offset: int = 0, timestamp: float = None):
+        """写入values到条目的offset位置，只能由一个线程调用"""
+        slot = self.slots.get(entry_id)
+        if slot is None:
+            return False
+        seq_view, timestamp_view, raw_view, pack_struct = slot
+        count = self.entries[entry_id]
+        seq = seq_view[0]
+        seq_view[0] = seq + 1
+        if self.typecode == 'B' and isinstance(values, (bytes, bytearray, memoryview)):
+            n = max(0, min(len(values), count - offset))
+            raw_view[offset:offset + n] = values[:n]
+        elif offset == 0 and len(values) == count:
+            pack_struct.pack_into(raw_view, 0, *values)
+        else:
+            n = max(0, min(len(values), count - offset))
+            if n:
+                struct.pack_into(f'<{n}{self.typecode}', raw_view, offset * self.itemsize, *values[:n])
+        timestamp_view[0] = time.time() if timestamp is None else timestamp
+        seq_view[0] = seq + 2
+        return True
+
+    def read_into(self, entry_id: int, out, max_retries: int = 1000):
+        """将条目数据一致地拷贝到out(可写缓冲，如array)，返回(seq, timestamp)
+
+        写入方正在写时重试，超过max_retries次抛出TimeoutError
+        """
+        seq_view, timestamp_view, raw_view, _ = self.slots[entry_id]
+        out_view = out if isinstance(out, memoryview) else memoryview(out)
+        if out_view.format != 'B':
+            out_view = out_view.cast('B')
+        for _ in range(max_retries):
+            seq = seq_view[0]
+            if seq & 1:
+                time.sleep(0)
+                continue
+            out_view[:] = raw_view
+            timestamp = timestamp_view[0]
+            if seq_view[0] == seq:
+                return seq, timestamp
+        raise TimeoutError(f"entry {entry_id} is being written continuously")
+
+    def copy_from(self, image):
+        """拷贝另一个映像(相同typecode)中共有条目的数据和时间戳，数据项个数不同时按较少的拷贝，用于调整条目后保留已有数据"""
+        for entry_id, count in self.entries.items():
+            if entry_id not in image.entries:
+                continue
+            data = array(image.typecode, bytes(image.entries[entry_id] * image.itemsize))
+            _, timestamp = image.read_into(entry_id, data)
+            self.update(entry_id, data[:count], timestamp=timestamp)
+
+    def sequence(self, entry_id: int):
+        """条目的写入序号，值不变表示数据未更新"""
+        return self.slots[entry_id][0][0]
+
+    def reader(self):
+        return ImageReader(self)
+
+    def release(self):
+        """释放对缓冲的所有引用，共享内存close()前必须调用"""
+        for seq_view, timestamp_view, raw_view, _ in self.slots.values():
+            seq_view.release()
+            timestamp_view.release()
+            raw_view.release()
+        self.slots = {}
+        self.buffer.release()
+
+
+class ImageReader(object):
+    """读取方持有的预分配缓冲，snapshot()不分配新对象，返回的memoryview在下次读取同一条目前有效"""
+    def __init__(self, image: SeqlockImage):
+        self.image = image
+        self.buffers = {}
+        # 读取方的缓冲属于本进程，不引用映像所在的共享内存
+        for entry_id, count in image.entries.items():
+            data = array(image.typecode, bytes(count * image.itemsize))
+            self.buffers[entry_id] = (data, memoryview(data), memoryview(data).cast('B'))
+
+    def snapshot(self, entry_id: int):
+        """返回(数据memoryview, seq, timestamp)"""
+        _, view, raw_view = self.buffers[entry_id]
+        seq, timestamp = self.image.read_into(entry_id, raw_view)
+        return view, seq, timestamp
+
+
+class RegisterImage(SeqlockImage):
+    """每个从站一块保持寄存器的最新值映像，按slaves_list {slave: 寄存器数量} 预分配"""
+    def __init__(self, slaves_list: dict, buffer=None):
+        super().__init__(slaves_list, 'H', buffer)
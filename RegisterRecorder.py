@@ -0,0 +1,147 @@
+import glob
+import os
+import queue
+import threading
+import time
+
+from LogUtils import get_logger
+
+logger = get_logger(__name__)
+
+np = None  # 仅在使用记录功能时由load_numpy()导入
+
+
+def load_numpy():
+    """导入numpy，未安装时返回None"""
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return None
+        np = numpy
+    return np
+
+
+def recording_dtype(register_count: int):
+    """每行: 时间戳(float64, 秒) + register_count个uint16寄存器值"""
+    return np.dtype([('timestamp', '<f8'), ('registers', '<u2', (register_count,))])
+
+
+class SlaveChunkWriter(object):
+    """单个从站的块缓冲，缓冲从固定大小的缓冲池中取用，写满后交给后台线程落盘"""
+    def __init__(self, slave: int, register_count: int, chunk_rows: int, pool_size: int):
+        self.slave = slave
+        self.register_count = register_count
+        self.chunk_rows = chunk_rows
+        self.dtype = recording_dtype(register_count)
+        self.free_buffers = queue.SimpleQueue()
+        for _ in range(pool_size):
+            self.free_buffers.put(np.zeros(chunk_rows, dtype=self.dtype))
+        self.active_buffer = None
+        self.row_index = 0
+        self.chunk_index = 0
+        self.rows = 0
+        self.dropped_rows = 0  # 缓冲池耗尽(落盘跟不上)时丢弃的行数
+        self.skipped_rows = 0  # 寄存器数量与配置不一致而跳过的行数
+
+    def append(self, timestamp: float, registers, flush_queue):
+        if len(registers) != self.register_count:
+            self.skipped_rows += 1
+            return
+        if self.active_buffer is None:
+            try:
+                self.active_buffer = self.free_buffers.get_nowait()
+            except queue.Empty:
+                self.dropped_rows += 1
+                return
+            self.row_index = 0
+        self.active_buffer['timestamp'][self.row_index] = timestamp
+        self.active_buffer['registers'][self.row_index] = registers
+        self.row_index += 1
+        self.rows += 1
+        if self.row_index >= self.chunk_rows:
+            self.submit(flush_queue)
+
+    def submit(self, flush_queue):
+        """将当前缓冲(可能未写满)交给落盘线程"""
+        if self.active_buffer is not None and self.row_index > 0:
+            flush_queue.put((self, self.chunk_index, self.active_buffer, self.row_index))
+            self.chunk_index += 1
+            self.active_buffer = None
+            self.row_index = 0
+
+
+class RegisterRecorder(object):
+    """寄存器值时序记录器
+
+    轮询线程调用append()只写入预分配的NumPy块缓冲，写满的块由后台线程写成
+    directory/slave_<id>/chunk_<n>.npy文件，可用open_recording()以np.memmap零拷贝读回；
+    每个从站最多占用pool_size个块缓冲，长时间高频记录内存不增长
+    """
+    def __init__(self, directory: str, slaves_list: dict, chunk_rows: int = 4096, pool_size: int = 4):
+        if load_numpy() is None:
+            raise ImportError("RegisterRecorder requires numpy")
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+        self.pool_size = pool_size
+        self.writers = {slave: SlaveChunkWriter(slave, count, chunk_rows, pool_size)
+                        for slave, count in slaves_list.items()}
+        self.flush_queue = queue.SimpleQueue()
+        self.flush_thread = None
+        self.is_running = False
+
+    def start(self):
+        if self.flush_thread is None or not self.flush_thread.is_alive():
+            for slave in self.writers:
+                os.makedirs(os.path.join(self.directory, f"slave_{slave}"), exist_ok=True)
+            self.is_running = True
+            self.flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+            self.flush_thread.start()
+
+    def stop(self):
+        """写出未满的块并停止落盘线程，应在轮询停止后调用"""
+        if self.flush_thread is None:
+            return
+        for writer in self.writers.values():
+            writer.submit(self.flush_queue)
+        self.is_running = False
+        self.flush_queue.put(None)
+        self.flush_thread.join()
+        self.flush_thread = None
+
+    def append(self, slave: int, registers, timestamp: float = None):
+        writer = self.writers.get(slave)
+        if writer is None or not self.is_running:
+            return
+        writer.append(time.time() if timestamp is None else timestamp, registers, self.flush_queue)
+
+    def _flush_loop(self):
+        while True:
+            item = self.flush_queue.get()
+            if item is None:
+                return
+            writer, chunk_index, buffer, rows = item
+            path = os.path.join(self.directory, f"slave_{writer.slave}", f"chunk_{chunk_index:08d}.npy")
+            try:
+                chunk = np.lib.format.open_memmap(path, mode='w+', dtype=buffer.dtype, shape=(rows,))
+                chunk[:] = buffer[:rows]
+                chunk.flush()
+                del chunk
+            except OSError as e:
+                logger.error("Error writing register chunk %s: %s", path, e)
+            finally:
+                writer.free_buffers.put(buffer)
+
+    def get_stats(self):
+        return {slave: {'rows': writer.rows, 'chunks': writer.chunk_index,
+                        'dropped_rows': writer.dropped_rows, 'skipped_rows': writer.skipped_rows}
+                for slave, writer in self.writers.items()}
+
+
+def open_recording(directory: str, slave: int):
+    """按时间顺序返回某从站所有块文件的只读np.memmap列表，字段为timestamp和registers"""
+    if load_numpy() is None:
+        raise ImportError("open_recording requires numpy")
+    paths = sorted(glob.glob(os.path.join(directory, f"slave_{slave}", "chunk_*.npy")))
+    return [np.load(path, mmap_mode='r') for path in paths]
@@ -0,0 +1,123 @@
+import struct
+
+from FdxCodec import register_struct
+
+
+class RegisterRing(object):
+    """Modbus总线线程与FDX发送线程之间传递寄存器读取结果的单生产者单消费者(SPSC)环
+
+    槽在创建时全部分配: 从站号、接收时间(perf_counter_ns)、寄存器个数和max_registers个寄存器的存储，
+    生产者把寄存器值直接打包(byteorder，默认与FDX相同的大端)到槽内，传递时不创建dict和list。
+    head只由生产者写入，tail只由消费者写入，都是单次属性赋值，与SlotRing相同不需要加锁。
+
+    环满时默认丢弃新结果并计入dropped；overwrite_oldest为True时覆盖最旧的未读结果并计入overwritten，
+    适用于只关心最新值的周期读取。生产者写槽前把槽的seq置为-1，写完后置为消息序号，
+    消费者拷贝数据后检查seq未变，被覆盖的槽跳过并计入skipped。
+
+    消费者可用peek()取得槽的memoryview，直接拷贝到FDX数据报后调用advance()确认槽在拷贝期间未被覆盖，
+    寄存器数据只拷贝这一次；get()另外拷贝为bytes，适用于需要保留结果的调用方
+    """
+    def __init__(self, slot_count: int = 256, max_registers: int = 125, byteorder: str = 'big',
+                 overwrite_oldest: bool = False):
+        if slot_count < 1 or max_registers < 1:
+            raise ValueError("slot_count and max_registers must be positive")
+        self.slot_count = slot_count
+        self.max_registers = max_registers
+        self.byteorder = byteorder
+        self.overwrite_oldest = overwrite_oldest
+        self.slot_bytes = max_registers * 2
+        self.buffer = bytearray(slot_count * self.slot_bytes)
+        self.buffer_view = memoryview(self.buffer)
+        self.slot_seqs = [-1] * slot_count
+        self.slot_slaves = [0] * slot_count
+        self.slot_timestamps = [0] * slot_count
+        self.slot_counts = [0] * slot_count
+        self.head = 0  # 已写入的结果总数，只由生产者写入
+        self.tail = 0  # 已取出的结果总数，只由消费者写入
+        self.dropped = 0
+        self.overwritten = 0
+        self.skipped = 0
+
+    # 生产者接口
+    def put(self, slave: int, registers, timestamp_ns: int):
+        """写入一次读取结果，环满且不覆盖时返回False；寄存器超过max_registers或取值越界时抛出ValueError"""
+        count = len(registers)
+        if count > self.max_registers:
+            raise ValueError(f"register count {count} exceeds slot capacity {self.max_registers}")
+        head = self.head
+        if head - self.tail >= self.slot_count:
+            if not self.overwrite_oldest:
+                self.dropped += 1
+                return False
+            self.overwritten += 1
+        index = head % self.slot_count
+        self.slot_seqs[index] = -1
+        try:
+            register_struct(count, self.byteorder).pack_into(self.buffer, index * self.slot_bytes, *registers)
+        except struct.error as e:
+            # 槽内容不完整，seq保持-1，消费者按被覆盖的槽跳过
+            self.head = head + 1
+            raise ValueError(f"registers must be integers in 0-0xFFFF: {e}") from None
+        self.slot_slaves[index] = slave
+        self.slot_timestamps[index] = timestamp_ns
+        self.slot_counts[index] = count
+        self.slot_seqs[index] = head
+        self.head = head + 1
+        return True
+
+    # 消费者接口
+    def peek(self):
+        """最早一条结果，返回(slave, 槽内寄存器字节的memoryview, timestamp_ns)，没有结果时返回None
+
+        不拷贝寄存器数据，也不取出结果: 使用memoryview后必须调用advance()，
+        advance()返回False时槽在使用期间已被覆盖，memoryview中的数据不可用
+        """
+        while True:
+            tail = self.tail
+            head = self.head
+            if tail == head:
+                return None
+            if head - tail > self.slot_count:
+                # 生产者已覆盖到tail之后，从仍在环中的最旧结果继续
+                self.skipped += head - self.slot_count - tail
+                tail = head - self.slot_count
+                self.tail = tail
+            index = tail % self.slot_count
+            slave = self.slot_slaves[index]
+            timestamp_ns = self.slot_timestamps[index]
+            count = self.slot_counts[index]
+            if self.slot_seqs[index] == tail:
+                offset = index * self.slot_bytes
+                return slave, self.buffer_view[offset:offset + count * 2], timestamp_ns
+            # 槽正在被覆盖或写入失败
+            self.tail = tail + 1
+            self.skipped += 1
+
+    def advance(self):
+        """取出peek()返回的结果，返回槽在peek()之后是否未被覆盖"""
+        tail = self.tail
+        self.tail = tail + 1
+        if self.slot_seqs[tail % self.slot_count] == tail:
+            return True
+        self.skipped += 1
+        return False
+
+    def get(self):
+        """取出最早一条结果，返回(slave, 寄存器字节串, timestamp_ns)，寄存器数据拷贝为bytes，没有结果时返回None"""
+        while True:
+            result = self.peek()
+            if result is None:
+                return None
+            slave, data, timestamp_ns = result
+            data = bytes(data)
+            if self.advance():
+                return slave, data, timestamp_ns
+
+    def __len__(self):
+        return min(self.head - self.tail, self.slot_count)
+
+    def get_stats(self):
+        head = self.head
+        return {'slots': self.slot_count, 'used': min(head - self.tail, self.slot_count), 'messages': head,
+                'dropped': self.dropped, 'overwritten': self.overwritten, 'skipped': self.skipped,
+                'overwrite_oldest': self.overwrite_oldest}
@@ -1,6 +1,7 @@
+import time
 from enum import Enum
 
-import pyvisa
+from SCPI.ScpiQuery import IncompleteResponse, QueryBatch
 
 
 class Function(Enum):
@@ -10,9 +11,32 @@ class Function(Enum):
     POWER = "POWer"
 
 
+class InstrumentError(Exception):
+    """仪器错误队列(SYSTem:ERRor?)报告的错误，errors为[(code, message)]"""
+    def __init__(self, errors):
+        super().__init__('; '.join(f"{code},{message}" for code, message in errors))
+        self.errors = errors
+
+
 class IT8800:
-    def __init__(self, pyvisa_instrument):
+    # 结果不会改变的查询，缓存到invalidate_cache()为止
+    StaticQueries = {'*IDN?'}
+    # 执行后仪器状态可能被面板操作或复位改变，需清空缓存的命令
+    InvalidatingCommands = {'SYSTEM:LOCAL', 'SYST:LOC', '*RST'}
+    # 仪器自身会改变的状态(保护动作关闭输入、面板操作)，设置命令每次都发送，不去重
+    VolatileNodes = ('INP',)
+
+    def __init__(self, pyvisa_instrument, measurement_max_age: float = 0.0, state_max_age: float = 1.0):
+        """measurement_max_age: 测量查询(MEAS...)结果的最长缓存时间(秒)，0表示不缓存
+        state_max_age: 已写入的设置在此时间(秒)内重复写入时跳过，超过后重新发送，面板切换到本地后修改的设置不会一直被跳过
+        """
         self.pyvisa_instrument = pyvisa_instrument
+        self.measurement_max_age = measurement_max_age
+        self.state_max_age = state_max_age
+        self.state_cache = {}  # {命令头(大写): (time.monotonic(), 参数)}，已写入仪器的设置
+        self.query_cache = {}  # {查询命令: (time.monotonic(), 结果)}
+        self.cache_hits = 0
+        self.skipped_writes = 0
 
 
         self.SYSTem = IT8800.SYSTem(self)
@@ -21,10 +45,110 @@ class IT8800:
         self.MEASure = IT8800.MEASure(self)
 
     def write(self, command):
-        self.pyvisa_instrument.write(command)
+        """写命令，带参数的设置命令与已写入的值相同时跳过(write-through缓存)"""
+        header, _, argument = command.strip().partition(' ')
+        header = header.upper()
+        is_cacheable = bool(argument) and not header.endswith('?') and not self._is_volatile(header)
+        if is_cacheable:
+            cached = self.state_cache.get(header)
+            if cached is not None and cached[1] == argument and time.monotonic() - cached[0] <= self.state_max_age:
+                self.skipped_writes += 1
+                return
+        try:
+            self.pyvisa_instrument.write(command)
+        except Exception:
+            self.invalidate_cache()
+            raise
+        if header in self.InvalidatingCommands:
+            self.invalidate_cache()
+        elif is_cacheable:
+            self.state_cache[header] = (time.monotonic(), argument)
 
     def read(self):
-        return self.pyvisa_instrument.read()
+        try:
+            return self.pyvisa_instrument.read()
+        except Exception:
+            self.invalidate_cache()
+            raise
+
+    def read_raw(self):
+        try:
+            return self.pyvisa_instrument.read_raw()
+        except Exception:
+            self.invalidate_cache()
+            raise
+
+    def invalidate_cache(self):
+        self.state_cache.clear()
+        self.query_cache.clear()
+
+    def _is_volatile(self, header: str):
+        node = header.lstrip(':')
+        if node.startswith('SOUR'):
+            node = node.partition(':')[2]
+        return node.startswith(self.VolatileNodes)
+
+    def check_errors(self, max_count: int = 20):
+        """读取错误队列直到无错误，返回[(code, message)]
+
+        有错误时清空缓存，被仪器拒绝的设置不会因缓存而不再发送
+        """
+        errors = []
+        for _ in range(max_count):
+            code, _, message = self.query("SYSTem:ERRor?").partition(',')
+            if int(code) == 0:
+                break
+            errors.append((int(code), message.strip().strip('"')))
+        if errors:
+            self.invalidate_cache()
+        return errors
+
+    def _is_cacheable_query(self, command: str):
+        if command in self.StaticQueries:
+            return True
+        return self.measurement_max_age > 0 and \
+            all(query.lstrip(':').upper().startswith('MEAS') for query in command.split(';'))
+
+    def _cached_query(self, command: str, execute):
+        """可缓存的查询在缓存有效时直接返回缓存结果，否则执行execute()并缓存"""
+        if not self._is_cacheable_query(command):
+            return execute()
+        cached = self.query_cache.get(command)
+        now = time.monotonic()
+        if cached is not None and (command in self.StaticQueries or now - cached[0] <= self.measurement_max_age):
+            self.cache_hits += 1
+            return cached[1]
+        result = execute()
+        self.query_cache[command] = (now, result)
+        return result
+
+    def query(self, command: str):
+        """写查询命令并读取响应(str)"""
+        def execute():
+            self.write(command)
+            return self.read()
+        return self._cached_query(command, execute)
+
+    def query_batch(self, batch: QueryBatch):
+        """发送组合查询并返回各查询的结果，响应中的二进制块未接收完整时继续读取"""
+        def execute():
+            self.write(batch.command())
+            response = self.read_raw()
+            while True:
+                try:
+                    return batch.parse(response)
+                except IncompleteResponse:
+                    response += self.read_raw()
+        return list(self._cached_query(batch.command(), execute))
+
+    def get_cache_stats(self):
+        return {'cache_hits': self.cache_hits, 'skipped_writes': self.skipped_writes}
+
+    def query_block(self, command: str):
+        """查询返回IEEE 488.2任意块的命令，返回块数据(bytes)"""
+        batch = QueryBatch()
+        batch.add(command, bytes)
+        return self.query_batch(batch)[0]
 
 
     class Common:
@@ -32,9 +156,7 @@ class IT8800:
             self.outer = outer  # 存储外部类的引用
 
         def identification_query(self):
-            self.outer.write("*IDN?")
-            response = self.outer.read()
-            return response
+            return self.outer.query("*IDN?")
 
     class MEASure:
         def __init__(self, outer):
@@ -42,9 +164,24 @@ class IT8800:
 
         def read_voltage(self):
             # self.outer.write(f"MEASure:VOLTage:DC?")
-            self.outer.write(f"MEAS:VOLT?")
-            response = self.outer.read()
-            return int(response)
+            response = self.outer.query("MEAS:VOLT?")
+            return float(response)
+
+        def read_current(self):
+            response = self.outer.query("MEAS:CURR?")
+            return float(response)
+
+        def read_power(self):
+            response = self.outer.query("MEAS:POW?")
+            return float(response)
+
+        def read_all(self):
+            """一次组合查询读取(voltage, current, power)"""
+            batch = QueryBatch()
+            batch.add("MEAS:VOLT?", float)
+            batch.add("MEAS:CURR?", float)
+            batch.add("MEAS:POW?", float)
+            return tuple(self.outer.query_batch(batch))
 
     class SOURce:
         def __init__(self, outer):
@@ -55,6 +192,13 @@ class IT8800:
             # response = self.outer.read()
             # return response
 
+        def set_value(self, mode: Function, value: float):
+            """设置mode对应的定值，如CURRent 1.5"""
+            self.outer.write(f"SOURce:{mode.value} {value}")
+
+        def set_input(self, state: bool):
+            self.outer.write(f"SOURce:INPut {'ON' if state else 'OFF'}")
+
 
     class SYSTem:
         def __init__(self, outer):
@@ -72,6 +216,8 @@ class IT8800:
 
 
 if __name__ == '__main__':
+    import pyvisa
+
     rm = pyvisa.ResourceManager('@py')
     # resources = rm.list_resources()
     # print(resources)
@@ -0,0 +1,223 @@
+import argparse
+import time
+
+# 长格式与短格式关键字
+Keywords = {
+    'MEASURE': 'MEAS', 'VOLTAGE': 'VOLT', 'CURRENT': 'CURR', 'POWER': 'POW', 'RESISTANCE': 'RES',
+    'SOURCE': 'SOUR', 'FUNCTION': 'FUNC', 'INPUT': 'INP', 'STATE': 'STAT', 'SYSTEM': 'SYST',
+    'REMOTE': 'REM', 'LOCAL': 'LOC', 'RWLOCK': 'RWL', 'ERROR': 'ERR', 'SCALAR': 'SCAL', 'DC': 'DC',
+}
+# 可省略的节点
+OptionalNodes = {'SOUR', 'DC', 'STAT', 'SCAL'}
+
+Modes = {'CURR': 'CURRent', 'VOLT': 'VOLTage', 'RES': 'RESistance', 'POW': 'POWer'}
+
+
+def short_form(node: str):
+    upper = node.upper()
+    for long, short in Keywords.items():
+        if upper in (long, short):
+            return short
+    return upper
+
+
+class SimulatedIT8800(object):
+    """纯Python实现的IT8800电子负载，接口与pyvisa资源一致(write/read/read_raw/timeout/close)，可直接传给IT8800
+
+    支持*IDN?、*RST、MEASure:VOLTage/CURRent/POWer?、[SOURce:]FUNCtion、[SOURce:]CURRent/VOLTage/RESistance/POWer、
+    [SOURce:]INPut、SYSTem:REMote/LOCal/RWLock和SYSTem:ERRor?，支持';'组合命令；
+    被测电源为source_voltage串联internal_resistance，负载按工作模式和设定值计算测量值。
+    write_delay/response_delay模拟仪器处理时间，baud_rate不为None时按串口字符时间增加传输延迟
+    """
+    Identification = 'ITECH Ltd.,IT8813,600000000000000000,1.00-1.00'
+
+    def __init__(self, write_delay: float = 0.0, response_delay: float = 0.0, baud_rate: int = None,
+                 source_voltage: float = 12.0, internal_resistance: float = 0.1):
+        self.write_delay = write_delay
+        self.response_delay = response_delay
+        self.baud_rate = baud_rate
+        self.source_voltage = source_voltage
+        self.internal_resistance = internal_resistance
+        self.timeout = 2000  # ms，与pyvisa一致
+        self.read_termination = '\n'
+        self.output_buffer = b''
+        self.commands_received = 0
+        self.reset()
+
+    def reset(self):
+        self.mode = 'CURR'
+        self.setpoints = {'CURR': 0.0, 'VOLT': self.source_voltage, 'RES': 1000.0, 'POW': 0.0}
+        self.input_on = False
+        self.remote = False
+        self.errors = []
+
+    def close(self):
+        pass
+
+    def _transfer_delay(self, nbytes: int):
+        if self.baud_rate:
+            time.sleep(nbytes * 10 / self.baud_rate)
+
+    def write(self, command: str):
+        self._transfer_delay(len(command) + 1)
+        if self.write_delay:
+            time.sleep(self.write_delay)
+        responses = []
+        path = []
+        for unit in command.strip().split(';'):
+            unit = unit.strip()
+            if not unit:
+                continue
+            self.commands_received += 1
+            header, _, argument = unit.partition(' ')
+            if header.startswith('*'):
+                nodes = [header.upper()]
+            else:
+                nodes = [short_form(node) for node in header.lstrip(':').split(':')]
+                if not header.startswith(':') and path:
+                    # 相对路径: 继承上一条命令除最后一个节点外的路径
+                    nodes = path[:-1] + nodes
+                path = nodes
+            is_query = nodes[-1].endswith('?')
+            if is_query:
+                nodes[-1] = short_form(nodes[-1][:-1])
+            nodes = [node for node in nodes if node not in OptionalNodes]
+            response = self._execute(nodes, argument.strip(), is_query)
+            if response is not None:
+                responses.append(response)
+        if responses:
+            self.output_buffer += (';'.join(responses) + '\n').encode('ascii')
+
+    def _measure(self):
+        """返回(voltage, current)"""
+        if not self.input_on:
+            return self.source_voltage, 0.0
+        r = self.internal_resistance
+        if self.mode == 'CURR':
+            current = min(self.setpoints['CURR'], self.source_voltage / r)
+        elif self.mode == 'VOLT':
+            current = max((self.source_voltage - self.setpoints['VOLT']) / r, 0.0)
+        elif self.mode == 'RES':
+            current = self.source_voltage / (self.setpoints['RES'] + r)
+        else:
+            # P = (E - I*r) * I，取较小的解
+            power = min(self.setpoints['POW'], self.source_voltage ** 2 / (4 * r))
+            current = (self.source_voltage - (self.source_voltage ** 2 - 4 * r * power) ** 0.5) / (2 * r)
+        return self.source_voltage - current * r, current
+
+    def _error(self, code: int, message: str):
+        self.errors.append(f'{code},"{message}"')
+
+    def _execute(self, nodes, argument: str, is_query: bool):
+        command = ':'.join(nodes)
+        if command == '*IDN' and is_query:
+            return self.Identification
+        if command == '*RST':
+            self.reset()
+            return None
+        if nodes[0] == 'MEAS' and is_query and len(nodes) == 2:
+            voltage, current = self._measure()
+            values = {'VOLT': voltage, 'CURR': current, 'POW': voltage * current}
+            if nodes[1] in values:
+                return f"{values[nodes[1]]:.5f}"
+        if command == 'FUNC':
+            if is_query:
+                return self.mode
+            mode = short_form(argument)
+            if mode in Modes:
+                self.mode = mode
+                return None
+            self._error(-224, "Illegal parameter value")
+            return None
+        if len(nodes) == 1 and nodes[0] in Modes:
+            if is_query:
+                return f"{self.setpoints[nodes[0]]:.5f}"
+            try:
+                self.setpoints[nodes[0]] = float(argument)
+            except ValueError:
+                self._error(-224, "Illegal parameter value")
+            return None
+        if command == 'INP':
+            if is_query:
+                return '1' if self.input_on else '0'
+            if argument.upper() in ('ON', '1', 'OFF', '0'):
+                self.input_on = argument.upper() in ('ON', '1')
+            else:
+                self._error(-224, "Illegal parameter value")
+            return None
+        if command in ('SYST:REM', 'SYST:RWL'):
+            self.remote = True
+            return None
+        if command == 'SYST:LOC':
+            self.remote = False
+            return None
+        if command == 'SYST:ERR' and is_query:
+            return self.errors.pop(0) if self.errors else '0,"No error"'
+        self._error(-113, "Undefined header")
+        return None
+
+    def read_raw(self):
+        if not self.output_buffer:
+            time.sleep(self.timeout / 1000)
+            raise TimeoutError("VI_ERROR_TMO: Timeout expired before operation completed.")
+        if self.response_delay:
+            time.sleep(self.response_delay)
+        response = self.output_buffer
+        end = response.find(b'\n') + 1
+        response, self.output_buffer = response[:end], response[end:]
+        self._transfer_delay(len(response))
+        return response
+
+    def read(self):
+        response = self.read_raw().decode('ascii')
+        if response.endswith(self.read_termination):
+            response = response[:-len(self.read_termination)]
+        return response
+
+
+def benchmark(count: int, instruments: int, response_delay: float, baud_rate: int):
+    """对比逐条查询、组合查询、缓存和多台仪器并发测量的耗时"""
+    from ScpiPoller import InstrumentWorker, ScpiInstrumentManager
+    from SCPI.ITECH.IT8800 import IT8800, Function
+
+    def simulated(max_age=0.0):
+        instrument = IT8800(SimulatedIT8800(response_delay=response_delay, baud_rate=baud_rate), max_age)
+        instrument.SOURce.set_function(Function.CURRENT)
+        instrument.SOURce.set_value(Function.CURRENT, 2.0)
+        instrument.SOURce.set_input(True)
+        return instrument
+
+    def timed(name, func):
+        start = time.perf_counter()
+        for _ in range(count):
+            func()
+        elapsed = time.perf_counter() - start
+        print(f"{name:<32} {elapsed / count * 1000:8.3f} ms/poll")
+
+    instrument = simulated()
+    timed("separate V/I/P queries",
+          lambda: (instrument.MEASure.read_voltage(), instrument.MEASure.read_current(),
+                   instrument.MEASure.read_power()))
+    timed("compound V/I/P query", instrument.MEASure.read_all)
+    cached_instrument = simulated(max_age=1.0)
+    timed("compound query, 1s max-age", cached_instrument.MEASure.read_all)
+    timed("repeated setpoint write", lambda: cached_instrument.SOURce.set_value(Function.CURRENT, 2.0))
+
+    simulated_instruments = [simulated() for _ in range(instruments)]
+    timed(f"{instruments} instruments sequential",
+          lambda: [InstrumentWorker.measure(it) for it in simulated_instruments])
+    manager = ScpiInstrumentManager()
+    for index, it in enumerate(simulated_instruments):
+        manager.add_instrument(f"sim{index}", it)
+    timed(f"{instruments} instruments concurrent", manager.poll_all)
+    manager.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the IT8800 driver against a simulated instrument")
+    parser.add_argument('--count', type=int, default=50)
+    parser.add_argument('--instruments', type=int, default=4)
+    parser.add_argument('--response-delay', type=float, default=0.002, help="instrument processing time in seconds")
+    parser.add_argument('--baud', type=int, default=115200, help="0 disables serial transfer delay")
+    args = parser.parse_args()
+    benchmark(args.count, args.instruments, args.response_delay, args.baud or None)
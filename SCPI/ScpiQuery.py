@@ -0,0 +1,90 @@
+class IncompleteResponse(Exception):
+    """响应中的二进制块尚未接收完整"""
+    def __init__(self, missing: int):
+        super().__init__(f"{missing} more bytes expected")
+        self.missing = missing
+
+
+def parse_block(data: bytes, offset: int = 0):
+    """解析offset处的IEEE 488.2任意块，返回(块数据, 块后的位置)
+
+    定长块: #<n><n位十进制长度><数据>；不定长块: #0<数据>，直到响应结束(去掉结尾换行)
+    """
+    if data[offset:offset + 1] != b'#':
+        raise ValueError(f"no block at offset {offset}")
+    if offset + 2 > len(data):
+        raise IncompleteResponse(2)
+    digits = data[offset + 1] - 0x30
+    if not 0 <= digits <= 9:
+        raise ValueError(f"invalid block header {data[offset:offset + 2]!r}")
+    if digits == 0:
+        end = len(data)
+        if data.endswith(b'\n'):
+            end -= 1
+        return data[offset + 2:end], len(data)
+    header_end = offset + 2 + digits
+    if header_end > len(data):
+        raise IncompleteResponse(header_end - len(data))
+    length = int(data[offset + 2:header_end])
+    end = header_end + length
+    if end > len(data):
+        raise IncompleteResponse(end - len(data))
+    return data[header_end:end], end
+
+
+def split_response(data: bytes):
+    """按顶层的';'拆分组合查询的响应，引号字符串和任意块中的';'不拆分
+
+    返回[bytes, ...]，任意块单元返回块数据本身，其他单元去掉首尾空白
+    """
+    units = []
+    start = 0
+    offset = 0
+    block = None
+    while offset < len(data):
+        char = data[offset]
+        if char == 0x23 and offset == start:  # '#'
+            block, offset = parse_block(data, offset)
+            continue
+        if char in (0x22, 0x27):  # 引号字符串
+            end = data.find(bytes([char]), offset + 1)
+            if end < 0:
+                raise ValueError("unterminated string in response")
+            offset = end + 1
+            continue
+        if char == 0x3B:  # ';'
+            units.append(block if block is not None else data[start:offset].strip())
+            block = None
+            offset += 1
+            while offset < len(data) and data[offset] in b' \t':
+                offset += 1
+            start = offset
+            continue
+        if char == 0x0A and block is None and not data[offset + 1:].strip():
+            break  # 响应结束符
+        offset += 1
+    units.append(block if block is not None else data[start:offset].strip())
+    return units
+
+
+class QueryBatch(object):
+    """将多个查询合并为一条组合命令，如MEAS:VOLT?;:MEAS:CURR?;:MEAS:POW?，一次往返得到所有结果"""
+    def __init__(self):
+        self.queries = []  # [(query, converter)]
+
+    def add(self, query: str, converter=None):
+        """converter: 将响应单元(bytes)转换为结果的函数，None时返回去掉空白的str，二进制块可传bytes"""
+        self.queries.append((query.lstrip(':'), converter))
+        return len(self.queries) - 1
+
+    def command(self):
+        return ';:'.join(query for query, _ in self.queries)
+
+    def parse(self, response: bytes):
+        units = split_response(response)
+        if len(units) != len(self.queries):
+            raise ValueError(f"expected {len(self.queries)} responses, got {len(units)}: {response!r}")
+        results = []
+        for unit, (_, converter) in zip(units, self.queries):
+            results.append(unit.decode('ascii') if converter is None else converter(unit))
+        return results
@@ -0,0 +1,238 @@
+import queue
+import struct
+import threading
+import time
+from concurrent.futures import CancelledError, Future, TimeoutError, wait
+from typing import Optional
+
+from LogUtils import get_logger
+from SCPI.ITECH.IT8800 import IT8800, Function, InstrumentError
+
+logger = get_logger(__name__)
+
+# 设定值数据组中function字段的取值，0表示不改变工作模式
+SetpointFunctions = {
+    1: Function.CURRENT,
+    2: Function.RESISTANCE,
+    3: Function.VOLTAGE,
+    4: Function.POWER,
+}
+
+
+def encode_measurement(voltage: float, current: float, power: float, byteorder: str = 'big'):
+    """测量数据组: voltage, current, power，均为float32"""
+    return struct.pack(f"{'>' if byteorder == 'big' else '<'}fff", voltage, current, power)
+
+
+def decode_setpoint(databytes: bytes, byteorder: str = 'big'):
+    """设定值数据组: function(uint16), input(uint16, 0不改变/1关闭/2打开), value(float32)"""
+    return struct.unpack(f"{'>' if byteorder == 'big' else '<'}HHf", databytes[:8])
+
+
+def open_it8800(resource: str, visa_backend: str = '@py', timeout_ms: int = 2000,
+                measurement_max_age: float = 0.0, **resource_kwargs):
+    """通过pyvisa打开仪器，resource_kwargs传给open_resource，如baud_rate
+
+    visa_backend为'sim'时打开SimulatedIT8800，resource_kwargs传给其构造函数，如response_delay
+    """
+    if visa_backend == 'sim':
+        from SCPI.ITECH.IT8800Simulator import SimulatedIT8800
+        instrument = SimulatedIT8800(**resource_kwargs)
+        instrument.timeout = timeout_ms
+        return IT8800(instrument, measurement_max_age)
+    import pyvisa
+    resource_manager = pyvisa.ResourceManager(visa_backend)
+    instrument = resource_manager.open_resource(resource, **resource_kwargs)
+    instrument.timeout = timeout_ms
+    return IT8800(instrument, measurement_max_age)
+
+
+class InstrumentWorker(object):
+    """单台仪器的工作线程和命令队列
+
+    对仪器的所有访问都在本线程中按提交顺序执行，submit(func, *args)执行func(instrument, *args)，
+    结果或异常写入返回的Future；设置了poll_interval时在命令之间每poll_interval秒测量一次电压、电流和功率，
+    通过on_measurement(name, (voltage, current, power), timestamp)回调输出。
+    仪器查询慢时只阻塞本线程，不影响其他仪器和Modbus、FDX收发
+    """
+    def __init__(self, name: str, instrument: IT8800, poll_interval: Optional[float] = None):
+        self.name = name
+        self.instrument = instrument
+        self.poll_interval = poll_interval
+        self.on_measurement = None
+        self.commands = queue.SimpleQueue()
+        self.worker_thread = None
+        self.is_running = False
+        self.commands_done = 0
+        self.polls = 0
+        self.errors = 0
+        self.dropped_commands = 0  # 执行前已超过截止时间的命令数
+        self.last_poll_duration = 0.0
+
+    def start(self):
+        if self.worker_thread is None or not self.worker_thread.is_alive():
+            self.is_running = True
+            self.worker_thread = threading.Thread(target=self._worker_loop, daemon=True)
+            self.worker_thread.start()
+
+    def stop(self):
+        """停止线程，队列中未执行的命令的Future被取消"""
+        if self.worker_thread is not None:
+            self.is_running = False
+            self.commands.put(None)
+            self.worker_thread.join()
+            self.worker_thread = None
+        while True:
+            try:
+                command = self.commands.get_nowait()
+            except queue.Empty:
+                break
+            if command is not None:
+                command[0].cancel()
+
+    def submit(self, func, *args, timeout: Optional[float] = None) -> Future:
+        """提交func(instrument, *args)，timeout为从提交开始计算的截止时间(秒)，执行前已超时时Future抛出TimeoutError"""
+        future = Future()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        self.commands.put((future, func, args, deadline))
+        return future
+
+    @staticmethod
+    def apply_setpoint(instrument: IT8800, function: Function = None, value: float = None, input_state: bool = None):
+        if function is not None:
+            instrument.SOURce.set_function(function)
+            if value is not None:
+                instrument.SOURce.set_value(function, value)
+        if input_state is not None:
+            instrument.SOURce.set_input(input_state)
+        # 设置被仪器拒绝时错误队列中有记录，同时清空设置缓存
+        errors = instrument.check_errors()
+        if errors:
+            raise InstrumentError(errors)
+
+    def submit_setpoint(self, function: Function = None, value: float = None, input_state: bool = None,
+                        timeout: Optional[float] = None) -> Future:
+        """设定工作模式和定值、打开或关闭输入，参数为None的项不改变"""
+        return self.submit(self.apply_setpoint, function, value, input_state, timeout=timeout)
+
+    @staticmethod
+    def measure(instrument: IT8800):
+        """返回(voltage, current, power)，一次组合查询完成"""
+        return instrument.MEASure.read_all()
+
+    def _execute(self, command):
+        future, func, args, deadline = command
+        if not future.set_running_or_notify_cancel():
+            return
+        if deadline is not None and time.monotonic() > deadline:
+            self.dropped_commands += 1
+            future.set_exception(TimeoutError("command deadline exceeded before execution"))
+            return
+        try:
+            future.set_result(func(self.instrument, *args))
+        except Exception as e:
+            self.errors += 1
+            logger.error("SCPI %s command error: %s", self.name, e)
+            future.set_exception(e)
+        self.commands_done += 1
+
+    def _poll(self):
+        start = time.perf_counter()
+        try:
+            values = self.measure(self.instrument)
+        except Exception as e:
+            self.errors += 1
+            logger.error("SCPI %s measure error: %s", self.name, e)
+        else:
+            self.polls += 1
+            if self.on_measurement is not None:
+                self.on_measurement(self.name, values, time.time())
+        self.last_poll_duration = time.perf_counter() - start
+
+    def _worker_loop(self):
+        next_poll = time.monotonic()
+        while self.is_running:
+            timeout = max(next_poll - time.monotonic(), 0) if self.poll_interval else None
+            try:
+                command = self.commands.get(timeout=timeout)
+            except queue.Empty:
+                command = None
+            if not self.is_running:
+                if command is not None:
+                    # stop()之后取出的命令不再执行，取消后调用方的result()不会一直等待
+                    command[0].cancel()
+                break
+            if command is not None:
+                self._execute(command)
+            # 每条命令后都检查测量周期，持续的设定命令不会让测量停止
+            if not self.poll_interval or time.monotonic() < next_poll:
+                continue
+            self._poll()
+            next_poll += self.poll_interval
+            if next_poll < time.monotonic():
+                # 测量耗时超过周期时不补测
+                next_poll = time.monotonic() + self.poll_interval
+
+    def get_stats(self):
+        stats = {'commands': self.commands_done, 'polls': self.polls, 'errors': self.errors,
+                 'dropped_commands': self.dropped_commands, 'queue_size': self.commands.qsize(),
+                 'last_poll_duration_ms': round(self.last_poll_duration * 1000, 3)}
+        stats.update(self.instrument.get_cache_stats())
+        return stats
+
+
+class ScpiInstrumentManager(object):
+    """管理多台仪器，每台仪器一个InstrumentWorker，各仪器的命令并发执行
+
+    poll_all()同时向所有仪器提交测量，总耗时取决于最慢的仪器而不是所有仪器之和
+    """
+    def __init__(self):
+        self.workers = {}  # {name: InstrumentWorker}
+        self.on_measurement = None
+
+    def add_instrument(self, name: str, instrument: IT8800, poll_interval: Optional[float] = None):
+        if name in self.workers:
+            raise ValueError(f"instrument {name} already exists")
+        worker = InstrumentWorker(name, instrument, poll_interval)
+        worker.on_measurement = self._on_measurement
+        self.workers[name] = worker
+        worker.start()
+        return worker
+
+    def open_instrument(self, name: str, resource: str, visa_backend: str = '@py', timeout_ms: int = 2000,
+                        poll_interval: Optional[float] = None, measurement_max_age: float = 0.0, **resource_kwargs):
+        instrument = open_it8800(resource, visa_backend, timeout_ms, measurement_max_age, **resource_kwargs)
+        return self.add_instrument(name, instrument, poll_interval)
+
+    def _on_measurement(self, name, values, timestamp):
+        if self.on_measurement is not None:
+            self.on_measurement(name, values, timestamp)
+
+    def submit(self, name: str, func, *args, timeout: Optional[float] = None) -> Future:
+        return self.workers[name].submit(func, *args, timeout=timeout)
+
+    def submit_all(self, func, *args, timeout: Optional[float] = None):
+        """向所有仪器提交func(instrument, *args)，返回{name: Future}"""
+        return {name: worker.submit(func, *args, timeout=timeout) for name, worker in self.workers.items()}
+
+    def poll_all(self, timeout: Optional[float] = None):
+        """同时测量所有仪器，返回{name: (voltage, current, power)或异常}"""
+        futures = self.submit_all(InstrumentWorker.measure, timeout=timeout)
+        wait(futures.values(), timeout=timeout)
+        results = {}
+        for name, future in futures.items():
+            if not future.done():
+                results[name] = TimeoutError(f"instrument {name} did not respond")
+            elif future.cancelled():
+                results[name] = CancelledError()
+            else:
+                results[name] = future.exception() or future.result()
+        return results
+
+    def stop(self):
+        for worker in self.workers.values():
+            worker.stop()
+        self.workers = {}
+
+    def get_stats(self):
+        return {name: worker.get_stats() for name, worker in self.workers.items()}
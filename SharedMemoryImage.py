@@ -0,0 +1,184 @@
+import os
+import struct
+import sys
+from multiprocessing import shared_memory
+
+from LogUtils import get_logger
+from RegisterImage import SeqlockImage
+from SlotRing import SlotRing
+
+logger = get_logger(__name__)
+
+# 创建方在共享内存末尾记录magic(8s)和pid(u64)，据此判断同名共享内存是否为异常退出遗留
+OwnerRecord = struct.Struct('<8sQ')
+OwnerMagic = b'FDXOWNER'
+
+
+def _untrack(shm: shared_memory.SharedMemory):
+    """读取方附加的共享内存不交给resource_tracker管理，否则读取进程退出时会删除发布方的共享内存"""
+    if sys.version_info >= (3, 13) or sys.platform == 'win32':
+        return
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception as e:
+        logger.debug("unregister shared memory %s error: %s", shm.name, e)
+
+
+def _is_process_alive(pid: int):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _live_owner(name: str):
+    """返回同名共享内存的使用者描述，能确认创建方进程已退出时返回None"""
+    if sys.platform == 'win32':
+        # Windows上共享内存在最后一个句柄关闭时删除，仍存在说明有进程在使用
+        return "another process"
+    shm = shared_memory.SharedMemory(name=name)
+    magic, pid = None, None
+    try:
+        if shm.size >= OwnerRecord.size:
+            magic, pid = OwnerRecord.unpack_from(shm.buf, shm.size - OwnerRecord.size)
+    finally:
+        # 本进程创建的共享内存已登记在resource_tracker中，不能注销
+        if magic != OwnerMagic or pid != os.getpid():
+            _untrack(shm)
+        shm.close()
+    if magic != OwnerMagic:
+        return "an unknown process"
+    if pid == os.getpid() or _is_process_alive(pid):
+        return f"process {pid}"
+    return None
+
+
+def _create(name: str, size: int):
+    """创建size字节的共享内存，末尾另加创建方记录
+
+    同名共享内存已存在时，只有创建方进程已退出(上次异常退出遗留)才删除重建，
+    否则抛出FileExistsError，不接管另一个运行中实例的共享内存
+    """
+    total_size = size + OwnerRecord.size
+    try:
+        shm = shared_memory.SharedMemory(name=name, create=True, size=total_size)
+    except FileExistsError:
+        owner = _live_owner(name)
+        if owner is not None:
+            raise FileExistsError(f"shared memory {name} is in use by {owner}, "
+                                  f"another instance may use the same shared_memory_name_prefix") from None
+        logger.warning("Removing stale shared memory %s", name)
+        stale = shared_memory.SharedMemory(name=name)
+        stale.close()
+        stale.unlink()
+        shm = shared_memory.SharedMemory(name=name, create=True, size=total_size)
+    OwnerRecord.pack_into(shm.buf, shm.size - OwnerRecord.size, OwnerMagic, os.getpid())
+    return shm
+
+
+class SharedImagePublisher(object):
+    """在multiprocessing.shared_memory中创建SeqlockImage，布局见SeqlockImage
+
+    发布方进程中的唯一写入线程调用image.update()，本机任意进程可用attach_shared_image()按名称只读访问；
+    共享内存末尾另有OwnerRecord(创建方pid)，同名共享内存的创建方仍在运行时抛出FileExistsError
+    """
+    def __init__(self, name: str, entries: dict, typecode: str = 'H'):
+        self.shm = _create(name, SeqlockImage.required_size(entries, typecode))
+        self.name = name
+        self.image = SeqlockImage(entries, typecode, self.shm.buf)
+
+    def unlink(self):
+        """只删除共享内存名称，本进程的映射仍有效，之后可用同名创建新的发布方，映射由close(unlink=False)释放"""
+        if self.shm is None:
+            return
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    def close(self, unlink: bool = True):
+        """释放并删除共享内存，应在写入线程停止后调用
+
+        unlink为False时只释放本进程的映射，用于同名共享内存已被新的发布方替换的情况
+        """
+        if self.shm is None:
+            return
+        self.image.release()
+        self.shm.close()
+        if unlink:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+        self.shm = None
+
+
+class SharedImageSubscriber(object):
+    """读取方: 按名称附加到发布方的共享内存映像"""
+    def __init__(self, name: str):
+        self.shm = shared_memory.SharedMemory(name=name)
+        _untrack(self.shm)
+        self.name = name
+        self.image = SeqlockImage.attach(self.shm.buf)
+        self.reader = self.image.reader()
+
+    def snapshot(self, entry_id: int):
+        """返回(数据memoryview, seq, timestamp)，见ImageReader.snapshot()"""
+        return self.reader.snapshot(entry_id)
+
+    def close(self):
+        if self.shm is None:
+            return
+        self.image.release()
+        self.shm.close()
+        self.shm = None
+
+
+def attach_shared_image(name: str):
+    return SharedImageSubscriber(name)
+
+
+class SharedSlotRing(object):
+    """共享内存中的SlotRing，slot_count为0时按名称附加到另一进程创建的环
+
+    创建方负责close(unlink=True)删除共享内存，附加方只释放本进程的映射；生产者和消费者各在一个进程中。
+    创建方以spawn方式启动的子进程与其共用resource_tracker，附加时应传入untrack=False，
+    否则子进程的注销会让创建方unlink时resource_tracker报KeyError
+    """
+    def __init__(self, name: str, slot_count: int = 0, slot_size: int = 0, untrack: bool = True):
+        self.name = name
+        self.is_owner = slot_count > 0
+        if self.is_owner:
+            self.shm = _create(name, SlotRing.required_size(slot_count, slot_size))
+            self.ring = SlotRing(slot_count, slot_size, self.shm.buf)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            if untrack:
+                _untrack(self.shm)
+            self.ring = SlotRing.attach(self.shm.buf)
+
+    def close(self, unlink: bool = None):
+        """unlink为None时由创建方删除共享内存"""
+        if self.shm is None:
+            return
+        self.ring.release()
+        self.shm.close()
+        if self.is_owner if unlink is None else unlink:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+        self.shm = None
+
+
+if __name__ == '__main__':
+    # 示例: python SharedMemoryImage.py fdx_bridge_registers
+    subscriber = attach_shared_image(sys.argv[1] if len(sys.argv) > 1 else 'fdx_bridge_registers')
+    for entry_id in subscriber.image.entries:
+        values, seq, timestamp = subscriber.snapshot(entry_id)
+        print(f"{entry_id}: seq={seq} timestamp={timestamp:.3f} values={values.tolist()}")
+    subscriber.close()
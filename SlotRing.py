@@ -0,0 +1,144 @@
+import struct
+
+
+class SlotRing(object):
+    """单生产者单消费者(SPSC)的定长槽环形缓冲，可建立在共享内存上用于进程间传递消息，不加锁也不序列化对象
+
+    所有数据保存在一块连续缓冲中(小端)，布局:
+        头部 64字节: magic(8s) version(u32) slot_count(u32) slot_size(u32)
+        64:  head(u64)     生产者已写入的消息总数，只由生产者写入
+        72:  dropped(u64)  环满时丢弃的消息数，只由生产者写入
+        128: tail(u64)     消费者已取出的消息总数，只由消费者写入
+        192: slot_count个槽，每个槽: length(u32) 保留(u32) slot_size字节数据
+    生产者写完槽内数据后再增加head，消费者处理完槽内数据后再增加tail；head和tail位于不同的缓存行，
+    都是8字节对齐的单次写入，与SeqlockImage相同，另一方总是看到完整的值
+    """
+    Magic = b'FDXRING\x00'
+    Version = 1
+    HeaderStruct = struct.Struct('<8sIII')
+    HeadOffset = 64
+    DroppedOffset = 72
+    TailOffset = 128
+    SlotsOffset = 192
+    SlotHeaderStruct = struct.Struct('<II')
+
+    def __init__(self, slot_count: int, slot_size: int, buffer=None):
+        """buffer为None时分配bytearray，否则在给定缓冲(如共享内存)上初始化，已有内容被清空"""
+        if slot_count < 1 or slot_size < 1:
+            raise ValueError("slot_count and slot_size must be positive")
+        self.slot_count = slot_count
+        self.slot_size = slot_size
+        required_size = self.required_size(slot_count, slot_size)
+        if buffer is None:
+            buffer = bytearray(required_size)
+        self.buffer = memoryview(buffer).cast('B')
+        if len(self.buffer) < required_size:
+            raise ValueError(f"buffer size {len(self.buffer)} smaller than required {required_size}")
+        self.buffer[:self.SlotsOffset] = bytes(self.SlotsOffset)
+        self.HeaderStruct.pack_into(self.buffer, 0, self.Magic, self.Version, slot_count, slot_size)
+        self._build_views()
+
+    @classmethod
+    def slot_stride(cls, slot_size: int):
+        return cls.SlotHeaderStruct.size + ((slot_size + 7) & ~7)
+
+    @classmethod
+    def required_size(cls, slot_count: int, slot_size: int):
+        return cls.SlotsOffset + slot_count * cls.slot_stride(slot_size)
+
+    @classmethod
+    def attach(cls, buffer):
+        """按缓冲中已有的头部创建环对象，不清空数据，用于另一个进程中的生产者或消费者"""
+        ring = cls.__new__(cls)
+        ring.buffer = memoryview(buffer).cast('B')
+        magic, version, ring.slot_count, ring.slot_size = cls.HeaderStruct.unpack_from(ring.buffer, 0)
+        if magic != cls.Magic or version != cls.Version:
+            raise ValueError("buffer does not contain a slot ring")
+        ring._build_views()
+        return ring
+
+    def _build_views(self):
+        self.head_view = self.buffer[self.HeadOffset:self.HeadOffset + 8].cast('Q')
+        self.dropped_view = self.buffer[self.DroppedOffset:self.DroppedOffset + 8].cast('Q')
+        self.tail_view = self.buffer[self.TailOffset:self.TailOffset + 8].cast('Q')
+        stride = self.slot_stride(self.slot_size)
+        # [(length视图, 数据视图)]
+        self.slots = []
+        for index in range(self.slot_count):
+            offset = self.SlotsOffset + index * stride
+            data_offset = offset + self.SlotHeaderStruct.size
+            self.slots.append((self.buffer[offset:offset + 4].cast('I'),
+                               self.buffer[data_offset:data_offset + self.slot_size]))
+        self.reserved_index = None
+
+    # 生产者接口
+    def reserve(self):
+        """返回下一个空槽的数据视图(slot_size字节)，写入后调用commit(length)发布；环满时丢弃并返回None"""
+        head = self.head_view[0]
+        if head - self.tail_view[0] >= self.slot_count:
+            self.dropped_view[0] += 1
+            return None
+        self.reserved_index = head % self.slot_count
+        return self.slots[self.reserved_index][1]
+
+    def commit(self, length: int):
+        if self.reserved_index is None:
+            raise RuntimeError("commit() without reserve()")
+        if not 0 <= length <= self.slot_size:
+            raise ValueError(f"message length {length} exceeds slot size {self.slot_size}")
+        self.slots[self.reserved_index][0][0] = length
+        self.reserved_index = None
+        self.head_view[0] += 1
+
+    def put(self, data):
+        """拷贝data到下一个空槽并发布，环满时返回False；data超过slot_size时抛出ValueError"""
+        if len(data) > self.slot_size:
+            raise ValueError(f"message length {len(data)} exceeds slot size {self.slot_size}")
+        slot = self.reserve()
+        if slot is None:
+            return False
+        slot[:len(data)] = data
+        self.commit(len(data))
+        return True
+
+    # 消费者接口
+    def peek(self):
+        """返回最早一条消息的数据视图，没有消息时返回None；视图在advance()之前有效"""
+        tail = self.tail_view[0]
+        if tail == self.head_view[0]:
+            return None
+        length_view, data_view = self.slots[tail % self.slot_count]
+        return data_view[:length_view[0]]
+
+    def advance(self):
+        """释放peek()返回的消息所在的槽"""
+        self.tail_view[0] += 1
+
+    def get(self):
+        """取出最早一条消息，返回bytes，没有消息时返回None"""
+        message = self.peek()
+        if message is None:
+            return None
+        data = bytes(message)
+        message.release()
+        self.advance()
+        return data
+
+    def __len__(self):
+        return self.head_view[0] - self.tail_view[0]
+
+    def get_stats(self):
+        head = self.head_view[0]
+        return {'slots': self.slot_count, 'slot_size': self.slot_size, 'used': head - self.tail_view[0],
+                'messages': head, 'dropped': self.dropped_view[0]}
+
+    def release(self):
+        """释放对缓冲的所有引用，共享内存close()前必须调用"""
+        for length_view, data_view in self.slots:
+            length_view.release()
+            data_view.release()
+        self.slots = []
+        self.head_view.release()
+        self.dropped_view.release()
+        self.tail_view.release()
+        self.buffer.release()
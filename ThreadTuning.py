@@ -0,0 +1,74 @@
+import os
+import threading
+import time
+
+from LogUtils import get_logger
+from Metrics import LatencyHistogram
+
+logger = get_logger(__name__)
+
+SchedulingPolicies = {
+    'other': 'SCHED_OTHER',
+    'batch': 'SCHED_BATCH',
+    'idle': 'SCHED_IDLE',
+    'fifo': 'SCHED_FIFO',
+    'rr': 'SCHED_RR',
+}
+
+
+def apply_thread_scheduling(name: str, settings: dict):
+    """在目标线程内调用，设置当前线程的CPU亲和性和调度策略，返回实际生效的设置
+
+    settings: {'cpus': [2, 3], 'policy': 'fifo'/'rr'/'other'/'batch'/'idle', 'priority': 1-99, 'nice': -20-19}
+    Linux上这些设置只作用于调用线程；系统不支持或权限不足(SCHED_FIFO需要CAP_SYS_NICE)时只输出警告
+    """
+    applied = {}
+    if not settings:
+        return applied
+    cpus = settings.get('cpus')
+    if cpus:
+        try:
+            os.sched_setaffinity(0, cpus)
+            applied['cpus'] = sorted(os.sched_getaffinity(0))
+        except (AttributeError, OSError, ValueError) as e:
+            logger.warning("Thread %s: cannot set CPU affinity %s: %s", name, cpus, e)
+    policy = settings.get('policy')
+    if policy:
+        try:
+            policy_value = getattr(os, SchedulingPolicies[policy])
+            priority = settings.get('priority', 1) if policy in ('fifo', 'rr') else 0
+            os.sched_setscheduler(0, policy_value, os.sched_param(priority))
+            applied['policy'] = policy
+            applied['priority'] = priority
+        except KeyError:
+            logger.warning("Thread %s: unknown scheduling policy %s", name, policy)
+        except (AttributeError, OSError) as e:
+            logger.warning("Thread %s: cannot set scheduling policy %s: %s", name, policy, e)
+    nice = settings.get('nice')
+    if nice is not None:
+        try:
+            # PRIO_PROCESS配合线程id时只调整该线程
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), nice)
+            applied['nice'] = nice
+        except (AttributeError, OSError) as e:
+            logger.warning("Thread %s: cannot set nice %s: %s", name, nice, e)
+    if applied:
+        logger.info("Thread %s scheduling: %s", name, applied)
+    return applied
+
+
+class LoopLateness(object):
+    """循环实际唤醒时刻与预期唤醒时刻之差(us)，只由循环所在线程写入"""
+    def __init__(self):
+        self.histogram = LatencyHistogram()
+
+    def record(self, intended_ns: int, actual_ns: int = None):
+        if actual_ns is None:
+            actual_ns = time.perf_counter_ns()
+        self.histogram.record((actual_ns - intended_ns) // 1000)
+
+    def reset(self):
+        self.histogram.reset()
+
+    def snapshot(self):
+        return self.histogram.snapshot()
@@ -1,8 +1,16 @@
 import socket
 import struct
 import threading
+import time
 from typing import Literal
 
+from FdxCodec import decode_data_exchange, decode_fdx_header, encode_fdx_command, iter_fdx_commands
+from LogUtils import get_logger
+from Metrics import FdxLinkStats
+from ThreadTuning import LoopLateness, apply_thread_scheduling
+
+logger = get_logger(__name__)
+
 
 class VectorFDX(object):
     # 定义命令代码
@@ -69,6 +77,11 @@ class VectorFDX(object):
         self.target_port = target_port
         self.receive_thread = None
         self.is_running = False
+        self.link_stats = FdxLinkStats()
+        self.group_image = None  # SeqlockImage('B')，按groupid保存最近收到的DataExchange数据
+        self.rx_timestamp_ns = 0  # 当前正在解析的数据报的接收时刻(time.perf_counter_ns())
+        self.receive_thread_scheduling = None  # 接收线程的CPU亲和性和调度策略，见ThreadTuning.apply_thread_scheduling
+        self.receive_lateness = LoopLateness()  # 接收线程socket超时后的唤醒延迟
 
         # self.received_data = []  # 存储接收到的数据
         self.command_handlers = {
@@ -94,7 +107,7 @@ class VectorFDX(object):
         elif self.UDP_Or_TCP == 'TCP':
             self.create_tcp_socket()
         else:
-            print(f"不支持{self.UDP_Or_TCP}协议")
+            logger.error("不支持%s协议", self.UDP_Or_TCP)
 
     def create_udp_socket(self):
         """创建 UDP 套接字并绑定到本地地址"""
@@ -108,7 +121,7 @@ class VectorFDX(object):
                 try:
                     self.close_socket()
                 except Exception as e:
-                    print(e)
+                    logger.error("%s", e)
         except:
             self.socket = None
 
@@ -128,12 +141,12 @@ class VectorFDX(object):
                 try:
                     self.close_socket()
                 except Exception as e:
-                    print(e)
+                    logger.error("%s", e)
         except OSError as e:
             if e.errno == 98:  # "Address already in use" error
-                print(f"错误: 端口 {self.local_port} 已经被占用.")
+                logger.error("错误: 端口 %s 已经被占用.", self.local_port)
             else:
-                print(f"error: {e}")
+                logger.error("error: %s", e)
             self.close_socket()
 
     # def create_tcp_socket(self):  # 服务端
@@ -162,21 +175,27 @@ class VectorFDX(object):
 
     def _receive_data_thread(self):
         """接收数据的线程函数"""
+        apply_thread_scheduling('fdx_receive', self.receive_thread_scheduling)
+        self.receive_lateness.reset()
         while self.is_running:
+            # socket超时时按预期超时时刻统计唤醒延迟
+            wait_start_ns = time.perf_counter_ns()
             if self.UDP_Or_TCP == "UDP":
                 try:
                     data, addr = self.socket.recvfrom(65535)
+                    self.rx_timestamp_ns = time.perf_counter_ns()
+                    self.link_stats.record_received(addr, len(data))
                     if not data.startswith(self.fdx_signature):
-                        print("Invalid FDX signature.")
+                        logger.warning("Invalid FDX signature.")
                     else:
                         self.parse_fdx_data(data, addr)
                     # print(f"Received data from {addr}: {data.hex()}")
                 except socket.timeout:
-                    pass
+                    self.receive_lateness.record(wait_start_ns + int(self.socket.gettimeout() * 1e9))
                     # print('socket.timeout')
                 except Exception as e:
                     if True:  # 仅当 is_running 为 True 时才打印错误
-                        print(f"Error receiving data: {e}")
+                        logger.error("Error receiving data: %s", e)
                         if e.args[0] == 10054:  # [WinError 10054] 远程主机强迫关闭了一个现有的连接。 端口不可达
                             pass
                         else:
@@ -184,17 +203,19 @@ class VectorFDX(object):
             else:
                 try:
                     data = self.socket.recv(65535)
+                    self.rx_timestamp_ns = time.perf_counter_ns()
+                    self.link_stats.record_received((self.target_ip, self.target_port), len(data))
                     if not data.startswith(self.fdx_signature):
-                        print("Invalid FDX signature.")
+                        logger.warning("Invalid FDX signature.")
                     else:
                         self.parse_fdx_data(data)
                     # print(f"Received data from {addr}: {data.hex()}")
                 except socket.timeout:
-                    pass
+                    self.receive_lateness.record(wait_start_ns + int(self.socket.gettimeout() * 1e9))
                     # print('socket.timeout')
                 except Exception as e:
                     if True:  # 仅当 is_running 为 True 时才打印错误
-                        print(f"Error receiving data: {e}")
+                        logger.error("Error receiving data: %s", e)
                         break
 
     def parse_fdx_data(self, data, addr=None):
@@ -204,52 +225,31 @@ class VectorFDX(object):
             # 检查数据长度是否足够
             header_len = 16
             if len(data) < header_len + 4:
-                print(f"Data too short: {len(data)} bytes")
+                logger.warning("Data too short: %d bytes", len(data))
                 return
 
-            if data[14] == 1: # big
-                fdx_signature, major_version, minor_version, number_of_commands, sequence_number, protocol_flags, reserved = struct.unpack(
-                    f'>8sBBHHBB', data[:header_len])
-            else:
-                fdx_signature, major_version, minor_version, number_of_commands, sequence_number, protocol_flags, reserved = struct.unpack(
-                    f'<8sBBHHBB', data[:header_len])
-
-
-
+            fdx_signature, major_version, minor_version, number_of_commands, sequence_number, byteorder = \
+                decode_fdx_header(data)
             if fdx_signature != self.fdx_signature:
                 raise ValueError("Invalid FDX signature.")
-            if protocol_flags == 1:
-                byteorder = 'big'
-            elif protocol_flags == 0:
-                byteorder = 'little'
-            else:
-                byteorder = 'big'
-            # 从头部之后开始解析命令
-            offset = header_len
-            for _ in range(number_of_commands):
-                # 检查剩余数据长度是否足够
-                if offset + 4 > len(data):
-                    raise ValueError(f"Data too short for command: {len(data) - offset} bytes")
-                command_size = int.from_bytes(data[offset:offset + 2], byteorder)
-                command_code = int.from_bytes(data[offset + 2:offset + 4], byteorder)
-                command_data = data[offset + 4:offset + command_size]
-
-                # print(f"command_size={command_size}, command_code={command_code}, command_data={command_data.hex()}")
-
-                # 调用命令处理函数
+            # TCP头部该字段为数据报长度，只有UDP使用序列号
+            if self.UDP_Or_TCP == 'UDP':
+                self.link_stats.record_sequence_number(addr, sequence_number)
+            # 从头部之后开始解析命令，调用命令处理函数
+            for command_code, command_data in iter_fdx_commands(data, number_of_commands, byteorder, header_len):
                 self.handle_command(command_code, command_data, addr, byteorder)
-                offset += command_size
 
         except Exception as e:
-            print(f"Error parsing FDX data: {e}")
+            logger.warning("Error parsing FDX data: %s", e)
 
     def handle_command(self, command_code, command_data, addr, byteorder):
         """根据命令代码调用相应的处理函数"""
+        self.link_stats.record_command(addr if addr is not None else (self.target_ip, self.target_port), command_code)
         handler = self.command_handlers.get(command_code)
         if handler:
             handler(command_data, addr, byteorder)
         else:
-            print(f"Unknown command code: {command_code}")
+            logger.warning("Unknown command code: %s", command_code)
 
     def handle_start_command(self, command_data: bytes, addr: str, byteorder: Literal["little", "big"]):
         """处理开始命令"""
@@ -280,21 +280,21 @@ class VectorFDX(object):
 
         ret['measurementstate'] = measurementstate
         ret['timestamps'] = timestamps
+        rtt_ns = self.link_stats.record_status_received(addr if addr is not None else (self.target_ip, self.target_port))
+        if rtt_ns is not None:
+            ret['round_trip_time_us'] = rtt_ns // 1000
         return ret
 
     def handle_data_exchange_command(self, command_data: bytes, addr: str, byteorder: Literal["little", "big"]):
         """处理数据交换命令"""
         ret = {'remote_addr': addr}
-        if byteorder == 'big':
-            groupid, datasize = struct.unpack(f'>HH', command_data[:4])
-            databytes = command_data[4:]
-        else:
-            groupid, datasize = struct.unpack(f'<HH', command_data[:4])
-            databytes = command_data[4:]
-
+        groupid, datasize, databytes = decode_data_exchange(command_data, byteorder)
         ret['groupid'] = groupid
         ret['datasize'] = datasize
         ret['databytes'] = databytes
+        ret['rx_timestamp_ns'] = self.rx_timestamp_ns
+        if self.group_image is not None:
+            self.group_image.update(groupid, databytes[:datasize])
         return ret
 
     def handle_data_request_command(self, command_data: bytes, addr: str, byteorder: Literal["little", "big"]):
@@ -359,6 +359,7 @@ class VectorFDX(object):
 
         ret['receivedSeqNr'] = receivedSeqNr
         ret['expectedSeqNr'] = expectedSeqNr
+        self.link_stats.record_sequence_number_error(addr if addr is not None else (self.target_ip, self.target_port))
         return ret
 
     def handle_function_call(self, command_data: bytes, addr: str, byteorder: Literal["little", "big"]):
@@ -438,10 +439,7 @@ class VectorFDX(object):
 
     def _create_command(self, command_code: int, command_data: bytes = b""):
         """创建 FDX 命令"""
-        command_size = 4 + len(command_data)
-        command = command_size.to_bytes(2, self.fdx_byte_order) + command_code.to_bytes(2,
-                                                                                        self.fdx_byte_order) + command_data
-        return command
+        return encode_fdx_command(command_code, command_data, self.fdx_byte_order)
 
     def start_command(self, is_add_command: bool = False):
         """创建并添加开始命令"""
@@ -494,11 +492,11 @@ class VectorFDX(object):
         # print(f"datarequest_command: {self.fdx_data.hex(' ').upper()}")
 
     def data_exchange_command(self, group_id: int, data_bytes: bytes, is_add_command: bool = False):
-        """创建并添加数据交换命令"""
+        """创建并添加数据交换命令，data_bytes为memoryview时在本方法中拷贝到数据报"""
         if not isinstance(group_id, int):
             raise TypeError("group_id must be an integer")
-        if not isinstance(data_bytes, bytes):
-            raise TypeError("data_bytes must be bytes")
+        if not isinstance(data_bytes, (bytes, memoryview)):
+            raise TypeError("data_bytes must be bytes or memoryview")
         data_size = len(data_bytes)
         if data_size > self.max_len - 16:
             raise ValueError(f"Data size {data_size} exceeds maximum allowed {self.max_len - 16}")
@@ -569,6 +567,7 @@ class VectorFDX(object):
     def status_request_command(self, is_add_command: bool = False):
         """创建并添加状态请求命令"""
         command = self._create_command(self.COMMAND_CODE_STATUS_REQUEST)
+        self.link_stats.record_status_request_sent()
         if is_add_command:
             self._add_command(command)
         else:
@@ -583,7 +582,7 @@ class VectorFDX(object):
             return
         # print(f"send:{self.fdx_data.hex(' ')}")
         if not self.fdx_data:
-            print("No FDX data to send.")
+            logger.warning("No FDX data to send.")
             return
         if self.UDP_Or_TCP == 'UDP':
             target_address = (self.target_ip, self.target_port)
@@ -591,18 +590,26 @@ class VectorFDX(object):
                 if not self.socket:
                     self.create_udp_socket()
                 self.socket.sendto(self.fdx_data, target_address)
+                self.link_stats.record_sent(target_address, len(self.fdx_data))
                 # print(f"Sent {len(self.fdx_data)} bytes of FDX data to {target_address}")
                 self.fdx_data = b''  # 发送后清空数据
             except Exception as e:
-                print(f"Error sending UDP data: {e}")
+                logger.error("Error sending FDX data: %s", e)
         else:
             try:
                 if not self.socket:
                     self.create_socket()
                 self.socket.sendall(self.fdx_data)
+                self.link_stats.record_sent((self.target_ip, self.target_port), len(self.fdx_data))
                 self.fdx_data = b''  # 发送后清空数据
             except Exception as e:
-                print(f"Error sending UDP data: {e}")
+                logger.error("Error sending FDX data: %s", e)
+
+    def get_link_stats(self):
+        """FDX链路统计快照: 收发数据报/字节数、丢包/乱序/重复数、各命令计数、状态请求往返时间及接收线程唤醒延迟"""
+        stats = self.link_stats.get_stats()
+        stats['receive_lateness'] = self.receive_lateness.snapshot()
+        return stats
 
     def close_socket(self):
         """关闭 UDP 套接字"""
@@ -616,7 +623,7 @@ class VectorFDX(object):
                     pass  # 如果连接已经关闭，忽略错误
             self.socket.close()
             self.socket = None
-            print("UDP socket closed.")
+            logger.info("UDP socket closed.")
 
 
 if __name__ == '__main__':
@@ -1,18 +1,30 @@
 import json
-import struct
+import os
 import sys
+import time
 from typing import Literal
 
-import serial.tools.list_ports
-
-from PyQt5.QtCore import QCoreApplication, Qt, pyqtSignal, QObject
+from PyQt5.QtCore import QCoreApplication, Qt, pyqtSignal, QObject, QTimer
 from PyQt5.QtGui import QTextCursor
 from PyQt5.QtWidgets import QMainWindow, QApplication, QMessageBox
 
+from ConfigWatcher import ConfigWatcher, FdxGroupKeys, SerialConfigKeys, StartupConfigKeys, validate_config
+from FdxCodec import encode_read_registers_batch_response
+from FdxDispatcher import FdxCommandDispatcher
+from LatencyTracer import LatencyTracer
+from LogUtils import get_logger, setup_logging, stop_logging
+from MetricsServer import MetricsServer, fdx_metrics, latency_metrics, modbus_metrics
+from Profiler import CommandProfiler
+from RegisterRecorder import RegisterRecorder
+from RegisterRing import RegisterRing
+from ScpiPoller import ScpiInstrumentManager, encode_measurement
+from SharedMemoryImage import SharedImagePublisher
 from VectorFDX import VectorFDX
-from ModbusClient import SerialModbusRTUClient
+from ModbusClient import SerialModbusRTUClient, is_queue_full
 from VectoeFDX_UI import Ui_MainWindow
 
+logger = get_logger(__name__)
+
 
 class QVectorFDX(VectorFDX, QObject):
     write_register_signal = pyqtSignal(object)
@@ -31,34 +43,39 @@ class QVectorFDX(VectorFDX, QObject):
 
 
 class QSerialModbusRTUClient(SerialModbusRTUClient, QObject):
-    read_holding_registers_response_data = pyqtSignal(dict)
-    def __init__(self, *args, **kwargs):
+    """读取结果写入register_ring，环由空变为非空时发出read_holding_registers_ready，主线程取空环后发送到FDX"""
+    read_holding_registers_ready = pyqtSignal()
+    read_holding_registers_batch_response_data = pyqtSignal(dict)
+    def __init__(self, *args, register_ring_slots: int = 256, register_ring_overwrite_oldest: bool = False,
+                 **kwargs):
         SerialModbusRTUClient.__init__(self, *args, **kwargs)
         QObject.__init__(self)
+        self.register_ring = RegisterRing(register_ring_slots, self.MaxReadRegistersCount,
+                                          overwrite_oldest=register_ring_overwrite_oldest)
+        self.is_register_ring_notified = False  # 已通知主线程且主线程尚未开始取环
 
     def handler_read_holding_registers_response(self, slave, response):
+        super().handler_read_holding_registers_response(slave, response)
+        try:
+            self.register_ring.put(slave, response.registers, time.perf_counter_ns())
+        except ValueError as e:
+            logger.error('register ring put error:%s', e)
+            return
+        if not self.is_register_ring_notified:
+            self.is_register_ring_notified = True
+            self.read_holding_registers_ready.emit()
+
+    def handler_read_holding_registers_batch_response(self, batch_id, results):
         try:
-            self.read_holding_registers_response_data.emit({'slave':slave,'data': response.registers})
+            self.read_holding_registers_batch_response_data.emit({'batch_id': batch_id, 'results': results,
+                                                                  'rx_timestamp_ns': time.perf_counter_ns()})
         except Exception as e:
-            print(f'read_holding_registers_response_data emit error:{e}')
+            logger.error('read_holding_registers_batch_response_data emit error:%s', e)
 
 
-
-def list_to_bytes_struct_direct(input_list,byte_oder):
-    output_bytes = b""
-    for item in input_list:
-        if isinstance(item, int):
-            if item > 0xFFFF:
-                raise ValueError("Integer value too large to represent as 2 bytes")
-            if byte_oder == 'big':
-                output_bytes += struct.pack(">H", item) # 大端字节序
-            else:
-                output_bytes += struct.pack("<H", item)  # 小端字节序
-        else:
-            raise ValueError("List item must be an integer")
-    return output_bytes
-
 class MainWindows(QMainWindow, Ui_MainWindow):
+    scpi_measurement_signal = pyqtSignal(object)
+    config_changed_signal = pyqtSignal(object)
     def __init__(self):
         super().__init__()
         self.setupUi(self)
@@ -72,10 +89,11 @@ class MainWindows(QMainWindow, Ui_MainWindow):
 
         self.slaves_lists = {}
         self.cycle_read_slaves_list = []
-        self.last_write_register_by_fdx_command = {'slave': None, 'address': None, 'value': None}
-        self.write_register_command_fdx_group_id = None
-        self.last_write_registers_by_fdx_command = {'slave': None, 'address': None, 'register_num': None, 'values': None}
-        self.write_registers_command_fdx_group_id = None
+        # FDX命令数据组的分发和发送方式请求与无界面桥接共用，按需请求由主线程的定时器发送
+        self.fdx_data_request_timer = QTimer()
+        self.scpi_manager = ScpiInstrumentManager()
+        self.fdx_dispatcher = FdxCommandDispatcher(self.fdx, {}, scpi_manager=self.scpi_manager,
+                                                   data_request_timer=self.fdx_data_request_timer)
         self.serial_baud_rate = 115200
         self.serial_bytesize = 8
         self.serial_parity = "N"
@@ -83,8 +101,31 @@ class MainWindows(QMainWindow, Ui_MainWindow):
         self.serial_timeout = 1
         self.serial_retries = 0
         self.port = 'com6'
+        self.modbus_stats_dump_file = None
+        self.modbus_stats_dump_interval = 10
+        self.profile_trace_file = None
+        self.profiler = None
+        self.metrics_http_port = None
+        self.metrics_server = None
+        self.register_recorder_dir = None
+        self.shared_memory_name_prefix = None
+        self.shared_memory_fdx_groups = {}
+        self.shared_image_publishers = {}  # {'registers'/'groups': SharedImagePublisher}
+        self.retired_shared_image_publishers = []  # 重新加载配置时被替换的发布方，关闭窗口时释放映射
+        self.latency_trace_enabled = False
+        self.latency_trace_outlier_ms = None  # 未配置时使用fdx_latency_budget_ms
+        self.latency_tracer = None
+        # 总线线程到主线程的寄存器读取结果环，环满时丢弃新结果或覆盖最旧结果
+        self.modbus_register_ring_slots = 256
+        self.modbus_register_ring_overwrite_oldest = False
+        # 各工作线程的CPU亲和性和调度策略 {'fdx_receive': {...}, 'modbus_bus': {...}}
+        self.thread_scheduling = {}
         self.ports_list=[]
-        self._load_modbus_config('./Config/config.json')
+        self.config_file = './Config/config.json'
+        self.config = {}
+        self.config_watch_interval_ms = None  # 检查配置文件修改的周期，None表示不自动重新加载
+        self.config_watcher = None
+        self._load_modbus_config(self.config_file)
         self.get_available_ports()
         try:
             self.port = self.ports_list[0]
@@ -98,14 +139,47 @@ class MainWindows(QMainWindow, Ui_MainWindow):
                                                     serial_parity=self.serial_parity,
                                                     serial_stop_bits=self.serial_stop_bits,
                                                     serial_timeout=self.serial_timeout,
-                                                    serial_retries=self.serial_retries)
+                                                    serial_retries=self.serial_retries,
+                                                    register_ring_slots=self.modbus_register_ring_slots,
+                                                    register_ring_overwrite_oldest=
+                                                    self.modbus_register_ring_overwrite_oldest)
 
         self.modbus_client.slaves_list=self.slaves_lists
+        self.fdx_dispatcher.modbus_client = self.modbus_client
         self.modbus_client.cycle_read_slaves_list=self.cycle_read_slaves_list
+        self.fdx.receive_thread_scheduling = self.thread_scheduling.get('fdx_receive')
+        self.modbus_client.bus_thread_scheduling = self.thread_scheduling.get('modbus_bus')
+
+        # 配置了trace文件时统计各命令处理耗时，关闭窗口时导出
+        if self.profile_trace_file:
+            self.profiler = CommandProfiler()
+            self.profiler.install_fdx(self.fdx)
+            self.profiler.install_modbus(self.modbus_client)
+
+        # 跟踪FDX写命令到Modbus应答、Modbus读应答到FDX发送的端到端延迟
+        if self.latency_trace_enabled:
+            outlier_ms = self.latency_trace_outlier_ms or self.fdx_dispatcher.fdx_latency_budget_ms
+            self.latency_tracer = LatencyTracer(outlier_threshold_us=int(outlier_ms * 1000))
+            self.modbus_client.latency_tracer = self.latency_tracer
+
+        if self.metrics_http_port:
+            self.start_metrics_server()
+
+        if self.shared_memory_name_prefix:
+            self.publish_shared_images()
 
         self.connect_ui_signals()
         self.connect_fdx_client_signals()
         self.connect_modbus_client_signals()
+        self.scpi_measurement_signal.connect(self.scpi_measurement_to_fdx)
+        self.start_scpi_pollers()
+        self.config_changed_signal.connect(self.apply_reloaded_config)
+        if self.config_watch_interval_ms:
+            self.config_watcher = ConfigWatcher(self.config_file,
+                                                lambda config, changed_keys: self.config_changed_signal.emit(
+                                                    (config, changed_keys)),
+                                                self.config_watch_interval_ms / 1000, self.config)
+            self.config_watcher.start()
         self.ui_setdisabled_FDX(True)
         self.ui_setdisabled_Serial(True)
         self.is_show_canoe_status = False
@@ -114,24 +188,191 @@ class MainWindows(QMainWindow, Ui_MainWindow):
         try:
             with open(config_file, 'r') as f:
                 config = json.load(f)
-                lists = config.get("slaves_list", {})
-                self.slaves_lists = {int(k): v for k, v in lists.items()}
-                self.cycle_read_slaves_list = config.get("cycle_read_slaves_list", [])
-                self.serial_baud_rate = config.get("serial_baud_rate", self.serial_baud_rate)
-                self.serial_bytesize = config.get("serial_bytesize", self.serial_bytesize)
-                self.serial_parity = config.get("serial_parity", self.serial_parity)
-                self.serial_stop_bits = config.get("serial_stop_bits", self.serial_stop_bits)
-                self.serial_timeout = config.get("serial_timeout", self.serial_timeout)
-                self.serial_retries = config.get("serial_retries", self.serial_retries)
-
-                self.write_register_command_fdx_group_id = config.get("write_register_command_fdx_group_id", None)
-                self.write_registers_command_fdx_group_id = config.get("write_registers_command_fdx_group_id", None)
+            errors = validate_config(config)
+            if errors:
+                # 与重新加载时相同的校验，不通过时使用默认值；仍按配置监视文件，修正后自动加载
+                logger.error("Config %s rejected: %s. Using default values.", config_file, '; '.join(errors))
+            else:
+                self._apply_config(config)
+            if isinstance(config, dict):
+                self.config_watch_interval_ms = config.get("config_watch_interval_ms", self.config_watch_interval_ms)
         except FileNotFoundError:
-            print(f"Error: Config file '{config_file}' not found. Using default values.")
+            logger.error("Error: Config file '%s' not found. Using default values.", config_file)
         except json.JSONDecodeError:
-            print(f"Error: Invalid JSON format in '{config_file}'. Using default values.")
+            logger.error("Error: Invalid JSON format in '%s'. Using default values.", config_file)
+
+    def _apply_config(self, config):
+        self.config = config
+        lists = config.get("slaves_list", {})
+        self.slaves_lists = {int(k): v for k, v in lists.items()}
+        self.cycle_read_slaves_list = config.get("cycle_read_slaves_list", [])
+        self.serial_baud_rate = config.get("serial_baud_rate", self.serial_baud_rate)
+        self.serial_bytesize = config.get("serial_bytesize", self.serial_bytesize)
+        self.serial_parity = config.get("serial_parity", self.serial_parity)
+        self.serial_stop_bits = config.get("serial_stop_bits", self.serial_stop_bits)
+        self.serial_timeout = config.get("serial_timeout", self.serial_timeout)
+        self.serial_retries = config.get("serial_retries", self.serial_retries)
+        self.modbus_stats_dump_file = config.get("modbus_stats_dump_file", self.modbus_stats_dump_file)
+        self.modbus_stats_dump_interval = config.get("modbus_stats_dump_interval", self.modbus_stats_dump_interval)
+        self.profile_trace_file = config.get("profile_trace_file", self.profile_trace_file)
+        self.metrics_http_port = config.get("metrics_http_port", self.metrics_http_port)
+        self.register_recorder_dir = config.get("register_recorder_dir", self.register_recorder_dir)
+        self.shared_memory_name_prefix = config.get("shared_memory_name_prefix", self.shared_memory_name_prefix)
+        self.latency_trace_enabled = config.get("latency_trace_enabled", self.latency_trace_enabled)
+        self.latency_trace_outlier_ms = config.get("latency_trace_outlier_ms", self.latency_trace_outlier_ms)
+        self.thread_scheduling = config.get("thread_scheduling", self.thread_scheduling)
+        self.modbus_register_ring_slots = config.get("modbus_register_ring_slots", self.modbus_register_ring_slots)
+        self.modbus_register_ring_overwrite_oldest = config.get("modbus_register_ring_overwrite_oldest",
+                                                                self.modbus_register_ring_overwrite_oldest)
+        fdx_groups = config.get("shared_memory_fdx_groups", {})
+        self.shared_memory_fdx_groups = {int(k): v for k, v in fdx_groups.items()}
+        self.fdx_dispatcher.apply_config(config)
+
+    def apply_reloaded_config(self, reloaded):
+        """在主线程中应用ConfigWatcher校验通过的新配置，串口和FDX连接保持不变
+
+        轮询集合和寄存器映像由update_poll_set()一次替换，命令数据组变化时重新请求发送方式，
+        串口参数在下次连接时生效，只在启动时读取的配置需重启
+        """
+        config, changed_keys = reloaded
+        is_fdx_connected = self.pushButton_fdxConnect.text() == 'Connected'
+        is_transmission_changed = bool(changed_keys & (set(FdxGroupKeys) | {'fdx_free_running', 'fdx_latency_budget_ms'}))
+        if is_fdx_connected and is_transmission_changed:
+            self.fdx_dispatcher.cancel_fdx_groups_transmission()
+        # 只在启动时读取的配置保持当前值
+        config = dict(config)
+        for key in StartupConfigKeys:
+            if key in self.config:
+                config[key] = self.config[key]
+            else:
+                config.pop(key, None)
+        self._apply_config(config)
+
+        if changed_keys & {'slaves_list', 'cycle_read_slaves_list'}:
+            register_image = None
+            publisher = self.shared_image_publishers.get('registers')
+            if publisher is not None and publisher.image.entries != self.slaves_lists:
+                register_image = self.replace_shared_image('registers', self.slaves_lists, 'H')
+            self.modbus_client.update_poll_set(self.slaves_lists, self.cycle_read_slaves_list, register_image)
+            if 'slaves_list' in changed_keys:
+                self.restart_register_recorder()
+        publisher = self.shared_image_publishers.get('groups')
+        if publisher is not None and publisher.image.entries != self.shared_memory_fdx_groups:
+            group_image = self.replace_shared_image('groups', self.shared_memory_fdx_groups, 'B')
+            if group_image is not None:
+                group_image.copy_from(publisher.image)
+                self.fdx.group_image = group_image
+        if changed_keys & set(FdxGroupKeys):
+            self.fdx_dispatcher.reset_command_state()
+        if is_fdx_connected and is_transmission_changed:
+            self.fdx_dispatcher.request_fdx_groups_transmission()
+
+        self.modbus_client.serial_baud_rate = self.serial_baud_rate
+        self.modbus_client.serial_bytesize = self.serial_bytesize
+        self.modbus_client.serial_parity = self.serial_parity
+        self.modbus_client.serial_stop_bits = self.serial_stop_bits
+        self.modbus_client.serial_timeout = self.serial_timeout
+        self.modbus_client.retries = self.serial_retries
+        pending_keys = changed_keys & (set(SerialConfigKeys) | set(StartupConfigKeys))
+        if pending_keys:
+            self.print_info(f"* 配置{', '.join(sorted(pending_keys))}需重新连接或重启后生效\n")
+        self.print_info(f"* 已重新加载配置: {', '.join(sorted(changed_keys - pending_keys))}\n")
+
+    def start_metrics_server(self):
+        self.metrics_server = MetricsServer(port=self.metrics_http_port)
+        self.metrics_server.add_collector(lambda: fdx_metrics(self.fdx))
+        self.metrics_server.add_collector(lambda: modbus_metrics(self.modbus_client))
+        self.metrics_server.add_collector(self.bridge_metrics)
+        if self.latency_tracer is not None:
+            self.metrics_server.add_collector(lambda: latency_metrics(self.latency_tracer))
+        try:
+            self.metrics_server.start()
+        except OSError as e:
+            logger.error('start metrics server error:%s', e)
+            self.metrics_server = None
+
+    def publish_shared_images(self):
+        """寄存器映像和FDX数据组映像发布到共享内存<prefix>_registers和<prefix>_groups，供本机其他进程读取"""
+        try:
+            publisher = SharedImagePublisher(f"{self.shared_memory_name_prefix}_registers", self.slaves_lists, 'H')
+            self.shared_image_publishers['registers'] = publisher
+            self.modbus_client.register_image = publisher.image
+            if self.shared_memory_fdx_groups:
+                publisher = SharedImagePublisher(f"{self.shared_memory_name_prefix}_groups",
+                                                 self.shared_memory_fdx_groups, 'B')
+                self.shared_image_publishers['groups'] = publisher
+                self.fdx.group_image = publisher.image
+        except OSError as e:
+            logger.error('publish shared memory error:%s', e)
+
+    def close_shared_images(self):
+        self.modbus_client.register_image = None
+        self.fdx.group_image = None
+        for publisher in self.shared_image_publishers.values():
+            publisher.close()
+        self.shared_image_publishers = {}
+        for publisher in self.retired_shared_image_publishers:
+            publisher.close(unlink=False)
+        self.retired_shared_image_publishers = []
+
+    def replace_shared_image(self, role, entries, typecode):
+        """按新的条目重建同名共享内存映像，返回新映像
+
+        旧映像仍可能被写入线程引用，只在关闭窗口时释放映射；已附加的读取方需重新附加才能看到新映像
+        """
+        old_publisher = self.shared_image_publishers[role]
+        old_publisher.unlink()
+        try:
+            publisher = SharedImagePublisher(old_publisher.name, entries, typecode)
+        except OSError as e:
+            logger.error('republish shared memory %s error:%s', old_publisher.name, e)
+            return None
+        self.shared_image_publishers[role] = publisher
+        self.retired_shared_image_publishers.append(old_publisher)
+        logger.info("Shared memory %s republished, readers must attach again", publisher.name)
+        return publisher.image
+
+    def start_scpi_pollers(self):
+        """打开配置的SCPI仪器，每台仪器一个工作线程，测量结果通过scpi_measurement_signal回到主线程发送"""
+        self.scpi_manager.on_measurement = lambda *args: self.scpi_measurement_signal.emit(args)
+        for instrument_config in self.fdx_dispatcher.scpi_instruments_config:
+            name = instrument_config.get('name', instrument_config['resource'])
+            resource_kwargs = {key: instrument_config[key] for key in ('baud_rate',) if key in instrument_config}
+            try:
+                self.scpi_manager.open_instrument(name, instrument_config['resource'],
+                                                  instrument_config.get('visa_backend', '@py'),
+                                                  instrument_config.get('timeout_ms', 2000),
+                                                  instrument_config.get('poll_interval_ms', 200) / 1000,
+                                                  instrument_config.get('measurement_max_age_ms', 0) / 1000,
+                                                  **resource_kwargs)
+            except Exception as e:
+                logger.error('open SCPI instrument %s error:%s', name, e)
+
+    def stop_scpi_pollers(self):
+        self.scpi_manager.stop()
+
+    def scpi_measurement_to_fdx(self, measurement):
+        name, values, _ = measurement
+        group_id = self.fdx_dispatcher.get_scpi_instrument_config(name).get('measurement_fdx_group_id')
+        if group_id is None or self.fdx.socket is None:
+            return
+        self.fdx.data_exchange_command(group_id, encode_measurement(*values, byteorder='big'))
+        self.fdx.send_fdx_data()
+
+    def bridge_metrics(self):
+        ring_stats = self.modbus_client.register_ring.get_stats()
+        return [('bridge_fdx_writes_coalesced_total', 'counter',
+                 'FDX write commands skipped because they repeat the last write', {},
+                 self.fdx_dispatcher.fdx_coalesced_writes),
+                ('bridge_register_ring_used', 'gauge', 'Modbus read results waiting to be sent to FDX', {},
+                 ring_stats['used']),
+                ('bridge_register_ring_dropped_total', 'counter',
+                 'Modbus read results dropped because the register ring was full', {}, ring_stats['dropped']),
+                ('bridge_register_ring_overwritten_total', 'counter',
+                 'Unsent Modbus read results overwritten by newer results', {}, ring_stats['overwritten'])]
 
     def get_available_ports(self):
+        import serial.tools.list_ports
         self.ports_list = [port.device for port in serial.tools.list_ports.comports()]
         self.comboBox_serialPorts.clear()
         for port in self.ports_list:
@@ -174,70 +415,20 @@ class MainWindows(QMainWindow, Ui_MainWindow):
         self.pushButton_UpdatePorts.clicked.connect(self.get_available_ports)
         self.comboBox_serialPorts.currentIndexChanged.connect(self.on_port_selected)
         self.comboBox_TCPORUDP.currentIndexChanged.connect(self.on_TCPORUDP_selected)
+        self.fdx_data_request_timer.timeout.connect(self.fdx_dispatcher.send_data_requests)
 
 
     def write_modbus_register_by_ui(self):
         slave=int(self.lineEdit_WriteSlave.text())
         address=int(self.lineEdit_WriteRegisterAddress.text())
         value=int(self.lineEdit_WriteRegisterValue.text())
-        self.modbus_client.add_write_register_queue(address=address,value=value,slave=slave)
-
-    def write_register_by_fdx_command(self, params):
-        group_id=params[0]['groupid']
-        datasize=params[0]['datasize']
-        if self.write_register_command_fdx_group_id is not None and group_id == self.write_register_command_fdx_group_id:
-            if params[1] == 'big':
-                slave, address, value = struct.unpack(f'>HHH', params[0]['databytes'][:datasize])
-            else:
-                slave, address, value = struct.unpack(f'<HHH', params[0]['databytes'][:datasize])
-            if self.last_write_register_by_fdx_command['slave'] == slave and \
-                    self.last_write_register_by_fdx_command['address'] == address and \
-                    self.last_write_register_by_fdx_command['value'] == value:
-                pass
-            else:
-                self.modbus_client.add_write_register_queue(address=address, value=value, slave=slave)
-                self.last_write_register_by_fdx_command['slave'] = slave
-                self.last_write_register_by_fdx_command['address'] = address
-                self.last_write_register_by_fdx_command['value'] = value
-
-    def write_registers_by_fdx_command(self, params):
-        group_id=params[0]['groupid']
-        datasize=params[0]['datasize']
-
-        if self.write_registers_command_fdx_group_id is not None and group_id == self.write_registers_command_fdx_group_id:
-            if params[1] == 'big':
-                slave, address, register_num = struct.unpack(f'>HHH', params[0]['databytes'][:6])
-                if datasize < register_num*2+6:
-                    return
-                data = params[0]['databytes'][6:register_num*2+6]
-                values = struct.unpack(f'>{register_num}H', data)
-                values = list(values)
-
-            else:
-                slave, address, register_num = struct.unpack(f'<HHH', params[0]['databytes'][:6])
-                if datasize < register_num*2+6:
-                    return
-                data = params[0]['databytes'][6:register_num * 2 + 6]
-                values = struct.unpack(f'<{register_num}H', data)
-                values = list(values)
-
-
-            if self.last_write_registers_by_fdx_command['slave'] == slave and \
-                    self.last_write_registers_by_fdx_command['address'] == address and \
-                    self.last_write_registers_by_fdx_command['register_num'] == register_num and \
-                    self.last_write_registers_by_fdx_command['values'] == values:
-                pass
-            else:
-                self.modbus_client.add_write_registers_queue(address=address, values=values, slave=slave)
-                self.last_write_registers_by_fdx_command['slave'] = slave
-                self.last_write_registers_by_fdx_command['address'] = address
-                self.last_write_registers_by_fdx_command['register_num'] = register_num
-                self.last_write_registers_by_fdx_command['values'] = values
-
-
-
-
+        future = self.modbus_client.add_write_register_queue(address=address, value=value, slave=slave, block=False)
+        if is_queue_full(future):
+            self.print_info(f"* Modbus请求队列已满，写入未执行\n")
 
+    def fdx_command_by_signal(self, params):
+        """write_register_signal的槽，params为[DataExchange解析结果, byteorder]"""
+        self.fdx_dispatcher.handle_fdx_command(params[0], params[1])
 
     def start_stop_read_modbus_cycle(self,checked):
         if checked:
@@ -254,6 +445,10 @@ class MainWindows(QMainWindow, Ui_MainWindow):
         if self.modbus_client.modbus_client == None:
             if self.modbus_client.create_modbus_rtu_service():
                 self.print_info(f"* {self.modbus_client.port}连接成功\n")
+                if self.modbus_stats_dump_file:
+                    self.modbus_client.start_stats_dump(self.modbus_stats_dump_file, self.modbus_stats_dump_interval)
+                if self.register_recorder_dir:
+                    self.start_register_recorder()
                 self.ui_setdisabled_Serial(False)
                 self.pushButton_connectmodbus.setText("Connected")
             else:
@@ -265,17 +460,52 @@ class MainWindows(QMainWindow, Ui_MainWindow):
     def close_modbus_client(self):
         if self.modbus_client.modbus_client is not None and self.modbus_client.is_connected:
             self.modbus_client.stop_cycle_read__loop()
+            self.modbus_client.stop_stats_dump()
             self.modbus_client.modbus_rtu_service_close()
+            self.stop_register_recorder()
             self.print_info(f"* 串口关闭成功\n")
             self.ui_setdisabled_Serial(True)
             self.pushButton_connectmodbus.setText("Connect")
 
+    def start_register_recorder(self):
+        """每次连接记录到register_recorder_dir下以时间命名的子目录"""
+        session_dir = os.path.join(self.register_recorder_dir, time.strftime('%Y%m%d_%H%M%S'))
+        suffix = 1
+        while os.path.exists(session_dir):
+            session_dir = os.path.join(self.register_recorder_dir, f"{time.strftime('%Y%m%d_%H%M%S')}_{suffix}")
+            suffix += 1
+        try:
+            recorder = RegisterRecorder(session_dir, self.modbus_client.slaves_list)
+            recorder.start()
+        except (ImportError, OSError) as e:
+            logger.error('start register recorder error:%s', e)
+            return
+        self.modbus_client.register_recorder = recorder
+        self.print_info(f"* 寄存器记录保存至{session_dir}\n")
+
+    def restart_register_recorder(self):
+        """slaves_list变化后按新的从站和寄存器数量记录到新的子目录，旧记录器写出已有数据后停止"""
+        old_recorder = self.modbus_client.register_recorder
+        if old_recorder is None:
+            return
+        self.start_register_recorder()
+        if self.modbus_client.register_recorder is old_recorder:
+            # 新记录器创建失败，旧记录器的从站和寄存器数量已与轮询不符
+            self.modbus_client.register_recorder = None
+        old_recorder.stop()
+
+    def stop_register_recorder(self):
+        recorder = self.modbus_client.register_recorder
+        if recorder is not None:
+            self.modbus_client.register_recorder = None
+            recorder.stop()
+
     def connect_modbus_client_signals(self):
-        self.modbus_client.read_holding_registers_response_data.connect(self.modbus_registers_to_fdx)
+        self.modbus_client.read_holding_registers_ready.connect(self.modbus_registers_to_fdx)
+        self.modbus_client.read_holding_registers_batch_response_data.connect(self.modbus_batch_registers_to_fdx)
 
     def connect_fdx_client_signals(self):
-        self.fdx.write_register_signal.connect(self.write_register_by_fdx_command)
-        self.fdx.write_register_signal.connect(self.write_registers_by_fdx_command)
+        self.fdx.write_register_signal.connect(self.fdx_command_by_signal)
         self.fdx.canoe_status.connect(self.canoe_status_ui)
 
     def canoe_status_ui(self, status):
@@ -284,9 +514,36 @@ class MainWindows(QMainWindow, Ui_MainWindow):
             MeasurementState=['NotRunning','PreStart','Running','Stop']
             QMessageBox.information(QApplication.activeWindow(), "INFO", f"CANoe is {MeasurementState[status['measurementstate']-1]}\ntimestamps:{status['timestamps']}")
 
-    def modbus_registers_to_fdx(self, data):
-        self.fdx.data_exchange_command(data['slave'], list_to_bytes_struct_direct(data['data'], 'big'))
+    def modbus_batch_registers_to_fdx(self, data):
+        """批量读取结果: request_id, request_num, request_num*(slave, address, count, status, values)"""
+        response = encode_read_registers_batch_response(data['batch_id'], data['results'])
+        try:
+            self.fdx.data_exchange_command(self.fdx_dispatcher.read_registers_response_fdx_group_id, response)
+        except ValueError as e:
+            logger.error('read registers batch response error:%s', e)
+            return
         self.fdx.send_fdx_data()
+        if self.latency_tracer is not None:
+            self.latency_tracer.record(LatencyTracer.PathModbusToFdx, data['rx_timestamp_ns'],
+                                       label=f"batch {data['batch_id']}")
+
+    def modbus_registers_to_fdx(self):
+        """取空寄存器环，每条读取结果发送一个FDX数据报
+
+        寄存器数据从环的槽直接拷贝到数据报，拷贝后槽已被覆盖(overwrite_oldest)的结果不发送
+        """
+        register_ring = self.modbus_client.register_ring
+        # 先清除通知标志再取环，取环期间写入的结果会再次通知
+        self.modbus_client.is_register_ring_notified = False
+        result = register_ring.peek()
+        while result is not None:
+            slave, data, rx_timestamp_ns = result
+            self.fdx.data_exchange_command(slave, data)
+            if register_ring.advance():
+                self.fdx.send_fdx_data()
+                if self.latency_tracer is not None:
+                    self.latency_tracer.record(LatencyTracer.PathModbusToFdx, rx_timestamp_ns, label=f"slave {slave}")
+            result = register_ring.peek()
 
 
     def start_canoe_command(self):
@@ -307,22 +564,11 @@ class MainWindows(QMainWindow, Ui_MainWindow):
         if self.pushButton_fdxConnect.text() == 'Connect':
             self.connect_fdx()
             self.ui_setdisabled_FDX(False)
-            self.fdx.free_running_request_command(self.write_register_command_fdx_group_id,
-                                                  self.fdx.FreeRunningFlag_TransmitCyclic,
-                                                  5*1000*1000,
-                                                  5*1000*1000)
-            self.fdx.free_running_request_command(self.write_registers_command_fdx_group_id,
-                                                  self.fdx.FreeRunningFlag_TransmitCyclic,
-                                                  5 * 1000 * 1000,
-                                                  5 * 1000 * 1000,
-                                                  is_add_command=True)
-            self.fdx.send_fdx_data()
+            self.fdx_dispatcher.request_fdx_groups_transmission()
         elif self.pushButton_fdxConnect.text() == 'Connected':
+            self.fdx_dispatcher.cancel_fdx_groups_transmission()
             self.disconnect_fdx()
             self.ui_setdisabled_FDX(True)
-            self.fdx.free_running_cancel_command(self.write_register_command_fdx_group_id)
-            self.fdx.free_running_cancel_command(self.write_registers_command_fdx_group_id,is_add_command=True)
-            self.fdx.send_fdx_data()
 
 
 
@@ -360,8 +606,22 @@ class MainWindows(QMainWindow, Ui_MainWindow):
         self.pushButton_fdxConnect.setText('Connect')
 
     def closeEvent(self, event):
+        if self.config_watcher is not None:
+            self.config_watcher.stop()
+        self.stop_scpi_pollers()
         self.disconnect_fdx()
         self.close_modbus_client()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        self.close_shared_images()
+        logger.info("Register ring stats: %s", self.modbus_client.register_ring.get_stats())
+        if self.latency_tracer is not None:
+            logger.info("End-to-end latency:\n%s", self.latency_tracer.report())
+        if self.profiler is not None:
+            try:
+                self.profiler.export_chrome_trace(self.profile_trace_file)
+            except OSError as e:
+                logger.error('export trace error:%s', e)
 
         event.accept()  # 允许关闭窗口
 
@@ -374,6 +634,7 @@ class MainWindows(QMainWindow, Ui_MainWindow):
 
 if __name__ == "__main__":
     QCoreApplication.setAttribute(Qt.AA_EnableHighDpiScaling)
+    setup_logging()
     app = QApplication(sys.argv)
     app.setStyle("WindowsVista")
     w = MainWindows()
@@ -381,4 +642,7 @@ if __name__ == "__main__":
     w.setWindowTitle("CANoe tool " + current_version)
 
     w.show()
-    sys.exit(app.exec_())
+    exit_code = app.exec_()
+    # 日志监听线程为守护线程，退出前写出closeEvent中记录的统计
+    stop_logging()
+    sys.exit(exit_code)